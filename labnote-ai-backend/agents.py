@@ -1,15 +1,19 @@
 import os
-import re
 import logging
 import asyncio
-from typing import List, Dict, TypedDict, Annotated, Tuple
+import threading
+from contextlib import aclosing
+from typing import List, Dict, TypedDict, Annotated, Tuple, Optional, AsyncIterator
 
 from langgraph.graph import StateGraph, END
 from langgraph.graph.message import add_messages
 
 # Local imports
-from rag_pipeline import rag_pipeline
-from llm_utils import call_llm_api
+from rag_pipeline import aget_rag_pipeline
+from context_packer import get_context_budget, pack_context
+from llm_scheduler import PRIORITY_BATCH, llm_priority
+from labnote_parser import LabNote, UOBlock, get_section_content, parse_uo_block
+from llm_utils import call_llm_api, stream_llm_api, get_model_timeout, _post_process_content
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -23,33 +27,78 @@ class AgentState(TypedDict):
     uo_name: str
     section_to_populate: str
     options: Dict[str, List[str]]
+    fanout_policy: Dict
+    generation_report: Dict
+    bypass_cache: bool
+    shared_context: Optional[list]  # 워크플로우 일괄 생성 시 UO 단위로 한 번 검색해 공유하는 SOP 청크
     messages: Annotated[list, add_messages]
 
-# --- Helper function for content generation ---
-def _extract_section_content(uo_block: str, section_name: str) -> str:
-    """Helper to extract content of a specific section from a UO block."""
-    pattern = re.compile(r"#### " + re.escape(section_name) + r"\n(.*?)(?=\n####|\n------------------------------------------------------------------------)", re.DOTALL)
-    match = pattern.search(uo_block)
-    if match:
-        content = match.group(1).strip()
-        return content if content and not content.startswith('(') else "(not specified)"
-    return "(not specified)"
-
-async def _generate_options(query: str, uo_id: str, uo_name: str, section: str, uo_block: str) -> Tuple[List[str], str]:
-    """
-    RAG 검색 결과에 따라 동적으로 프롬프트를 조정하고, 출처 정보 문자열을 함께 반환합니다.
-    - 각 LLM에서 최상의 답변 하나씩을 생성하여 총 3가지 옵션을 반환합니다.
-    """
-    logger.info(f"Generating options for UO '{uo_id}' - Section '{section}' using multiple LLMs")
-    input_context = _extract_section_content(uo_block, "Input")
-    rag_query = f"Find the specific procedure or list of items for the '{section}' section of the unit operation '{uo_id}: {uo_name}' related to the experiment: {query}"
+# 사용할 LLM 모델 목록과 옵션 제목
+MODELS_TO_USE = ["biollama3", "mixtral", "llama3:70b"]
+MODEL_TITLES = {
+    "biollama3": "BioLLaMa3 (Default)",
+    "mixtral": "Mixtral 8x7B (Efficient)",
+    "llama3:70b": "Llama 3 70B (High-Quality)"
+}
+
+# --- [최적화] 멀티 모델 fan-out 정책 ---
+# 최소 N개의 옵션이 모이거나 T초가 지나면 응답하고 남은 모델 호출은 취소합니다.
+# POPULATE_MIN_OPTIONS=0 은 모든 모델을 기다림, POPULATE_DEADLINE_SECONDS=0 은 마감 없음을 뜻합니다.
+POPULATE_MIN_OPTIONS = int(os.getenv("POPULATE_MIN_OPTIONS", "0"))
+POPULATE_DEADLINE_SECONDS = float(os.getenv("POPULATE_DEADLINE_SECONDS", "0") or 0)
+
+# --- [최적화] SOP 검색 옵션 ---
+# 검색 방식(vector/hybrid), 가중치, 재정렬 기본값은 rag_pipeline의 RAG_* 환경 변수를 따릅니다.
+# RAG_FILTER_BY_UO=true 이면 현재 UO ID가 나오는 청크로 먼저 제한하고, 결과가 없으면 필터 없이 다시 검색합니다.
+RAG_FILTER_BY_UO = os.getenv("RAG_FILTER_BY_UO", "false").lower() == "true"
+
+def resolve_fanout_policy(min_options: Optional[int] = None, deadline_seconds: Optional[float] = None) -> Dict:
+    """요청별 값이 없으면 환경 변수 기본값으로 fan-out 정책을 구성합니다."""
+    if min_options is None:
+        min_options = POPULATE_MIN_OPTIONS
+    if deadline_seconds is None:
+        deadline_seconds = POPULATE_DEADLINE_SECONDS
+    if not min_options or min_options <= 0 or min_options > len(MODELS_TO_USE):
+        min_options = len(MODELS_TO_USE)
+    return {
+        "min_options": min_options,
+        "deadline_seconds": deadline_seconds if deadline_seconds and deadline_seconds > 0 else None,
+        "model_timeouts": {model_name: get_model_timeout(model_name) for model_name in MODELS_TO_USE},
+    }
 
+# 각 모델별로 최적의 답변을 유도하기 위한 통합 시스템 프롬프트
+# DPO 학습 시 'concise'와 'detailed' 사이의 균형을 학습시키는 것을 목표로 합니다.
+OPTION_SYSTEM_PROMPT = "You are a specialized scientific assistant. Your task is to generate a comprehensive and well-structured response for a specific section of a lab note, using the provided context. The response should be clear, detailed, and directly applicable to the experiment. Your answer MUST be only the list or method itself, without any extra conversation or explanation."
+
+async def _retrieve_sop_context(rag_query: str, uo_id: str, k: int = 3) -> list:
+    """SOP 청크를 검색합니다. RAG를 사용할 수 없으면 빈 목록을 반환하여 일반 지식으로 생성하게 합니다."""
     logger.info(f"Refined RAG Query: {rag_query}")
-    context_docs = rag_pipeline.retrieve_context(rag_query, k=3)
-    rag_context = rag_pipeline.format_context_for_prompt(context_docs)
-    attribution_str = ""
+    try:
+        rag_pipeline = await aget_rag_pipeline()
+        context_docs = []
+        if RAG_FILTER_BY_UO:
+            context_docs = await rag_pipeline.aretrieve_context(rag_query, k=k, uo_id=uo_id)
+        if not context_docs:
+            context_docs = await rag_pipeline.aretrieve_context(rag_query, k=k)
+        return context_docs
+    except Exception as e:
+        # RAG가 아직 준비되지 않았거나 Redis에 연결할 수 없으면 일반 지식으로 생성합니다.
+        logger.warning(f"RAG retrieval unavailable, continuing without SOP context: {e}")
+        return []
 
-    if "No relevant context found" in rag_context or not rag_context.strip():
+async def _build_generation_prompt(query: str, uo_id: str, uo_name: str, section: str, uo_block: str, context_docs: Optional[list] = None) -> Tuple[Dict[str, str], str, Dict]:
+    """
+    RAG 검색 결과에 따라 동적으로 사용자 프롬프트를 구성하고, 출처 정보 문자열과 함께 반환합니다.
+    SOP 컨텍스트는 모델별 토큰 예산(CONTEXT_TOKEN_BUDGETS)에 맞춰 압축하므로 모델마다 프롬프트가 다를 수 있습니다.
+    context_docs가 주어지면(UO 단위 공유 검색 결과) 섹션별 검색을 생략합니다.
+    반환값: ({모델 이름: 사용자 프롬프트}, 출처 정보 문자열, {모델 이름: 컨텍스트 패킹 보고서})
+    """
+    input_context = get_section_content(uo_block, "Input")
+    if context_docs is None:
+        rag_query = f"Find the specific procedure or list of items for the '{section}' section of the unit operation '{uo_id}: {uo_name}' related to the experiment: {query}"
+        context_docs = await _retrieve_sop_context(rag_query, uo_id)
+
+    if not context_docs:
         logger.warning(f"No relevant SOPs found for '{section}' in '{uo_name}'. Falling back to general knowledge.")
         attribution_str = "[주의: 참고할 SOP가 없어 LLM의 자체 지식으로 생성됨]"
         base_user_prompt = f"""
@@ -60,10 +109,21 @@ async def _generate_options(query: str, uo_id: str, uo_name: str, section: str,
 
 Based on your general molecular biology knowledge, please write a plausible list or protocol for the '{section}'.
 """
-    else:
-        sources = list(set([doc.metadata.get('source', 'Unknown').split('/')[-1] for doc in context_docs]))
-        attribution_str = f"[참고 SOP: {', '.join(sources)}]"
-        base_user_prompt = f"""
+        return {model_name: base_user_prompt for model_name in MODELS_TO_USE}, attribution_str, {}
+
+    sources = list(set([doc.metadata.get('source', 'Unknown').split('/')[-1] for doc in context_docs]))
+    attribution_str = f"[참고 SOP: {', '.join(sources)}]"
+    relevance_query = f"{section} {uo_id} {uo_name} {query} {input_context}"
+
+    user_prompts, context_reports = {}, {}
+    packed_by_budget: Dict[Optional[int], Tuple[str, Dict]] = {}
+    for model_name in MODELS_TO_USE:
+        budget = get_context_budget(model_name)
+        # 예산이 같은 모델끼리는 압축 결과를 공유합니다.
+        if budget not in packed_by_budget:
+            packed_by_budget[budget] = pack_context(context_docs, relevance_query, budget)
+        rag_context, context_reports[model_name] = packed_by_budget[budget]
+        user_prompts[model_name] = f"""
 - **Experiment Goal**: '{query}'
 - **Unit Operation**: '{uo_id}: {uo_name}'
 - **Section to Write**: '{section}'
@@ -75,74 +135,130 @@ Based on your general molecular biology knowledge, please write a plausible list
 
 Your task is to write the content for the specified section using the provided SOP context.
 """
+    logger.info(
+        "SOP context tokens per model: "
+        + ", ".join(f"{m}={r['tokens_after']} (saved {r['tokens_saved']})" for m, r in context_reports.items())
+    )
+    return user_prompts, attribution_str, context_reports
 
-    # 사용할 LLM 모델 목록 정의
-    models_to_use = ["biollama3", "mixtral", "llama3:70b"]
+def _format_option(model_name: str, opt: str, attribution_str: str) -> Optional[str]:
+    """모델 출력에 제목과 출처 정보를 붙입니다. 빈 출력이나 오류 메시지는 None을 반환합니다."""
+    if not opt or opt.startswith("(LLM Error"):
+        return None
+    title = MODEL_TITLES.get(model_name, model_name)
+    # 각 모델의 출력을 구별하기 위해 제목을 추가하고, 원본 SOP 출처 정보를 맨 뒤에 추가합니다.
+    return f"--- {title}의 제안 ---\n\n{opt}\n\n{attribution_str}"
+
+async def _fan_out(user_prompts: Dict[str, str], attribution_str: str, policy: Dict, bypass_cache: bool = False, cache_scope: Optional[str] = None) -> Tuple[List[str], Dict]:
+    """
+    정책에 따라 여러 모델을 동시에 호출하고, 조건을 만족하면 남은 호출을 취소합니다.
+    user_prompts는 모델별 사용자 프롬프트입니다. (_build_generation_prompt 참고)
+    cache_scope는 의미 기반 LLM 캐시가 다른 UO/섹션의 응답을 재사용하지 않도록 하는 범위 키입니다.
+    반환값: (모델 순서대로 정렬된 옵션 목록, 적용된 정책과 결과를 담은 보고서)
+    """
+    loop = asyncio.get_running_loop()
+    started_at = loop.time()
+    deadline_at = started_at + policy["deadline_seconds"] if policy["deadline_seconds"] else None
 
-    # 각 모델별로 최적의 답변을 유도하기 위한 통합 프롬프트
-    # DPO 학습 시 'concise'와 'detailed' 사이의 균형을 학습시키는 것을 목표로 합니다.
-    unified_prompt = {
-        "system": "You are a specialized scientific assistant. Your task is to generate a comprehensive and well-structured response for a specific section of a lab note, using the provided context. The response should be clear, detailed, and directly applicable to the experiment. Your answer MUST be only the list or method itself, without any extra conversation or explanation.",
-        "user": base_user_prompt
+    tasks = {
+        asyncio.create_task(call_llm_api(
+            system_prompt=OPTION_SYSTEM_PROMPT,
+            user_prompt=user_prompts[model_name],
+            model_name=model_name,
+            timeout=policy["model_timeouts"].get(model_name),
+            use_cache=not bypass_cache,
+            cache_scope=cache_scope
+        )): model_name
+        for model_name in MODELS_TO_USE
     }
+    pending = set(tasks)
+    formatted = {}
+    failed_models = []
+    stop_reason = "all_completed"
 
-    tasks = [
-        call_llm_api(
-            system_prompt=unified_prompt["system"],
-            user_prompt=unified_prompt["user"],
-            model_name=model_name
-        )
-        for model_name in models_to_use
-    ]
+    try:
+        while pending and len(formatted) < policy["min_options"]:
+            wait_timeout = None if deadline_at is None else max(0.0, deadline_at - loop.time())
+            done, pending = await asyncio.wait(pending, timeout=wait_timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                stop_reason = "deadline"
+                break
+            for task in done:
+                model_name = tasks[task]
+                formatted_option = _format_option(model_name, task.result(), attribution_str)
+                if formatted_option:
+                    formatted[model_name] = formatted_option
+                else:
+                    failed_models.append(model_name)
+        else:
+            if pending:
+                stop_reason = "min_options_reached"
+    finally:
+        # 남은(느린) 모델 호출을 취소하여 모델 자원을 반환합니다.
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
 
-    generated_options = await asyncio.gather(*tasks)
+    cancelled = {tasks[task] for task in pending}
+    cancelled_models = [m for m in MODELS_TO_USE if m in cancelled]
+    if cancelled_models:
+        logger.info(f"Fan-out stopped ({stop_reason}); cancelled stragglers: {cancelled_models}")
 
-    # 생성된 옵션들을 필터링하고 attribution 정보를 추가합니다.
-    final_options = []
-    model_titles = {
-        "biollama3": "BioLLaMa3 (Default)",
-        "mixtral": "Mixtral 8x7B (Efficient)",
-        "llama3:70b": "Llama 3 70B (High-Quality)"
+    report = {
+        **policy,
+        "stop_reason": stop_reason,
+        "completed_models": [m for m in MODELS_TO_USE if m in formatted],
+        "failed_models": failed_models,
+        "cancelled_models": cancelled_models,
+        "elapsed_seconds": round(loop.time() - started_at, 3),
     }
-    
-    for i, opt in enumerate(generated_options):
-        if opt and not opt.startswith("(LLM Error"):
-            model_name = models_to_use[i]
-            title = model_titles.get(model_name, model_name)
-            
-            # 각 모델의 출력을 구별하기 위해 제목을 추가합니다.
-            formatted_option = f"--- {title}의 제안 ---\n\n{opt}"
-            
-            # 원본 SOP 출처 정보를 맨 뒤에 추가합니다.
-            final_options.append(f"{formatted_option}\n\n{attribution_str}")
-    
-    return final_options, attribution_str
+    return [formatted[m] for m in MODELS_TO_USE if m in formatted], report
+
+async def _generate_options(query: str, uo_id: str, uo_name: str, section: str, uo_block: str, policy: Optional[Dict] = None, bypass_cache: bool = False, context_docs: Optional[list] = None) -> Tuple[List[str], str, Dict]:
+    """
+    RAG 검색 결과에 따라 동적으로 프롬프트를 조정하고, 출처 정보 문자열을 함께 반환합니다.
+    - 각 LLM에서 최상의 답변 하나씩을 생성하여 최대 3가지 옵션을 반환합니다.
+    - fan-out 정책(최소 옵션 수, 마감 시간, 모델별 제한 시간)과 그 결과 보고서를 함께 반환합니다.
+    """
+    logger.info(f"Generating options for UO '{uo_id}' - Section '{section}' using multiple LLMs")
+    user_prompts, attribution_str, context_reports = await _build_generation_prompt(query, uo_id, uo_name, section, uo_block, context_docs)
+    final_options, report = await _fan_out(user_prompts, attribution_str, policy or resolve_fanout_policy(), bypass_cache, f"{uo_id}:{section}")
+    report["context_packing"] = context_reports or None
+    return final_options, attribution_str, report
     
 # --- Agent Nodes ---
-def method_agent(state: AgentState) -> AgentState:
+# 노드는 코루틴으로 정의하여 서버의 이벤트 루프 위에서 그대로 실행됩니다.
+# (스레드마다 asyncio.run으로 새 루프를 만들지 않습니다.)
+async def method_agent(state: AgentState) -> AgentState:
     logger.info(f"Method Agent: Generating content for {state['uo_id']}")
-    options, attribution = asyncio.run(
-        _generate_options(state['query'], state['uo_id'], state['uo_name'], 'Method', state['uo_block'])
+    options, attribution, report = await _generate_options(
+        state['query'], state['uo_id'], state['uo_name'], 'Method', state['uo_block'],
+        state.get('fanout_policy'), state.get('bypass_cache', False), state.get('shared_context')
     )
     state['options']['Method'] = [f"{attribution}\n\n{opt}" for opt in options]
+    state['generation_report'] = report
     return state
 
-def materials_agent(state: AgentState) -> AgentState:
+async def materials_agent(state: AgentState) -> AgentState:
     section = state['section_to_populate']
     logger.info(f"Materials Agent: Generating content for {state['uo_id']} - {section}")
-    options, attribution = asyncio.run(
-        _generate_options(state['query'], state['uo_id'], state['uo_name'], section, state['uo_block'])
+    options, attribution, report = await _generate_options(
+        state['query'], state['uo_id'], state['uo_name'], section, state['uo_block'],
+        state.get('fanout_policy'), state.get('bypass_cache', False), state.get('shared_context')
     )
     state['options'][section] = [f"{attribution}\n\n{opt}" for opt in options]
+    state['generation_report'] = report
     return state
 
-def results_agent(state: AgentState) -> AgentState:
+async def results_agent(state: AgentState) -> AgentState:
     section = state['section_to_populate']
     logger.info(f"Results Agent: Generating content for {state['uo_id']} - {section}")
-    options, attribution = asyncio.run(
-        _generate_options(state['query'], state['uo_id'], state['uo_name'], section, state['uo_block'])
+    options, attribution, report = await _generate_options(
+        state['query'], state['uo_id'], state['uo_name'], section, state['uo_block'],
+        state.get('fanout_policy'), state.get('bypass_cache', False), state.get('shared_context')
     )
     state['options'][section] = [f"{attribution}\n\n{opt}" for opt in options]
+    state['generation_report'] = report
     return state
 
 
@@ -184,14 +300,35 @@ def create_agent_graph():
     logger.info("Agent graph compiled successfully with conditional entry point.")
     return agent_graph
 
+# --- [최적화] 컴파일된 그래프 캐시 ---
+# 컴파일된 그래프는 체크포인터가 없어 호출 간 상태를 공유하지 않으므로,
+# 프로세스 전체에서 하나를 만들어 동시 요청에 재사용해도 안전합니다.
+_compiled_agent_graph = None
+_agent_graph_lock = threading.Lock()
+
+def get_agent_graph():
+    """컴파일된 에이전트 그래프를 반환합니다. 최초 호출 시 한 번만 컴파일합니다."""
+    global _compiled_agent_graph
+    if _compiled_agent_graph is None:
+        with _agent_graph_lock:
+            if _compiled_agent_graph is None:
+                _compiled_agent_graph = create_agent_graph()
+    return _compiled_agent_graph
+
 # --- Main execution function ---
-def run_agent_team(query: str, uo_block: str, section: str) -> Dict:
-    match = re.search(r"### \[(U[A-Z]{2,3}\d{3}) (.*)\]", uo_block)
-    if not match:
+async def arun_agent_team(query: str, uo_block: str, section: str, min_options: Optional[int] = None, deadline_seconds: Optional[float] = None, bypass_cache: bool = False, shared_context: Optional[list] = None) -> Dict:
+    """
+    에이전트 팀을 호출한 쪽의 이벤트 루프에서 비동기로 실행합니다.
+    min_options/deadline_seconds를 지정하지 않으면 환경 변수 기본 fan-out 정책을 사용합니다.
+    bypass_cache=True이면 LLM 응답 캐시를 건너뛰고 항상 새로 생성합니다.
+    shared_context가 주어지면 섹션별 SOP 검색 대신 이 청크 목록을 사용합니다.
+    """
+    block = parse_uo_block(uo_block)
+    if block is None:
         logger.error(f"Could not parse UO ID and Name from block.")
         return {}
         
-    uo_id, uo_name = match.groups()
+    uo_id, uo_name = block.uo_id, block.uo_name
 
     initial_state = AgentState(
         query=query,
@@ -200,18 +337,200 @@ def run_agent_team(query: str, uo_block: str, section: str) -> Dict:
         uo_name=uo_name,
         section_to_populate=section,
         options={},
+        fanout_policy=resolve_fanout_policy(min_options, deadline_seconds),
+        generation_report={},
+        bypass_cache=bypass_cache,
+        shared_context=shared_context,
         messages=[]
     )
     
-    graph = create_agent_graph()
-    final_state = graph.invoke(initial_state)
+    graph = get_agent_graph()
+    final_state = await graph.ainvoke(initial_state)
     
     return {
         "uo_id": uo_id,
         "section": section,
-        "options": final_state.get('options', {}).get(section, [])
+        "options": final_state.get('options', {}).get(section, []),
+        "generation_policy": final_state.get('generation_report') or None
     }
 
+async def astream_agent_team(query: str, uo_block: str, section: str, stream_tokens: bool = False, bypass_cache: bool = False) -> AsyncIterator[Dict]:
+    """
+    모델별 옵션을 완료되는 즉시 이벤트로 내보내는 스트리밍 버전입니다.
+    - 이벤트 형식: {"event": "meta" | "token" | "option" | "error" | "done", "data": {...}}
+    - stream_tokens=True이면 Ollama 스트리밍 chat을 사용해 토큰 단위 'token' 이벤트도 보냅니다.
+    - 'option' 이벤트의 내용은 비스트리밍 엔드포인트가 반환하는 옵션과 동일한 형식입니다.
+    """
+    block = parse_uo_block(uo_block)
+    if block is None:
+        yield {"event": "error", "data": {"detail": "Could not parse UO ID and Name from block."}}
+        return
+    uo_id, uo_name = block.uo_id, block.uo_name
+
+    if route_request({"uo_id": uo_id, "section_to_populate": section}) == END:
+        yield {"event": "error", "data": {"detail": f"No agent available for section '{section}'."}}
+        return
+
+    user_prompts, attribution_str, context_reports = await _build_generation_prompt(query, uo_id, uo_name, section, uo_block)
+    yield {"event": "meta", "data": {
+        "uo_id": uo_id, "section": section, "attribution": attribution_str, "models": MODELS_TO_USE,
+        "context_packing": context_reports or None
+    }}
+
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def _stream_tokens(model_name: str) -> str:
+        parts = []
+        # wait_for의 시간 초과나 취소로 중단되어도 토큰 제너레이터를 즉시 닫아 스케줄러 슬롯과 Ollama 스트림을 반환합니다.
+        async with aclosing(stream_llm_api(OPTION_SYSTEM_PROMPT, user_prompts[model_name], model_name=model_name)) as deltas:
+            async for delta in deltas:
+                parts.append(delta)
+                await queue.put({"event": "token", "data": {"model": model_name, "delta": delta}})
+        return _post_process_content("".join(parts).strip())
+
+    async def _run_model(model_name: str):
+        timeout = get_model_timeout(model_name)
+        try:
+            if stream_tokens:
+                opt = await asyncio.wait_for(_stream_tokens(model_name), timeout=timeout)
+            else:
+                opt = await call_llm_api(system_prompt=OPTION_SYSTEM_PROMPT, user_prompt=user_prompts[model_name], model_name=model_name, timeout=timeout, use_cache=not bypass_cache, cache_scope=f"{uo_id}:{section}")
+
+            formatted_option = _format_option(model_name, opt, attribution_str)
+            if formatted_option:
+                await queue.put({"event": "option", "data": {"model": model_name, "option": f"{attribution_str}\n\n{formatted_option}"}})
+            else:
+                await queue.put({"event": "error", "data": {"model": model_name, "detail": opt or "Empty response."}})
+        except asyncio.TimeoutError:
+            logger.warning(f"Streaming generation for {model_name} timed out after {timeout}s.")
+            await queue.put({"event": "error", "data": {"model": model_name, "detail": f"timed out after {timeout}s"}})
+        except Exception as e:
+            logger.error(f"Streaming generation failed for model {model_name}: {e}", exc_info=True)
+            await queue.put({"event": "error", "data": {"model": model_name, "detail": str(e)}})
+        finally:
+            await queue.put(None)
+
+    tasks = [asyncio.create_task(_run_model(model_name)) for model_name in MODELS_TO_USE]
+    options = []
+    try:
+        remaining = len(tasks)
+        while remaining:
+            event = await queue.get()
+            if event is None:
+                remaining -= 1
+                continue
+            if event["event"] == "option":
+                options.append(event["data"]["option"])
+            yield event
+        yield {"event": "done", "data": {"uo_id": uo_id, "section": section, "options": options}}
+    finally:
+        # 클라이언트 연결이 끊긴 경우 남은 생성 작업을 취소하여 모델 자원을 반환합니다.
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+# --- [최적화] 워크플로우 일괄 생성 ---
+# 파일 전체를 한 번 파싱하고, (UO, 섹션) 작업들을 전역 동시 실행 한도 안에서 실행하며 완료 순서대로 결과를 내보냅니다.
+# 같은 UO의 섹션들은 UO 단위로 한 번 검색한 SOP 청크를 공유하고, 섹션별 관련 문장은 컨텍스트 패킹 단계에서 고릅니다.
+POPULATABLE_SECTIONS = ["Input", "Reagent", "Consumables", "Equipment", "Method", "Output", "Results & Discussions"]
+POPULATE_WORKFLOW_CONCURRENCY = int(os.getenv("POPULATE_WORKFLOW_CONCURRENCY", "4"))
+WORKFLOW_CONTEXT_K = int(os.getenv("WORKFLOW_CONTEXT_K", "5"))
+_workflow_semaphore: Optional[asyncio.Semaphore] = None
+
+def _get_workflow_semaphore() -> asyncio.Semaphore:
+    """모든 일괄 생성 요청이 공유하는 (UO, 섹션) 작업 동시 실행 한도. 작업 하나는 모든 모델을 호출합니다."""
+    global _workflow_semaphore
+    if _workflow_semaphore is None:
+        _workflow_semaphore = asyncio.Semaphore(max(POPULATE_WORKFLOW_CONCURRENCY, 1))
+    return _workflow_semaphore
+
+async def astream_workflow_population(query: str, note: LabNote, uo_ids: Optional[List[str]] = None, sections: Optional[List[str]] = None, skip_filled: bool = True, min_options: Optional[int] = None, deadline_seconds: Optional[float] = None, bypass_cache: bool = False) -> AsyncIterator[Dict]:
+    """
+    파싱된 연구노트의 여러 UO/섹션을 한 번에 생성합니다.
+    - 이벤트 형식: {"event": "meta" | "result" | "error" | "done", "data": {...}}
+    - 'result' 이벤트의 data는 /populate_note 응답과 같은 형식입니다. (uo_id, section, options, generation_policy)
+    - skip_filled=True이면 이미 내용이 있는 섹션은 건너뜁니다.
+    """
+    started_at = asyncio.get_running_loop().time()
+    blocks, seen_ids = [], set()
+    for block in note.blocks:
+        # 같은 UO ID가 여러 번 나오면 /populate_note와 같이 첫 번째 블록만 대상으로 합니다.
+        if block.uo_id in seen_ids or (uo_ids and block.uo_id not in uo_ids):
+            continue
+        seen_ids.add(block.uo_id)
+        blocks.append(block)
+    jobs = [
+        (block, section)
+        for block in blocks
+        for section in (sections or POPULATABLE_SECTIONS)
+        if not skip_filled or not block.is_section_filled(section)
+    ]
+    yield {"event": "meta", "data": {
+        "uo_ids": [block.uo_id for block in blocks],
+        "missing_uo_ids": [uo_id for uo_id in (uo_ids or []) if uo_id not in seen_ids],
+        "jobs": [{"uo_id": block.uo_id, "section": section} for block, section in jobs],
+        "total": len(jobs),
+        "concurrency": POPULATE_WORKFLOW_CONCURRENCY,
+    }}
+
+    context_tasks: Dict[str, asyncio.Task] = {}
+
+    def _shared_context(block: UOBlock) -> asyncio.Task:
+        # UO별 검색은 처음 요청한 섹션이 시작하고, 나머지 섹션은 같은 작업의 결과를 기다립니다.
+        if block.uo_id not in context_tasks:
+            rag_query = f"Find the specific procedures and materials for the unit operation '{block.uo_id}: {block.uo_name}' related to the experiment: {query}"
+            context_tasks[block.uo_id] = asyncio.create_task(_retrieve_sop_context(rag_query, block.uo_id, k=WORKFLOW_CONTEXT_K))
+        return context_tasks[block.uo_id]
+
+    async def _run_job(block: UOBlock, section: str) -> Dict:
+        context_docs = await _shared_context(block)
+        # 일괄 생성의 LLM 호출은 대화형 요청(chat, populate)보다 낮은 우선순위로 스케줄링합니다.
+        async with _get_workflow_semaphore():
+            with llm_priority(PRIORITY_BATCH):
+                return await arun_agent_team(
+                    query, block.text, section, min_options=min_options, deadline_seconds=deadline_seconds,
+                    bypass_cache=bypass_cache, shared_context=context_docs
+                )
+
+    tasks = {asyncio.create_task(_run_job(block, section)): (block.uo_id, section) for block, section in jobs}
+    pending = set(tasks)
+    completed, failed = 0, 0
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                uo_id, section = tasks[task]
+                try:
+                    result = task.result()
+                except Exception as e:
+                    logger.error(f"Workflow population failed for {uo_id} - {section}: {e}", exc_info=True)
+                    result, detail = None, str(e)
+                else:
+                    detail = "Agent team failed to generate options."
+                if result and result.get("options"):
+                    completed += 1
+                    yield {"event": "result", "data": result}
+                else:
+                    failed += 1
+                    yield {"event": "error", "data": {"uo_id": uo_id, "section": section, "detail": detail}}
+        yield {"event": "done", "data": {
+            "completed": completed,
+            "failed": failed,
+            "elapsed_seconds": round(asyncio.get_running_loop().time() - started_at, 3),
+        }}
+    finally:
+        # 클라이언트 연결이 끊긴 경우 남은 생성/검색 작업을 취소합니다.
+        leftover = [*pending, *context_tasks.values()]
+        for task in leftover:
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*leftover, return_exceptions=True)
+
+def run_agent_team(query: str, uo_block: str, section: str) -> Dict:
+    """동기 호출자(스크립트, 테스트)를 위한 래퍼. 서버 코드에서는 arun_agent_team을 사용합니다."""
+    return asyncio.run(arun_agent_team(query, uo_block, section))
+
 if __name__ == '__main__':
     # Example usage for testing
     test_query = "Plasmid construction using Golden Gate Assembly"
@@ -0,0 +1,217 @@
+import os
+import re
+import math
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from langchain_core.documents import Document
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# --- 프롬프트 컨텍스트 토큰 예산 ---
+# 모델별 예산은 "모델=토큰" 목록으로 지정하고, 목록에 없는 모델은 기본 예산을 사용합니다. 0은 제한 없음을 뜻합니다.
+CONTEXT_PACKING_ENABLED = os.getenv("CONTEXT_PACKING_ENABLED", "true").lower() == "true"
+CONTEXT_DEFAULT_TOKEN_BUDGET = int(os.getenv("CONTEXT_DEFAULT_TOKEN_BUDGET", "0") or 0)
+
+NO_CONTEXT_MESSAGE = "No relevant context found in the SOPs."
+
+_TERM_PATTERN = re.compile(r"\w+")
+_SENTENCE_SPLIT_PATTERN = re.compile(r"(?<=[.!?])\s+")
+# 이 길이(문자)보다 긴 줄만 문장 단위로 다시 나눕니다. 목록 항목 한 줄은 그대로 하나의 단위입니다.
+_LONG_LINE_CHARS = 300
+# 청크 경계 중복(분할기의 chunk_overlap)으로 인정할 최소/최대 길이(문자)
+_MIN_OVERLAP_CHARS = 20
+_MAX_OVERLAP_CHARS = 1000
+# 이보다 짧은 줄과 제목 줄은 SOP 템플릿에서 반복되는 구조(예: '#### Method')이므로 중복 제거 대상에서 제외합니다.
+_MIN_DEDUPE_CHARS = 20
+# 검색 쿼리 템플릿과 일반 영어에서 반복되어 관련도 판단에 도움이 되지 않는 단어
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "into", "is", "it", "of", "on",
+    "or", "that", "the", "to", "with", "find", "specific", "procedure", "list", "items", "section",
+    "unit", "operation", "related", "experiment",
+}
+
+
+def _parse_model_budgets(raw: str) -> Dict[str, int]:
+    budgets = {}
+    for item in raw.split(","):
+        if "=" not in item:
+            continue
+        model_name, tokens = item.rsplit("=", 1)
+        try:
+            budgets[model_name.strip()] = int(tokens)
+        except ValueError:
+            logger.warning(f"Ignoring invalid context budget entry: '{item}'")
+    return budgets
+
+CONTEXT_TOKEN_BUDGETS = _parse_model_budgets(os.getenv("CONTEXT_TOKEN_BUDGETS", ""))
+
+
+def get_context_budget(model_name: Optional[str]) -> Optional[int]:
+    """모델에 설정된 SOP 컨텍스트 토큰 예산을 반환합니다. 패킹이 꺼져 있거나 제한이 없으면 None."""
+    if not CONTEXT_PACKING_ENABLED:
+        return None
+    budget = CONTEXT_TOKEN_BUDGETS.get(model_name, CONTEXT_DEFAULT_TOKEN_BUDGET)
+    return budget if budget and budget > 0 else None
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    토크나이저 없이 쓰는 근사치: UTF-8 4바이트당 1토큰.
+    영어는 약 4글자, 한글은 약 1.3글자당 1토큰으로 세어져 Llama 계열 토크나이저와 비슷한 수준입니다.
+    """
+    return math.ceil(len(text.encode("utf-8")) / 4)
+
+
+def query_terms(text: str) -> List[str]:
+    """관련도 계산(BM25 쿼리, 문장 선택)에 쓰는 소문자 용어 목록. 순서를 유지하고 중복과 불용어를 제거합니다."""
+    terms = []
+    for term in _TERM_PATTERN.findall(text.lower()):
+        if len(term) > 1 and term not in STOPWORDS and term not in terms:
+            terms.append(term)
+    return terms
+
+
+def _source_name(doc: Document) -> str:
+    return str(doc.metadata.get("source", "Unknown")).split(os.path.sep)[-1]
+
+
+def _context_header(doc: Document) -> str:
+    return f"--- CONTEXT FROM: {_source_name(doc)} ---"
+
+
+def render_context(documents: List[Document]) -> str:
+    """청크 전체를 출처 머리글과 함께 이어 붙입니다. (패킹 전 프롬프트 형식)"""
+    if not documents:
+        return NO_CONTEXT_MESSAGE
+    return "\n\n".join(f"{_context_header(doc)}\n{doc.page_content}" for doc in documents)
+
+
+def _overlap_length(previous: str, current: str) -> int:
+    """previous의 끝과 current의 앞이 겹치는 가장 긴 길이(문자)를 반환합니다."""
+    for length in range(min(len(previous), len(current), _MAX_OVERLAP_CHARS), _MIN_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(current[:length]):
+            return length
+    return 0
+
+
+def _strip_chunk_overlaps(documents: List[Document]) -> Tuple[List[str], int]:
+    """
+    같은 파일에서 나온 인접 청크의 경계 중복을 제거한 본문 목록과 제거한 문자 수를 반환합니다.
+    검색 결과는 점수 순이므로, 앞서 나온 청크를 기준으로 뒤 청크의 앞/뒤 겹침을 모두 확인합니다.
+    """
+    texts = [doc.page_content for doc in documents]
+    removed = 0
+    for i in range(1, len(texts)):
+        for j in range(i):
+            if _source_name(documents[i]) != _source_name(documents[j]):
+                continue
+            head = _overlap_length(documents[j].page_content, texts[i])
+            if head:
+                texts[i] = texts[i][head:]
+                removed += head
+            tail = _overlap_length(texts[i], documents[j].page_content)
+            if tail:
+                texts[i] = texts[i][:-tail]
+                removed += tail
+    return texts, removed
+
+
+def _split_units(text: str) -> List[Tuple[int, str]]:
+    """본문을 (줄 번호, 문장) 단위로 나눕니다. 짧은 줄(목록 항목, 제목)은 한 줄이 한 단위입니다."""
+    units = []
+    for line_no, line in enumerate(text.splitlines()):
+        line = line.rstrip()
+        if not line.strip():
+            continue
+        if len(line) <= _LONG_LINE_CHARS:
+            units.append((line_no, line))
+        else:
+            units.extend((line_no, sentence) for sentence in _SENTENCE_SPLIT_PATTERN.split(line) if sentence.strip())
+    return units
+
+
+def _unit_score(unit: str, terms: set, doc_rank: int, doc_count: int) -> float:
+    unit_terms = set(_TERM_PATTERN.findall(unit.lower()))
+    score = len(unit_terms & terms) / math.sqrt(len(unit_terms) + 1) if terms else 0.0
+    if unit.lstrip().startswith("#"):
+        score += 1.0  # 제목 줄은 짧고 구조를 알려 주므로 우선 유지
+    # 검색 순위가 높은 청크의 문장을 약간 우대합니다.
+    return score + 0.5 * (doc_count - doc_rank) / doc_count
+
+
+def pack_context(documents: List[Document], query: str = "", token_budget: Optional[int] = None) -> Tuple[str, Dict]:
+    """
+    검색된 SOP 청크를 프롬프트용 컨텍스트로 압축합니다.
+    1. 같은 파일의 인접 청크 경계 중복과, 청크 간에 반복되는 문장을 제거합니다.
+    2. token_budget이 있으면 쿼리 용어와 겹치는 문장부터 예산 안에서 고르고, 원래 순서대로 다시 이어 붙입니다.
+    반환값: (컨텍스트 문자열, 패킹 전후 토큰 수를 담은 보고서)
+    """
+    original = render_context(documents)
+    tokens_before = estimate_tokens(original)
+    report = {
+        "token_budget": token_budget,
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_before,
+        "tokens_saved": 0,
+        "chunks_in": len(documents),
+        "chunks_used": len(documents),
+        "overlap_chars_removed": 0,
+        "duplicate_sentences_removed": 0,
+        "sentences_dropped": 0,
+    }
+    if not documents:
+        return original, report
+
+    texts, report["overlap_chars_removed"] = _strip_chunk_overlaps(documents)
+    terms = set(query_terms(query))
+    seen = set()
+    candidates = []  # (점수, 청크 순위, 단위 순서, 줄 번호, 문장, 토큰 수)
+    for doc_rank, text in enumerate(texts):
+        for position, (line_no, unit) in enumerate(_split_units(text)):
+            key = " ".join(unit.lower().split())
+            if len(key) >= _MIN_DEDUPE_CHARS and not key.startswith("#"):
+                if key in seen:
+                    report["duplicate_sentences_removed"] += 1
+                    continue
+                seen.add(key)
+            score = _unit_score(unit, terms, doc_rank, len(texts))
+            candidates.append((score, doc_rank, position, line_no, unit, estimate_tokens(unit) + 1))
+
+    header_tokens = [estimate_tokens(_context_header(doc)) + 1 for doc in documents]
+    selected = []
+    used_tokens = 0
+    used_docs = set()
+    for candidate in sorted(candidates, key=lambda c: (-c[0], c[1], c[2])):
+        doc_rank, cost = candidate[1], candidate[5]
+        if doc_rank not in used_docs:
+            cost += header_tokens[doc_rank]
+        if token_budget is not None and used_tokens + cost > token_budget:
+            continue
+        selected.append(candidate)
+        used_tokens += cost
+        used_docs.add(doc_rank)
+    report["sentences_dropped"] = len(candidates) - len(selected)
+
+    parts = []
+    for doc_rank, doc in enumerate(documents):
+        doc_units = sorted((c for c in selected if c[1] == doc_rank), key=lambda c: c[2])
+        if not doc_units:
+            continue
+        lines: List[str] = []
+        last_line_no = None
+        for _, _, _, line_no, unit, _ in doc_units:
+            if line_no == last_line_no:
+                lines[-1] = f"{lines[-1]} {unit.strip()}"
+            else:
+                lines.append(unit)
+            last_line_no = line_no
+        parts.append(f"{_context_header(doc)}\n" + "\n".join(lines))
+
+    packed = "\n\n".join(parts) if parts else NO_CONTEXT_MESSAGE
+    report["chunks_used"] = len(parts)
+    report["tokens_after"] = estimate_tokens(packed)
+    report["tokens_saved"] = max(tokens_before - report["tokens_after"], 0)
+    return packed, report
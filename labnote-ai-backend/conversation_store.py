@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import logging
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import redis.asyncio as redis
+from dotenv import load_dotenv
+
+from context_packer import estimate_tokens
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# --- /chat 대화 기록 저장소 ---
+# 'redis'는 앱의 Redis 연결 풀에 대화별 JSON을 TTL과 함께 저장하여 재시작 후에도 유지되고 여러 uvicorn 워커가 공유합니다.
+# 'memory'는 단일 프로세스용 LRU 저장소입니다. 두 저장소 모두 저장 시 오래된 턴부터 잘라 크기를 제한합니다.
+CHAT_HISTORY_BACKEND = os.getenv("CHAT_HISTORY_BACKEND", "redis").lower()  # 'redis' | 'memory'
+CHAT_HISTORY_TTL_SECONDS = int(os.getenv("CHAT_HISTORY_TTL_SECONDS", "86400"))  # 마지막 턴 이후 보관 시간, 0은 무기한
+CHAT_HISTORY_MAX_TURNS = int(os.getenv("CHAT_HISTORY_MAX_TURNS", "20"))  # 보관할 최근 (질문, 답변) 턴 수, 0은 제한 없음
+CHAT_HISTORY_MAX_TOKENS = int(os.getenv("CHAT_HISTORY_MAX_TOKENS", "4000"))  # 기록 전체의 근사 토큰 수 상한, 0은 제한 없음
+CHAT_HISTORY_MAX_CONVERSATIONS = int(os.getenv("CHAT_HISTORY_MAX_CONVERSATIONS", "1000"))  # memory 저장소의 최대 대화 수
+CHAT_HISTORY_KEY_PREFIX = "chat:history:"
+
+Message = Dict[str, str]
+
+
+def truncate_history(messages: List[Message], max_turns: int = CHAT_HISTORY_MAX_TURNS,
+                     max_tokens: int = CHAT_HISTORY_MAX_TOKENS) -> List[Message]:
+    """
+    맨 앞의 system 메시지는 유지하고, 나머지는 user 메시지로 시작하는 턴 단위로 가장 오래된 것부터 버립니다.
+    가장 최근 턴은 한도를 넘더라도 항상 남깁니다.
+    """
+    head_size = 0
+    while head_size < len(messages) and messages[head_size]["role"] == "system":
+        head_size += 1
+    head, turns = messages[:head_size], []
+    for message in messages[head_size:]:
+        if message["role"] == "user" or not turns:
+            turns.append([message])
+        else:
+            turns[-1].append(message)
+
+    if max_turns > 0:
+        turns = turns[-max_turns:]
+    if max_tokens > 0:
+        budget = max_tokens - sum(estimate_tokens(message["content"]) for message in head)
+        kept, used = [], 0
+        for turn in reversed(turns):
+            cost = sum(estimate_tokens(message["content"]) for message in turn)
+            if kept and used + cost > budget:
+                break
+            kept.append(turn)
+            used += cost
+        turns = kept[::-1]
+    return head + [message for turn in turns for message in turn]
+
+
+class ConversationStore(ABC):
+    """대화 ID별 메시지 목록 저장소의 공통 인터페이스. 메서드를 빠뜨린 구현은 생성 시점에 TypeError가 납니다."""
+
+    backend = "base"
+
+    @abstractmethod
+    async def get(self, conversation_id: str) -> Optional[List[Message]]:
+        """저장된 대화를 반환합니다. 없거나 만료되었으면 None."""
+
+    @abstractmethod
+    async def save(self, conversation_id: str, messages: List[Message]):
+        """대화 전체를 덮어씁니다. 호출자는 truncate_history로 자른 목록을 넘깁니다."""
+
+    @abstractmethod
+    async def delete(self, conversation_id: str) -> bool:
+        """대화를 삭제하고, 삭제할 대화가 있었으면 True를 반환합니다."""
+
+
+class InMemoryConversationStore(ConversationStore):
+    """단일 프로세스용 LRU 저장소. 가장 오래 사용되지 않은 대화부터 밀어내고, TTL이 지난 대화는 읽을 때 버립니다."""
+
+    backend = "memory"
+
+    def __init__(self, max_conversations: int = CHAT_HISTORY_MAX_CONVERSATIONS, ttl_seconds: int = CHAT_HISTORY_TTL_SECONDS):
+        self.max_conversations = max_conversations
+        self.ttl_seconds = ttl_seconds
+        self._conversations: "OrderedDict[str, tuple]" = OrderedDict()  # id -> (만료 시각, 메시지)
+
+    async def get(self, conversation_id: str) -> Optional[List[Message]]:
+        entry = self._conversations.get(conversation_id)
+        if entry is None:
+            return None
+        expires_at, messages = entry
+        if expires_at is not None and time.monotonic() >= expires_at:
+            del self._conversations[conversation_id]
+            return None
+        self._conversations.move_to_end(conversation_id)
+        return list(messages)
+
+    async def save(self, conversation_id: str, messages: List[Message]):
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds > 0 else None
+        self._conversations[conversation_id] = (expires_at, list(messages))
+        self._conversations.move_to_end(conversation_id)
+        while len(self._conversations) > self.max_conversations:
+            self._conversations.popitem(last=False)
+
+    async def delete(self, conversation_id: str) -> bool:
+        return self._conversations.pop(conversation_id, None) is not None
+
+
+class RedisConversationStore(ConversationStore):
+    """대화마다 'chat:history:<id>' 키에 메시지 목록 JSON을 저장합니다. TTL은 턴을 저장할 때마다 갱신됩니다."""
+
+    backend = "redis"
+
+    def __init__(self, redis_pool: redis.ConnectionPool, ttl_seconds: int = CHAT_HISTORY_TTL_SECONDS):
+        self._redis = redis.Redis(connection_pool=redis_pool)
+        self.ttl_seconds = ttl_seconds
+
+    @staticmethod
+    def _key(conversation_id: str) -> str:
+        return f"{CHAT_HISTORY_KEY_PREFIX}{conversation_id}"
+
+    async def get(self, conversation_id: str) -> Optional[List[Message]]:
+        raw = await self._redis.get(self._key(conversation_id))
+        return json.loads(raw) if raw else None
+
+    async def save(self, conversation_id: str, messages: List[Message]):
+        await self._redis.set(
+            self._key(conversation_id), json.dumps(messages, ensure_ascii=False),
+            ex=self.ttl_seconds if self.ttl_seconds > 0 else None
+        )
+
+    async def delete(self, conversation_id: str) -> bool:
+        return bool(await self._redis.delete(self._key(conversation_id)))
+
+
+def create_conversation_store(redis_pool: Optional[redis.ConnectionPool] = None) -> ConversationStore:
+    """CHAT_HISTORY_BACKEND 설정에 맞는 저장소를 만듭니다. Redis 풀이 없으면 메모리 저장소를 사용합니다."""
+    if CHAT_HISTORY_BACKEND == "redis" and redis_pool is not None:
+        store = RedisConversationStore(redis_pool)
+    else:
+        if CHAT_HISTORY_BACKEND not in ("redis", "memory"):
+            logger.warning(f"Unknown CHAT_HISTORY_BACKEND '{CHAT_HISTORY_BACKEND}', using in-memory store.")
+        store = InMemoryConversationStore()
+    logger.info(
+        f"Conversation store: {store.backend} (ttl={CHAT_HISTORY_TTL_SECONDS}s, "
+        f"max_turns={CHAT_HISTORY_MAX_TURNS}, max_tokens={CHAT_HISTORY_MAX_TOKENS})"
+    )
+    return store
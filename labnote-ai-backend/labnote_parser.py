@@ -0,0 +1,177 @@
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- 연구노트 마크다운 파서 ---
+# 워크플로우 파일을 한 번의 줄 단위 순회로 UO 블록 → 섹션 구조로 나누고, 내용 해시 기준으로 캐시합니다.
+# 모든 정규식은 모듈 로드 시 한 번만 컴파일하며, 요청마다 UO ID로 동적 정규식을 만들지 않습니다.
+UO_HEADER_PATTERN = re.compile(r"^### \\?\[(U[A-Z]{2,3}\d{3}) (.*?)\\?\](.*)$")
+SECTION_HEADER_PATTERN = re.compile(r"^#### (.+?)\s*$")
+# 상위 제목(## / ###)은 현재 UO 블록의 섹션을 끝냅니다.
+UPPER_HEADING_PATTERN = re.compile(r"^#{1,3} ")
+SEPARATOR_LINE = "-" * 72
+# 스캐폴드 템플릿의 자리표시자 줄: '- (e.g. enzyme, buffer, etc.)'
+PLACEHOLDER_LINE_PATTERN = re.compile(r"^\s*(?:[-*]\s*)?\(.*\)\s*$")
+NOT_SPECIFIED = "(not specified)"
+
+NOTE_PARSER_CACHE_SIZE = int(os.getenv("NOTE_PARSER_CACHE_SIZE", "256"))
+
+
+@dataclass(frozen=True)
+class Section:
+    """UO 블록 안의 '#### 이름' 섹션. 오프셋은 원본 문서 기준 문자 위치입니다."""
+    name: str
+    start: int          # 섹션 제목 줄의 시작
+    content_start: int  # 제목 다음 줄의 시작
+    end: int            # 다음 섹션/구분선/제목 직전
+    content: str        # 앞뒤 공백을 제거한 본문
+
+
+@dataclass(frozen=True)
+class UOBlock:
+    """
+    '### [UHW010 Liquid Handling]'로 시작하는 UO 블록.
+    start/end는 제목 바로 위의 여는 구분선부터 닫는 구분선(있으면)까지를 가리키며, text는 그 구간의 원문입니다.
+    """
+    uo_id: str
+    uo_name: str
+    title: str
+    start: int
+    header_start: int
+    end: int
+    text: str
+    sections: Tuple[Section, ...]
+
+    def section(self, name: str) -> Optional[Section]:
+        return next((section for section in self.sections if section.name == name), None)
+
+    def section_content(self, name: str) -> str:
+        """섹션 본문을 반환합니다. 섹션이 없거나, 비어 있거나, 템플릿 자리표시자('(...)')면 '(not specified)'."""
+        section = self.section(name)
+        content = section.content if section else ""
+        return content if content and not content.startswith('(') else NOT_SPECIFIED
+
+    def is_section_filled(self, name: str) -> bool:
+        """섹션에 자리표시자가 아닌 내용이 한 줄이라도 있으면 True."""
+        section = self.section(name)
+        return bool(section) and any(
+            line.strip() and not PLACEHOLDER_LINE_PATTERN.match(line) for line in section.content.splitlines()
+        )
+
+
+@dataclass(frozen=True)
+class LabNote:
+    content_hash: str
+    blocks: Tuple[UOBlock, ...]
+
+    def get_block(self, uo_id: str) -> Optional[UOBlock]:
+        """ID가 같은 블록이 여러 개면 문서에서 처음 나오는 블록을 반환합니다."""
+        return next((block for block in self.blocks if block.uo_id == uo_id), None)
+
+    @property
+    def uo_ids(self) -> Tuple[str, ...]:
+        return tuple(block.uo_id for block in self.blocks)
+
+
+def _content_hash(content: str) -> str:
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _parse(content: str, content_hash: str) -> LabNote:
+    blocks = []
+    block = None          # 현재 UO 블록의 누적 정보
+    section = None        # 현재 섹션: (이름, 시작, 본문 시작)
+    last_separator = None  # 직전 줄이 구분선이면 그 시작 오프셋
+
+    def close_section(end: int):
+        nonlocal section
+        if block is not None and section is not None:
+            name, start, content_start = section
+            block["sections"].append(Section(name, start, content_start, end, content[content_start:end].strip()))
+        section = None
+
+    def close_block(end: int):
+        nonlocal block
+        if block is not None:
+            close_section(end)
+            blocks.append(UOBlock(
+                uo_id=block["uo_id"], uo_name=block["uo_name"], title=block["title"],
+                start=block["start"], header_start=block["header_start"], end=end,
+                text=content[block["start"]:end], sections=tuple(block["sections"]),
+            ))
+        block = None
+
+    offset = 0
+    for line in content.splitlines(keepends=True):
+        line_start, offset = offset, offset + len(line)
+        stripped = line.rstrip("\r\n")
+
+        if stripped.rstrip() == SEPARATOR_LINE:
+            # 블록 안의 구분선은 닫는 구분선입니다. 블록에 포함하고 블록을 끝냅니다.
+            close_section(line_start)
+            close_block(line_start + len(stripped))
+            last_separator = line_start
+            continue
+
+        header = UO_HEADER_PATTERN.match(stripped)
+        if header:
+            close_block(line_start if last_separator is None else last_separator)
+            block = {
+                "uo_id": header.group(1), "uo_name": header.group(2).strip(), "title": header.group(3).strip(),
+                "start": line_start if last_separator is None else last_separator,
+                "header_start": line_start, "sections": [],
+            }
+        elif block is not None:
+            section_header = SECTION_HEADER_PATTERN.match(stripped)
+            if section_header:
+                close_section(line_start)
+                section = (section_header.group(1), line_start, offset)
+            elif UPPER_HEADING_PATTERN.match(stripped):
+                close_block(line_start)
+        if stripped.strip():
+            last_separator = None
+    close_block(len(content))
+    return LabNote(content_hash=content_hash, blocks=tuple(blocks))
+
+
+_cache: "OrderedDict[str, LabNote]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def parse_lab_note(content: str) -> LabNote:
+    """
+    연구노트 마크다운을 파싱합니다. 같은 내용은 해시로 캐시된 결과(불변 객체)를 재사용하므로
+    여러 엔드포인트/에이전트가 같은 파일을 반복해서 넘겨도 파싱은 한 번만 일어납니다.
+    """
+    content_hash = _content_hash(content)
+    with _cache_lock:
+        note = _cache.get(content_hash)
+        if note is not None:
+            _cache.move_to_end(content_hash)
+            return note
+    note = _parse(content, content_hash)
+    with _cache_lock:
+        _cache[content_hash] = note
+        while len(_cache) > NOTE_PARSER_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return note
+
+
+def parse_uo_block(uo_block: str) -> Optional[UOBlock]:
+    """UO 블록 하나(또는 블록이 들어 있는 문서)에서 첫 번째 UO 블록을 반환합니다."""
+    blocks = parse_lab_note(uo_block).blocks
+    return blocks[0] if blocks else None
+
+
+def get_section_content(uo_block: str, section_name: str) -> str:
+    """UO 블록 텍스트에서 섹션 본문을 반환합니다. (UOBlock.section_content 참고)"""
+    block = parse_uo_block(uo_block)
+    return block.section_content(section_name) if block else NOT_SPECIFIED
@@ -0,0 +1,149 @@
+import os
+import json
+import math
+import asyncio
+import hashlib
+import logging
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+import redis.asyncio as redis
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# --- LLM 응답 캐시 설정 ---
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", "86400"))
+LLM_SEMANTIC_CACHE_ENABLED = os.getenv("LLM_SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+LLM_SEMANTIC_CACHE_THRESHOLD = float(os.getenv("LLM_SEMANTIC_CACHE_THRESHOLD", "0.97"))
+LLM_SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("LLM_SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+LLM_CACHE_KEY_PREFIX = "llm_cache:"
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _normalize(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+class LLMResponseCache:
+    """
+    LLM 응답 2단계 캐시.
+    - exact 단계: (모델, 시스템 프롬프트, 사용자 프롬프트, 옵션)의 해시를 키로 Redis에 TTL과 함께 저장
+    - semantic 단계(선택): 같은 (모델, 시스템 프롬프트, 옵션, scope) 범위에서 사용자 프롬프트 임베딩의
+      코사인 유사도가 임계값 이상인 기존 항목을 재사용. 벡터 인덱스는 프로세스 메모리에, 값은 Redis에 둡니다.
+      scope는 호출자가 주는 범위 키(예: '<UO ID>:<섹션>')로, 본문 대부분이 같은 다른 섹션/UO의 프롬프트가
+      서로의 응답을 가져가지 않게 합니다.
+    """
+
+    def __init__(self):
+        self._redis: Optional[redis.Redis] = None
+        self._embeddings = None
+        self._semantic_entries: deque = deque(maxlen=LLM_SEMANTIC_CACHE_MAX_ENTRIES)
+        self._counters: Dict[str, int] = {
+            "exact_hits": 0, "semantic_hits": 0, "misses": 0, "bypassed": 0, "stores": 0, "errors": 0
+        }
+
+    def configure(self, redis_pool: Optional[redis.ConnectionPool], embeddings=None):
+        """lifespan에서 앱의 Redis 연결 풀과 (선택) 임베딩 모델을 연결합니다."""
+        self._redis = redis.Redis(connection_pool=redis_pool) if redis_pool and LLM_CACHE_ENABLED else None
+        self._embeddings = embeddings if LLM_SEMANTIC_CACHE_ENABLED else None
+        logger.info(
+            f"LLM cache configured (exact={'on' if self._redis else 'off'}, "
+            f"semantic={'on' if self._redis and self._embeddings else 'off'}, ttl={LLM_CACHE_TTL_SECONDS}s)"
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self._redis is not None
+
+    @staticmethod
+    def make_key(model_name: str, system_prompt: str, user_prompt: str, options: Dict) -> str:
+        payload = json.dumps([model_name, system_prompt, user_prompt, options], sort_keys=True, ensure_ascii=False)
+        return f"{LLM_CACHE_KEY_PREFIX}{_sha256(payload)}"
+
+    @staticmethod
+    def _semantic_scope(model_name: str, system_prompt: str, options: Dict, scope: Optional[str]) -> str:
+        return _sha256(json.dumps([model_name, system_prompt, options, scope], sort_keys=True, ensure_ascii=False))
+
+    async def _embed(self, text: str) -> List[float]:
+        # NomicEmbeddings.embed_query는 동기 호출이므로 이벤트 루프를 막지 않도록 스레드에서 실행
+        return _normalize(await asyncio.to_thread(self._embeddings.embed_query, text))
+
+    def _find_similar(self, text: str, candidates: List[Tuple[List[float], str]]) -> Tuple[Optional[str], float]:
+        """(스레드에서 실행) 질의를 임베딩하고 후보 중 유사도가 임계값 이상인 가장 가까운 항목의 키와 점수를 반환합니다."""
+        vector = _normalize(self._embeddings.embed_query(text))
+        best_key, best_score = None, LLM_SEMANTIC_CACHE_THRESHOLD
+        for entry_vector, entry_key in candidates:
+            score = sum(a * b for a, b in zip(vector, entry_vector))
+            if score >= best_score:
+                best_key, best_score = entry_key, score
+        return best_key, best_score
+
+    def record_bypass(self):
+        self._counters["bypassed"] += 1
+
+    async def get(self, model_name: str, system_prompt: str, user_prompt: str, options: Dict,
+                  scope: Optional[str] = None) -> Optional[str]:
+        if not self.enabled:
+            return None
+        key = self.make_key(model_name, system_prompt, user_prompt, options)
+        try:
+            cached = await self._redis.get(key)
+            if cached is not None:
+                self._counters["exact_hits"] += 1
+                return cached
+
+            if self._embeddings is not None and self._semantic_entries:
+                semantic_scope = self._semantic_scope(model_name, system_prompt, options, scope)
+                # 같은 범위의 후보만 루프에서 복사해 두고(set이 deque를 바꿀 수 있으므로), 임베딩과 유사도 계산은 스레드에서 수행
+                candidates = [(vector, key) for entry_scope, vector, key in self._semantic_entries if entry_scope == semantic_scope]
+                best_key, best_score = (None, 0.0)
+                if candidates:
+                    best_key, best_score = await asyncio.to_thread(self._find_similar, user_prompt, candidates)
+                if best_key:
+                    cached = await self._redis.get(best_key)
+                    if cached is not None:
+                        self._counters["semantic_hits"] += 1
+                        logger.info(f"Semantic LLM cache hit for {model_name} (similarity={best_score:.4f})")
+                        return cached
+        except Exception as e:
+            self._counters["errors"] += 1
+            logger.warning(f"LLM cache lookup failed, treating as miss: {e}")
+
+        self._counters["misses"] += 1
+        return None
+
+    async def set(self, model_name: str, system_prompt: str, user_prompt: str, options: Dict, content: str,
+                  scope: Optional[str] = None):
+        if not self.enabled:
+            return
+        key = self.make_key(model_name, system_prompt, user_prompt, options)
+        try:
+            await self._redis.set(key, content, ex=LLM_CACHE_TTL_SECONDS)
+            self._counters["stores"] += 1
+            if self._embeddings is not None:
+                semantic_scope = self._semantic_scope(model_name, system_prompt, options, scope)
+                self._semantic_entries.append((semantic_scope, await self._embed(user_prompt), key))
+        except Exception as e:
+            self._counters["errors"] += 1
+            logger.warning(f"Failed to store LLM response in cache: {e}")
+
+    def stats(self) -> Dict:
+        hits = self._counters["exact_hits"] + self._counters["semantic_hits"]
+        lookups = hits + self._counters["misses"]
+        return {
+            **self._counters,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "semantic_entries": len(self._semantic_entries),
+            "enabled": self.enabled,
+            "semantic_enabled": self.enabled and self._embeddings is not None,
+        }
+
+
+llm_cache = LLMResponseCache()
@@ -0,0 +1,205 @@
+import os
+import heapq
+import asyncio
+import logging
+import itertools
+import contextvars
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# --- [최적화] 프로세스 내 LLM 요청 스케줄러 ---
+# 모델별 동시 실행 수를 제한하고, 슬롯이 비면 우선순위가 높은 대기자(chat > populate > batch)부터 실행합니다.
+# 모델별 대기열이 가득 차면 LLMQueueFullError를 발생시키며, API는 이를 HTTP 429 + Retry-After로 응답합니다.
+PRIORITY_CHAT = "chat"
+PRIORITY_POPULATE = "populate"
+PRIORITY_BATCH = "batch"
+PRIORITIES = {PRIORITY_CHAT: 0, PRIORITY_POPULATE: 1, PRIORITY_BATCH: 2}
+
+LLM_SCHEDULER_ENABLED = os.getenv("LLM_SCHEDULER_ENABLED", "true").lower() == "true"
+LLM_DEFAULT_CONCURRENCY = int(os.getenv("LLM_DEFAULT_CONCURRENCY", "2"))
+LLM_MAX_QUEUE_DEPTH = int(os.getenv("LLM_MAX_QUEUE_DEPTH", "32"))
+# 첫 호출 전, 처리 시간 통계가 없을 때 Retry-After 계산에 쓰는 호출당 예상 시간(초)
+LLM_EXPECTED_CALL_SECONDS = float(os.getenv("LLM_EXPECTED_CALL_SECONDS", "30"))
+
+
+def _parse_model_limits(raw: str) -> Dict[str, int]:
+    limits = {}
+    for item in raw.split(","):
+        if "=" not in item:
+            continue
+        model_name, value = item.rsplit("=", 1)
+        try:
+            limits[model_name.strip()] = int(value)
+        except ValueError:
+            logger.warning(f"Ignoring invalid LLM concurrency entry: '{item}'")
+    return limits
+
+LLM_MODEL_CONCURRENCY = _parse_model_limits(os.getenv("LLM_MODEL_CONCURRENCY", ""))
+
+# 호출 경로(엔드포인트)가 정한 우선순위. asyncio 작업은 생성 시점의 컨텍스트를 복사하므로,
+# 에이전트 그래프/fan-out 안에서 만들어지는 LLM 호출에도 그대로 전달됩니다.
+_current_priority: contextvars.ContextVar[str] = contextvars.ContextVar("llm_priority", default=PRIORITY_POPULATE)
+
+
+@contextmanager
+def llm_priority(priority: str):
+    """이 블록 안에서 시작되는 LLM 호출의 기본 우선순위를 지정합니다."""
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown LLM priority '{priority}'. Expected one of {list(PRIORITIES)}.")
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+def current_priority() -> str:
+    return _current_priority.get()
+
+
+class LLMQueueFullError(Exception):
+    """모델 대기열이 가득 차서 요청을 받을 수 없을 때 발생합니다. retry_after는 재시도까지 권장 대기 시간(초)."""
+
+    def __init__(self, model_name: str, queue_depth: int, retry_after: int):
+        super().__init__(f"LLM queue for '{model_name}' is full ({queue_depth} waiting). Retry after {retry_after}s.")
+        self.model_name = model_name
+        self.queue_depth = queue_depth
+        self.retry_after = retry_after
+
+
+class _ModelQueue:
+    def __init__(self, model_name: str, capacity: int):
+        self.model_name = model_name
+        self.capacity = max(capacity, 1)
+        self.in_flight = 0
+        self.waiters: List[Tuple[int, int, asyncio.Future]] = []  # (우선순위, 순번, future) 최소 힙
+        self.avg_call_seconds: Optional[float] = None
+        self.counters = {"admitted": 0, "queued": 0, "rejected": 0, "max_queue_depth": 0}
+        self.total_wait_seconds = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for _, _, future in self.waiters if not future.done())
+
+    def queued_by_priority(self) -> Dict[str, int]:
+        names = {rank: name for name, rank in PRIORITIES.items()}
+        counts = {name: 0 for name in PRIORITIES}
+        for rank, _, future in self.waiters:
+            if not future.done():
+                counts[names[rank]] += 1
+        return counts
+
+    def retry_after(self) -> int:
+        # 대기열이 모두 처리될 때까지의 대략적인 시간: (대기 수 / 동시 실행 수 + 1) × 평균 호출 시간
+        call_seconds = self.avg_call_seconds or LLM_EXPECTED_CALL_SECONDS
+        return max(1, int((self.queue_depth / self.capacity + 1) * call_seconds))
+
+    def record_call(self, seconds: float):
+        # 지수 이동 평균으로 최근 호출 시간에 가중치를 둡니다.
+        self.avg_call_seconds = seconds if self.avg_call_seconds is None else 0.8 * self.avg_call_seconds + 0.2 * seconds
+
+
+class LLMScheduler:
+    def __init__(self, enabled: bool = LLM_SCHEDULER_ENABLED, max_queue_depth: int = LLM_MAX_QUEUE_DEPTH):
+        self.enabled = enabled
+        self.max_queue_depth = max_queue_depth
+        self._queues: Dict[str, _ModelQueue] = {}
+        self._sequence = itertools.count()
+
+    def _queue(self, model_name: str) -> _ModelQueue:
+        queue = self._queues.get(model_name)
+        if queue is None:
+            capacity = LLM_MODEL_CONCURRENCY.get(model_name, LLM_DEFAULT_CONCURRENCY)
+            queue = self._queues[model_name] = _ModelQueue(model_name, capacity)
+        return queue
+
+    def ensure_capacity(self, model_names: Iterable[str]):
+        """
+        스트리밍 응답을 시작하기 전에 호출하여, 대기열이 이미 가득 찬 모델이 있으면 바로 LLMQueueFullError를 발생시킵니다.
+        (응답 헤더를 보낸 뒤에는 429로 바꿀 수 없기 때문입니다.)
+        """
+        if not self.enabled:
+            return
+        for model_name in model_names:
+            queue = self._queue(model_name)
+            if queue.in_flight >= queue.capacity and queue.queue_depth >= self.max_queue_depth:
+                queue.counters["rejected"] += 1
+                raise LLMQueueFullError(model_name, queue.queue_depth, queue.retry_after())
+
+    async def _acquire(self, queue: _ModelQueue, priority: str) -> float:
+        if queue.in_flight < queue.capacity and not queue.queue_depth:
+            queue.in_flight += 1
+            queue.counters["admitted"] += 1
+            return 0.0
+        depth = queue.queue_depth
+        if depth >= self.max_queue_depth:
+            queue.counters["rejected"] += 1
+            raise LLMQueueFullError(queue.model_name, depth, queue.retry_after())
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        heapq.heappush(queue.waiters, (PRIORITIES[priority], next(self._sequence), future))
+        queue.counters["queued"] += 1
+        queue.counters["max_queue_depth"] = max(queue.counters["max_queue_depth"], depth + 1)
+        queued_at = loop.time()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 슬롯을 넘겨받은 직후 취소되었으면 다음 대기자에게 돌려줍니다.
+                self._release(queue)
+            raise
+        queue.counters["admitted"] += 1
+        wait_seconds = loop.time() - queued_at
+        queue.total_wait_seconds += wait_seconds
+        return wait_seconds
+
+    def _release(self, queue: _ModelQueue):
+        # 취소된 대기자는 건너뛰고, 가장 우선순위가 높은 대기자에게 슬롯을 그대로 넘깁니다.
+        while queue.waiters:
+            _, _, future = heapq.heappop(queue.waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        queue.in_flight -= 1
+
+    @asynccontextmanager
+    async def slot(self, model_name: str, priority: Optional[str] = None):
+        """모델 실행 슬롯을 얻은 동안 블록을 실행합니다. priority를 생략하면 현재 컨텍스트의 우선순위를 사용합니다."""
+        if not self.enabled:
+            yield
+            return
+        priority = priority or current_priority()
+        queue = self._queue(model_name)
+        wait_seconds = await self._acquire(queue, priority)
+        if wait_seconds > 1:
+            logger.info(f"LLM call to {model_name} ({priority}) waited {wait_seconds:.1f}s for a slot.")
+        started_at = asyncio.get_running_loop().time()
+        try:
+            yield
+        finally:
+            queue.record_call(asyncio.get_running_loop().time() - started_at)
+            self._release(queue)
+
+    def stats(self) -> Dict:
+        models = {}
+        for model_name, queue in self._queues.items():
+            admitted_after_wait = max(queue.counters["queued"], 1)
+            models[model_name] = {
+                "capacity": queue.capacity,
+                "in_flight": queue.in_flight,
+                "queue_depth": queue.queue_depth,
+                "queued_by_priority": queue.queued_by_priority(),
+                **queue.counters,
+                "avg_wait_seconds": round(queue.total_wait_seconds / admitted_after_wait, 3),
+                "avg_call_seconds": round(queue.avg_call_seconds, 3) if queue.avg_call_seconds is not None else None,
+            }
+        return {"enabled": self.enabled, "max_queue_depth": self.max_queue_depth, "models": models}
+
+
+llm_scheduler = LLMScheduler()
@@ -1,9 +1,17 @@
 import os
 import re
 import logging
-import ollama
+import asyncio
+from contextlib import aclosing
+from typing import Dict, Optional
+
 from dotenv import load_dotenv
 
+from llm_cache import llm_cache
+from llm_scheduler import LLMQueueFullError, llm_scheduler
+# 클라이언트 레지스트리는 ollama_pool로 옮겼으며, 기존 임포트 경로를 위해 다시 내보냅니다.
+from ollama_pool import close_ollama_clients, get_ollama_client, ollama_pool  # noqa: F401
+
 load_dotenv()
 logger = logging.getLogger(__name__)
 
@@ -22,30 +30,108 @@ def _post_process_content(content: str) -> str:
     return content.strip()
 
 
-async def call_llm_api(system_prompt: str, user_prompt: str, model_name: str = None):
-    """LLM API를 호출하는 범용 비동기 함수."""
+LLM_GENERATION_OPTIONS = {'temperature': 0.1, 'top_p': 0.8}
+
+# --- [최적화] 모델별 응답 제한 시간 ---
+# LLM_MODEL_TIMEOUTS="biollama3=60,mixtral=90,llama3:70b=120" 형식으로 모델별 제한 시간(초)을 지정하고,
+# 지정되지 않은 모델은 LLM_DEFAULT_TIMEOUT을 사용합니다. 0 또는 빈 값은 제한 없음입니다.
+def _parse_model_timeouts(raw: str) -> Dict[str, float]:
+    timeouts = {}
+    for item in raw.split(","):
+        if "=" not in item:
+            continue
+        model_name, seconds = item.rsplit("=", 1)
+        try:
+            timeouts[model_name.strip()] = float(seconds)
+        except ValueError:
+            logger.warning(f"Ignoring invalid LLM timeout entry: '{item}'")
+    return timeouts
+
+LLM_DEFAULT_TIMEOUT = float(os.getenv("LLM_DEFAULT_TIMEOUT", "0") or 0)
+LLM_MODEL_TIMEOUTS = _parse_model_timeouts(os.getenv("LLM_MODEL_TIMEOUTS", ""))
+
+
+def get_model_timeout(model_name: str) -> Optional[float]:
+    """모델에 설정된 제한 시간(초)을 반환합니다. 제한이 없으면 None."""
+    timeout = LLM_MODEL_TIMEOUTS.get(model_name, LLM_DEFAULT_TIMEOUT)
+    return timeout if timeout and timeout > 0 else None
+
+
+def _build_messages(system_prompt: str, user_prompt: str):
+    return [
+        {'role': 'system', 'content': system_prompt},
+        {'role': 'user', 'content': user_prompt}
+    ]
+
+
+async def call_llm_api(system_prompt: str, user_prompt: str, model_name: str = None, timeout: Optional[float] = None, use_cache: bool = True, priority: Optional[str] = None, cache_scope: Optional[str] = None):
+    """
+    LLM API를 호출하는 범용 비동기 함수.
+    timeout을 지정하지 않으면 모델별 설정(get_model_timeout)을 따르며, 시간 초과 시 오류 문자열을 반환합니다.
+    use_cache=False이면 응답 캐시를 조회하지도, 저장하지도 않습니다. cache_scope는 의미 기반 캐시의 범위 키입니다. (예: '<UO ID>:<섹션>')
+    호출은 llm_scheduler의 모델별 슬롯 안에서 실행되며(제한 시간은 슬롯을 얻은 뒤부터 적용),
+    대기열이 가득 차면 오류 문자열 대신 LLMQueueFullError를 그대로 전파합니다.
+    """
     if model_name is None:
         model_name = os.getenv("LLM_MODEL", "biollama3")
+    if timeout is None:
+        timeout = get_model_timeout(model_name)
+
+    if not use_cache:
+        llm_cache.record_bypass()
+    else:
+        cached = await llm_cache.get(model_name, system_prompt, user_prompt, LLM_GENERATION_OPTIONS, cache_scope)
+        if cached is not None:
+            logger.info(f"LLM cache hit for {model_name}.")
+            return cached
 
     logger.info(f"Calling LLM: {model_name} for a specific task.")
     try:
-        ollama_base_url = os.getenv("OLLAMA_BASE_URL")
-        client = ollama.AsyncClient(host=ollama_base_url)
-
-        response = await client.chat(
-            model=model_name,
-            messages=[
-                {'role': 'system', 'content': system_prompt},
-                {'role': 'user', 'content': user_prompt}
-            ],
-            options={'temperature': 0.1, 'top_p': 0.8}
-        )
+        async with llm_scheduler.slot(model_name, priority):
+            # 모델을 서비스하는 호스트 중 한 곳으로 보내며, 연결 실패 시 다른 호스트로 재시도합니다.
+            response = await asyncio.wait_for(
+                ollama_pool.chat(
+                    model_name,
+                    messages=_build_messages(system_prompt, user_prompt),
+                    options=LLM_GENERATION_OPTIONS
+                ),
+                timeout=timeout
+            )
         content = response['message']['content'].strip()
         
         # 후처리 함수 호출
         processed_content = _post_process_content(content)
+        if use_cache and processed_content:
+            await llm_cache.set(model_name, system_prompt, user_prompt, LLM_GENERATION_OPTIONS, processed_content, cache_scope)
         return processed_content
 
+    except LLMQueueFullError:
+        raise
+    except asyncio.TimeoutError:
+        logger.warning(f"LLM API call to {model_name} timed out after {timeout}s.")
+        return f"(LLM Error: {model_name} timed out after {timeout}s)"
     except Exception as e:
         logger.error(f"LLM API call failed: {e}", exc_info=True)
-        return f"(LLM Error: Could not generate content due to: {e})"
\ No newline at end of file
+        return f"(LLM Error: Could not generate content due to: {e})"
+
+
+async def stream_llm_api(system_prompt: str, user_prompt: str, model_name: str = None, priority: Optional[str] = None):
+    """
+    Ollama 스트리밍 chat을 사용해 생성되는 토큰 조각을 차례로 내보내는 비동기 제너레이터.
+    call_llm_api와 달리 오류를 삼키지 않고 호출자에게 전파합니다. 스트림이 끝날 때까지 스케줄러 슬롯을 점유합니다.
+    """
+    if model_name is None:
+        model_name = os.getenv("LLM_MODEL", "biollama3")
+
+    logger.info(f"Streaming LLM: {model_name} for a specific task.")
+    async with llm_scheduler.slot(model_name, priority):
+        stream = ollama_pool.stream_chat(
+            model_name,
+            messages=_build_messages(system_prompt, user_prompt),
+            options=LLM_GENERATION_OPTIONS
+        )
+        async with aclosing(stream):
+            async for chunk in stream:
+                delta = chunk['message']['content']
+                if delta:
+                    yield delta
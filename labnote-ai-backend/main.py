@@ -2,32 +2,38 @@ import os
 import logging
 import datetime
 import uuid
+import time
+import math
 import re
 import asyncio
 import json
 import redis.asyncio as redis
-import ollama
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi.responses import StreamingResponse, JSONResponse
 from pydantic import BaseModel
 from typing import Optional, List, Dict
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, aclosing
 from dotenv import load_dotenv
 
 # Local imports
-from rag_pipeline import rag_pipeline
-from agents import run_agent_team
-from llm_utils import call_llm_api
+from rag_pipeline import create_embeddings, get_rag_pipeline, aget_rag_pipeline, set_async_redis_pool, rag_pipeline_status
+from agents import MODELS_TO_USE, POPULATABLE_SECTIONS, arun_agent_team, astream_agent_team, astream_workflow_population, get_agent_graph
+from llm_utils import call_llm_api, close_ollama_clients
+from ollama_pool import ollama_pool
+from llm_cache import llm_cache
+from llm_scheduler import PRIORITY_CHAT, LLMQueueFullError, llm_scheduler
+from context_packer import get_context_budget, pack_context
+from labnote_parser import NOT_SPECIFIED, parse_lab_note
+from conversation_store import ConversationStore, create_conversation_store, truncate_history
+from preference_buffer import preference_buffer
 
 # .env 파일 로드 및 로깅 설정
 load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# --- [최적화 1] 정규식 사전 컴파일 ---
-UO_BLOCK_EXTRACT_PATTERN = re.compile(
-    r"(### \[" + r"(?P<uo_id>U[A-Z]{2,3}\d{3})" + r".*?\n.*?)(?=### \[U[A-Z]{2,3}\d{3}|\Z)",
-    re.DOTALL
-)
+# --- [최적화 1] 연구노트 파싱 ---
+# UO 블록/섹션 추출은 labnote_parser가 사전 컴파일된 패턴으로 한 번에 파싱하고 내용 해시로 캐시합니다.
 
 # --- [최적화 2] 데이터 사전 처리 ---
 WORKFLOW_GUIDE_DATA = """
@@ -203,15 +209,56 @@ ALL_UOS_DATA, ALL_WORKFLOWS_DATA = _precompute_data()
 # --- [최적화 3] Redis 연결 관리 ---
 redis_pool = None
 
+# --- [최적화 4] RAG 파이프라인 백그라운드 워밍업 ---
+async def _warm_up_rag_pipeline():
+    """서버가 포트를 연 뒤 백그라운드에서 RAG 파이프라인을 생성합니다. Redis 연결 실패 시 지수 백오프로 재시도합니다."""
+    delay = 1.0
+    while True:
+        try:
+            started_at = asyncio.get_running_loop().time()
+            pipeline = await aget_rag_pipeline(wait=True)
+            logger.info(f"RAG pipeline ready in {asyncio.get_running_loop().time() - started_at:.2f}s.")
+            break
+        except Exception as e:
+            logger.warning(f"RAG pipeline warm-up failed, retrying in {delay:.0f}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+    if os.getenv("RAG_SYNC_ON_STARTUP", "false").lower() == "true":
+        # 추가/변경/삭제된 SOP만 반영하는 증분 인덱싱
+        await asyncio.to_thread(pipeline.sync_index)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global redis_pool
+    global redis_pool, conversation_store
     redis_url = os.getenv("REDIS_URL")
     if not redis_url:
         raise ValueError("REDIS_URL environment variable is not set.")
     logger.info(f"Creating Redis connection pool for {redis_url}")
     redis_pool = redis.ConnectionPool.from_url(redis_url, decode_responses=True)
+    # LLM 응답 캐시: exact 단계는 앱의 Redis 풀을, semantic 단계는 RAG와 같은 임베딩 모델을 사용
+    llm_cache.configure(redis_pool, embeddings=create_embeddings())
+    # 비동기 RAG 검색도 같은 연결 풀을 공유
+    set_async_redis_pool(redis_pool)
+    # /chat 대화 기록 (CHAT_HISTORY_BACKEND=redis면 같은 연결 풀 사용)
+    conversation_store = create_conversation_store(redis_pool)
+    rag_warmup_task = asyncio.create_task(_warm_up_rag_pipeline())
+    if os.getenv("AGENT_GRAPH_WARMUP", "true").lower() == "true":
+        # 첫 사용자 요청이 그래프 컴파일 비용을 내지 않도록 미리 컴파일
+        logger.info("Warming up agent graph...")
+        get_agent_graph()
+    # Ollama 호스트별 공유 클라이언트(keep-alive 연결 풀)를 서버 이벤트 루프에서 생성하고,
+    # 첫 헬스 체크로 각 호스트의 상태와 모델 목록을 채운 뒤 주기적 체크를 시작
+    await ollama_pool.check_health()
+    ollama_pool.start_health_checks()
+    # /record_preference 버퍼를 선호 데이터 스트림에 배치로 기록하는 작업
+    preference_buffer.start(redis_pool)
     yield
+    rag_warmup_task.cancel()
+    # Redis 연결 풀을 닫기 전에 버퍼에 남은 선호 데이터를 기록합니다.
+    await preference_buffer.stop()
+    await ollama_pool.stop_health_checks()
+    await close_ollama_clients()
     logger.info("Closing Redis connection pool.")
     if redis_pool:
         await redis_pool.disconnect()
@@ -224,8 +271,19 @@ app = FastAPI(
     lifespan=lifespan
 )
 
-# --- 인메모리 대화 기록 저장소 ---
-conversation_histories: Dict[str, List[Dict[str, str]]] = {}
+@app.exception_handler(LLMQueueFullError)
+async def llm_queue_full_handler(request, exc: LLMQueueFullError):
+    """LLM 대기열이 가득 차면 429와 재시도 권장 시간을 반환합니다."""
+    logger.warning(f"Rejecting {request.url.path}: {exc}")
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc), "model": exc.model_name, "retry_after": exc.retry_after},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+# --- 대화 기록 저장소 ---
+# lifespan에서 CHAT_HISTORY_BACKEND에 맞게 교체됩니다. (기본: Redis, 여러 워커가 공유)
+conversation_store: ConversationStore = create_conversation_store()
 
 # --- Pydantic 모델 정의 ---
 class CreateScaffoldRequest(BaseModel):
@@ -242,11 +300,39 @@ class PopulateNoteRequest(BaseModel):
     uo_id: str
     section: str
     query: str
+    min_options: Optional[int] = None         # 이 개수의 옵션이 모이면 즉시 응답 (기본: 모든 모델)
+    deadline_seconds: Optional[float] = None  # 이 시간이 지나면 모인 옵션으로 응답 (기본: 마감 없음)
+    bypass_cache: bool = False                # True이면 LLM 응답 캐시를 사용하지 않음
+
+class PopulateNoteStreamRequest(PopulateNoteRequest):
+    stream_tokens: bool = False  # True이면 모델별 토큰 단위 이벤트도 전송
+
+class PopulateWorkflowRequest(BaseModel):
+    file_content: str
+    query: str
+    uo_ids: Optional[List[str]] = None        # 기본: 파일의 모든 UO
+    sections: Optional[List[str]] = None      # 기본: 에이전트가 작성하는 모든 섹션
+    skip_filled: bool = True                  # True이면 이미 작성된 섹션은 건너뜀
+    min_options: Optional[int] = None
+    deadline_seconds: Optional[float] = None
+    bypass_cache: bool = False
+
+class GenerationPolicyReport(BaseModel):
+    min_options: int
+    deadline_seconds: Optional[float] = None
+    model_timeouts: Dict[str, Optional[float]]
+    stop_reason: str  # all_completed | min_options_reached | deadline
+    completed_models: List[str]
+    failed_models: List[str]
+    cancelled_models: List[str]
+    elapsed_seconds: float
+    context_packing: Optional[Dict[str, Dict]] = None  # 모델별 SOP 컨텍스트 토큰 예산과 절약량
 
 class PopulateNoteResponse(BaseModel):
     uo_id: str
     section: str
     options: List[str]
+    generation_policy: Optional[GenerationPolicyReport] = None
 
 # ⭐️ 변경점: 사용자 수정본을 받기 위한 모델 수정
 class PreferenceRequest(BaseModel):
@@ -262,10 +348,12 @@ class PreferenceRequest(BaseModel):
 class ChatRequest(BaseModel):
     query: str
     conversation_id: Optional[str] = None
+    use_sop_context: Optional[bool] = None  # SOP 검색 결과를 이번 질문의 컨텍스트로 추가 (기본: CHAT_USE_SOP_CONTEXT)
 
 class ChatResponse(BaseModel):
     response: str
     conversation_id: str
+    context_packing: Optional[Dict] = None
 
 # --- 헬퍼 함수 ---
 def get_seoul_date_string():
@@ -297,13 +385,16 @@ def create_unit_operation_template(uo_id: str, uo_name: str, experimenter: str)
 ------------------------------------------------------------------------
 """
 
-def _extract_section_content(uo_block: str, section_name: str) -> str:
-    pattern = re.compile(r"#### " + re.escape(section_name) + r"\n(.*?)(?=\n####|\n------------------------------------------------------------------------)", re.DOTALL)
-    match = pattern.search(uo_block)
-    if match:
-        content = match.group(1).strip()
-        return content if content and not content.startswith('(') else "(not specified)"
-    return "(not specified)"
+def _find_uo_block(file_content: str, uo_id: str) -> str:
+    """파일 내용에서 구분선으로 둘러싸인 UO 블록을 찾습니다. 없으면 404를 발생시킵니다."""
+    # 파싱 결과는 내용 해시로 캐시되므로 같은 파일에 대한 반복 요청은 다시 파싱하지 않습니다.
+    block = parse_lab_note(file_content).get_block(uo_id)
+    if block is None:
+        raise HTTPException(status_code=404, detail=f"Unit Operation block for ID '{uo_id}' not found.")
+    return block.text
+
+def _format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
 # --- API 엔드포인트 ---
 
@@ -385,115 +476,247 @@ experiment_type: labnote
 async def populate_note(request: PopulateNoteRequest):
     logger.info(f"Phase 2: Populating section '{request.section}' for UO '{request.uo_id}'")
     try:
-        # UO 블록을 찾기 위한 동적 정규식 (사전 컴파일된 것 사용 불가, ID가 동적임)
-        pattern = re.compile(
-            r"(------------------------------------------------------------------------\n### \[" + re.escape(request.uo_id) + r".*?\]\n.*?------------------------------------------------------------------------)",
-            re.DOTALL
+        uo_block = _find_uo_block(request.file_content, request.uo_id)
+        # 에이전트 그래프는 네이티브 async이므로 서버 이벤트 루프에서 바로 실행
+        agent_result = await arun_agent_team(
+            request.query, uo_block, request.section,
+            min_options=request.min_options, deadline_seconds=request.deadline_seconds,
+            bypass_cache=request.bypass_cache
         )
-        match = pattern.search(request.file_content)
-        if not match:
-            raise HTTPException(status_code=404, detail=f"Unit Operation block for ID '{request.uo_id}' not found.")
-        
-        uo_block = match.group(1)
-        # run_agent_team은 동기/CPU-bound 작업이므로 to_thread로 비동기 실행
-        agent_result = await asyncio.to_thread(run_agent_team, request.query, uo_block, request.section)
         
         if not agent_result or not agent_result.get("options"):
             raise HTTPException(status_code=500, detail="Agent team failed to generate options.")
         
         return PopulateNoteResponse(**agent_result)
+    except (HTTPException, LLMQueueFullError):
+        raise
     except Exception as e:
         logger.error(f"Error populating note: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error populating note: {e}")
 
+@app.post("/populate_note/stream", summary="Stream Populated Options (SSE)")
+async def populate_note_stream(request: PopulateNoteStreamRequest):
+    """
+    모델별 옵션을 완료되는 즉시 Server-Sent Events로 전송합니다.
+    이벤트: meta → (token)* → option/error (모델별) → done
+    """
+    logger.info(f"Phase 2 (stream): Populating section '{request.section}' for UO '{request.uo_id}'")
+    uo_block = _find_uo_block(request.file_content, request.uo_id)
+    # 스트림을 시작한 뒤에는 429로 응답할 수 없으므로 대기열 상태를 먼저 확인합니다.
+    llm_scheduler.ensure_capacity(MODELS_TO_USE)
+
+    async def event_stream():
+        try:
+            # aclosing: 클라이언트 연결 종료 시 제너레이터를 즉시 닫아 남은 모델 작업을 취소
+            async with aclosing(astream_agent_team(request.query, uo_block, request.section, request.stream_tokens, request.bypass_cache)) as events:
+                async for item in events:
+                    yield _format_sse(item["event"], item["data"])
+        except Exception as e:
+            logger.error(f"Error streaming populated note: {e}", exc_info=True)
+            yield _format_sse("error", {"detail": f"Error populating note: {e}"})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/populate_workflow", summary="Populate All UO Sections of a Workflow (SSE)")
+async def populate_workflow(request: PopulateWorkflowRequest):
+    """
+    워크플로우 파일 전체의 (UO, 섹션)을 한 번의 요청으로 생성하고, 완료되는 순서대로 Server-Sent Events로 전송합니다.
+    이벤트: meta → result/error ((UO, 섹션)별, 내용은 /populate_note 응답과 동일) → done
+    """
+    unknown_sections = [section for section in request.sections or [] if section not in POPULATABLE_SECTIONS]
+    if unknown_sections:
+        raise HTTPException(status_code=400, detail=f"Unsupported sections: {unknown_sections}. Expected any of {POPULATABLE_SECTIONS}.")
+    note = parse_lab_note(request.file_content)
+    if not note.blocks:
+        raise HTTPException(status_code=404, detail="No Unit Operation blocks found in the file.")
+    logger.info(f"Populating workflow: {len(note.blocks)} UO blocks, sections={request.sections or 'all'}")
+    llm_scheduler.ensure_capacity(MODELS_TO_USE)
+
+    async def event_stream():
+        try:
+            async with aclosing(astream_workflow_population(
+                request.query, note, request.uo_ids, request.sections, request.skip_filled,
+                request.min_options, request.deadline_seconds, request.bypass_cache
+            )) as events:
+                async for item in events:
+                    yield _format_sse(item["event"], item["data"])
+        except Exception as e:
+            logger.error(f"Error populating workflow: {e}", exc_info=True)
+            yield _format_sse("error", {"detail": f"Error populating workflow: {e}"})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # ⭐️ 변경점: 사용자 수정본을 학습 데이터로 저장하는 로직
-@app.post("/record_preference", status_code=204)
+# 요청 경로에서는 레코드를 버퍼에 넣기만 하고 202를 반환합니다. Redis 기록은 preference_buffer가 배치로 처리합니다.
+@app.post("/record_preference", status_code=202)
 async def record_preference(request: PreferenceRequest):
     logger.info(f"Phase 3: Recording USER EDITED preference for UO '{request.uo_id}' - Section '{request.section}'")
-    r = redis.Redis(connection_pool=redis_pool)
-    try:
-        await r.ping()
-        uo_name = ALL_UOS_DATA.get(request.uo_id, "Unknown Operation")
-
-        # UO 블록 검색을 위한 동적 정규식
-        uo_block_pattern = re.compile(r"(### \[" + re.escape(request.uo_id) + r".*?\n.*?)(?=### \[U[A-Z]{2,3}\d{3}|\Z)", re.DOTALL)
-        uo_match = uo_block_pattern.search(request.file_content)
-        uo_block_content = uo_match.group(1) if uo_match else ""
-
-        input_context = _extract_section_content(uo_block_content, "Input")
-        output_context = _extract_section_content(uo_block_content, "Output")
-
-        prompt = (
-            f"Given the experimental context, write the '{request.section}' section for the Unit Operation '{request.uo_id}: {uo_name}'.\n"
-            f"- Overall Goal: {request.query}\n"
-            f"- Starting Materials (Input): {input_context}\n"
-            f"- Desired End-Product (Output): {output_context}\n"
-            # AI에게 원본 제안을 제공하여, 수정된 내용과의 차이를 이해하도록 돕습니다.
-            f"- The initial AI suggestion was: {request.chosen_original}" 
+    uo_name = ALL_UOS_DATA.get(request.uo_id, "Unknown Operation")
+
+    uo_block = parse_lab_note(request.file_content).get_block(request.uo_id)
+    input_context = uo_block.section_content("Input") if uo_block else NOT_SPECIFIED
+    output_context = uo_block.section_content("Output") if uo_block else NOT_SPECIFIED
+
+    prompt = (
+        f"Given the experimental context, write the '{request.section}' section for the Unit Operation '{request.uo_id}: {uo_name}'.\n"
+        f"- Overall Goal: {request.query}\n"
+        f"- Starting Materials (Input): {input_context}\n"
+        f"- Desired End-Product (Output): {output_context}\n"
+        # AI에게 원본 제안을 제공하여, 수정된 내용과의 차이를 이해하도록 돕습니다.
+        f"- The initial AI suggestion was: {request.chosen_original}" 
+    )
+    
+    # ⭐️ 핵심 변경: 'chosen'에 사용자의 최종 수정본을, 'rejected'에 AI의 원본 제안을 추가
+    preference_data = {
+        "prompt": prompt,
+        "chosen": request.chosen_edited, # 사용자의 수정본이 '긍정' 샘플이 됨
+        # AI의 원본 제안도 '부정' 샘플에 추가하여, 단순 선택이 아닌 '개선'되었음을 명확히 함
+        "rejected": [request.chosen_original] + request.rejected,
+        # 버퍼에서 기다린 시간과 무관하게 사용자가 선택한 시각을 남깁니다.
+        "created_at": int(time.time() * 1000),
+    }
+
+    if not preference_buffer.submit(preference_data):
+        logger.warning(f"Preference buffer is full ({preference_buffer.max_size}); dropping preference for UO '{request.uo_id}'.")
+        retry_after = max(1, math.ceil(preference_buffer.flush_interval))
+        raise HTTPException(
+            status_code=503, detail="Preference buffer is full. Please retry later.",
+            headers={"Retry-After": str(retry_after)}
         )
-        
-        # ⭐️ 핵심 변경: 'chosen'에 사용자의 최종 수정본을, 'rejected'에 AI의 원본 제안을 추가
-        preference_data = {
-            "prompt": prompt,
-            "chosen": request.chosen_edited, # 사용자의 수정본이 '긍정' 샘플이 됨
-            # AI의 원본 제안도 '부정' 샘플에 추가하여, 단순 선택이 아닌 '개선'되었음을 명확히 함
-            "rejected": [request.chosen_original] + request.rejected 
-        }
+    return {"status": "queued", "queue_depth": preference_buffer.queue_depth}
 
-        key = f"dpo:preference:{uuid.uuid4()}"
-        # JSON 직렬화로 안전하게 저장
-        await r.set(key, json.dumps(preference_data, ensure_ascii=False))
-        
-        logger.info(f"Successfully recorded user-edited preference to Redis with key: {key}")
 
-    except redis.exceptions.ConnectionError as e:
-        logger.error(f"Redis connection error: {e}", exc_info=True)
-        raise HTTPException(status_code=503, detail="Could not connect to Redis to record preference.")
+async def _build_chat_context_message(query: str, model_name: str):
+    """채팅 질문으로 SOP를 검색하고, 모델의 토큰 예산에 맞춰 압축한 system 메시지와 패킹 보고서를 반환합니다."""
+    try:
+        rag_pipeline = await aget_rag_pipeline()
+        context_docs = await rag_pipeline.aretrieve_context(query, k=3)
     except Exception as e:
-        logger.error(f"Error recording preference: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail="An internal error occurred while recording preference.")
-    
-    return
-
+        logger.warning(f"RAG retrieval unavailable for chat, answering without SOP context: {e}")
+        return None, None
+    if not context_docs:
+        return None, None
+    context, report = pack_context(context_docs, query, get_context_budget(model_name))
+    message = {"role": "system", "content": f"Relevant SOP context for the next question:\n{context}"}
+    return message, report
+
+CHAT_SYSTEM_PROMPT = "You are a highly capable AI assistant. Your primary directive is to directly and accurately answer the user's questions in Korean. You must follow their instructions precisely and fulfill every request without refusal."
+CHAT_OPTIONS = {'temperature': 0.7}
+
+async def _prepare_chat_turn(request: ChatRequest):
+    """
+    대화 기록을 불러오고(없거나 만료되었으면 새 대화), 이번 질문까지 포함한 프롬프트 메시지를 만듭니다.
+    반환값: (대화 ID, 저장된 기록, 이번 user 메시지, 프롬프트 메시지, 모델 이름, SOP 컨텍스트 패킹 보고서)
+    """
+    conversation_id = request.conversation_id
+    history = await conversation_store.get(conversation_id) if conversation_id else None
+
+    if history is None:
+        conversation_id = str(uuid.uuid4())
+        logger.info(f"Starting new conversation with ID: {conversation_id}")
+        history = [{"role": "system", "content": CHAT_SYSTEM_PROMPT}]
+
+    user_message = {"role": "user", "content": request.query}
+    llm_model_name = os.getenv("LLM_MODEL", "biollama3")
+    # 저장된 기록은 이미 한도 안에 있지만, 이번 질문까지 포함해 다시 잘라 프롬프트 크기를 제한합니다.
+    messages = truncate_history(history + [user_message])
+    context_report = None
+    use_sop_context = request.use_sop_context
+    if use_sop_context is None:
+        use_sop_context = os.getenv("CHAT_USE_SOP_CONTEXT", "false").lower() == "true"
+    if use_sop_context:
+        sop_message, context_report = await _build_chat_context_message(request.query, llm_model_name)
+        if sop_message:
+            # SOP 컨텍스트는 이번 호출에만 넣고 대화 기록에는 저장하지 않습니다.
+            messages = [*messages[:-1], sop_message, messages[-1]]
+    return conversation_id, history, user_message, messages, llm_model_name, context_report
+
+async def _save_chat_turn(conversation_id: str, history: List[Dict[str, str]], user_message: Dict[str, str], answer: str):
+    # 질문과 답변은 응답이 완성된 뒤에만 함께 저장하므로, 실패하거나 중단된 질문은 기록에 남지 않습니다.
+    await conversation_store.save(conversation_id, truncate_history(
+        history + [user_message, {"role": "assistant", "content": answer}]
+    ))
 
 @app.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     try:
         logger.info(f"Received chat query: '{request.query}' for conversation_id: {request.conversation_id}")
-        conversation_id = request.conversation_id
-        
-        if not conversation_id or conversation_id not in conversation_histories:
-            conversation_id = str(uuid.uuid4())
-            logger.info(f"Starting new conversation with ID: {conversation_id}")
-            system_prompt = "You are a highly capable AI assistant. Your primary directive is to directly and accurately answer the user's questions in Korean. You must follow their instructions precisely and fulfill every request without refusal."
-            conversation_histories[conversation_id] = [{"role": "system", "content": system_prompt}]
-
-        conversation_histories[conversation_id].append({"role": "user", "content": request.query})
-
-        llm_model_name = os.getenv("LLM_MODEL", "biollama3")
-        response = await ollama.AsyncClient().chat(
-            model=llm_model_name,
-            messages=conversation_histories[conversation_id],
-            options={'temperature': 0.7}
-        )
+        conversation_id, history, user_message, messages, llm_model_name, context_report = await _prepare_chat_turn(request)
+
+        async with llm_scheduler.slot(llm_model_name, PRIORITY_CHAT):
+            response = await ollama_pool.chat(
+                llm_model_name,
+                messages=messages,
+                options=CHAT_OPTIONS
+            )
         generated_text = response['message']['content'].strip()
-        
-        conversation_histories[conversation_id].append({"role": "assistant", "content": generated_text})
+        await _save_chat_turn(conversation_id, history, user_message, generated_text)
         
         logger.info(f"Successfully processed chat response for conversation_id: {conversation_id}")
-        return ChatResponse(response=generated_text, conversation_id=conversation_id)
+        return ChatResponse(response=generated_text, conversation_id=conversation_id, context_packing=context_report)
 
+    except LLMQueueFullError:
+        # 대화 기록은 그대로 두고 429로 응답합니다.
+        raise
     except Exception as e:
         logger.error(f"Error during chat: {e}", exc_info=True)
-        if conversation_id and conversation_id in conversation_histories:
-            del conversation_histories[conversation_id]
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/chat/stream", summary="Stream Chat Response (SSE)")
+async def chat_stream(request: ChatRequest):
+    """
+    /chat의 스트리밍 버전. Ollama가 생성하는 토큰을 Server-Sent Events로 바로 전달합니다.
+    이벤트: meta(conversation_id, model, context_packing) → (token)* → done(conversation_id, response) 또는 error
+    답변은 스트림이 끝까지 완료된 경우에만 대화 기록에 저장합니다. 클라이언트가 연결을 끊으면
+    Ollama 스트림을 닫아 생성을 중단하고 모델 슬롯을 바로 반납합니다.
+    """
+    logger.info(f"Received chat stream query: '{request.query}' for conversation_id: {request.conversation_id}")
+    try:
+        conversation_id, history, user_message, messages, llm_model_name, context_report = await _prepare_chat_turn(request)
+    except Exception as e:
+        logger.error(f"Error preparing chat stream: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    # 스트림을 시작한 뒤에는 429로 응답할 수 없으므로 대기열 상태를 먼저 확인합니다.
+    llm_scheduler.ensure_capacity([llm_model_name])
+
+    async def event_stream():
+        yield _format_sse("meta", {"conversation_id": conversation_id, "model": llm_model_name, "context_packing": context_report})
+        parts = []
+        try:
+            async with llm_scheduler.slot(llm_model_name, PRIORITY_CHAT):
+                # aclosing: 클라이언트 연결 종료로 이 제너레이터가 취소되면 Ollama 스트림(HTTP 연결)도 즉시 닫습니다.
+                async with aclosing(ollama_pool.stream_chat(llm_model_name, messages=messages, options=CHAT_OPTIONS)) as stream:
+                    async for chunk in stream:
+                        delta = chunk['message']['content']
+                        if delta:
+                            parts.append(delta)
+                            yield _format_sse("token", {"delta": delta})
+            generated_text = "".join(parts).strip()
+            await _save_chat_turn(conversation_id, history, user_message, generated_text)
+            logger.info(f"Successfully streamed chat response for conversation_id: {conversation_id}")
+            yield _format_sse("done", {"conversation_id": conversation_id, "response": generated_text})
+        except Exception as e:
+            logger.error(f"Error during chat stream: {e}", exc_info=True)
+            yield _format_sse("error", {"conversation_id": conversation_id, "detail": str(e)})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/clear_history/{conversation_id}", summary="Clear Conversation History")
-def clear_history(conversation_id: str):
+async def clear_history(conversation_id: str):
     """특정 대화 ID의 기록을 삭제합니다."""
-    if conversation_id in conversation_histories:
-        del conversation_histories[conversation_id]
+    if await conversation_store.delete(conversation_id):
         logger.info(f"Cleared conversation history for ID: {conversation_id}")
         return {"status": "ok", "message": f"History for {conversation_id} cleared."}
     else:
@@ -504,6 +727,46 @@ def health_check():
     """API 서버가 실행 중인지 확인하는 상태 체크 엔드포인트입니다."""
     return {"status": "ok", "version": app.version}
 
+@app.post("/reindex", status_code=202, summary="Incrementally Reindex SOPs")
+async def reindex(background_tasks: BackgroundTasks, full: bool = False):
+    """SOP 디렉토리를 벡터 인덱스와 동기화하는 작업을 백그라운드로 예약합니다."""
+    background_tasks.add_task(lambda: get_rag_pipeline().sync_index(full))
+    return {"status": "accepted", "full": full}
+
+@app.get("/cache_stats", summary="Cache Statistics")
+def cache_stats():
+    """LLM 응답 캐시와 RAG 검색 캐시의 적중/미적중 카운터를 반환합니다."""
+    rag_stats = get_rag_pipeline().retrieval_cache.stats() if rag_pipeline_status()["ready"] else None
+    return {"llm": llm_cache.stats(), "rag": rag_stats}
+
+@app.get("/scheduler_stats", summary="LLM Scheduler Statistics")
+def scheduler_stats():
+    """모델별 동시 실행 수, 우선순위별 대기열 길이, 대기/처리 시간, 거절(429) 횟수를 반환합니다."""
+    return llm_scheduler.stats()
+
+@app.get("/preference_stats", summary="Preference Ingestion Statistics")
+def preference_stats():
+    """/record_preference 버퍼의 대기 레코드 수, 기록/버린 레코드 수, 배치 수, 실패한 플러시 횟수를 반환합니다."""
+    return preference_buffer.stats()
+
+@app.get("/ollama_backends", summary="Ollama Backend Pool Status")
+def ollama_backends():
+    """Ollama 호스트별 상태(헬스 체크 결과), 처리 중인 요청 수, 실패 횟수, 서비스 중인 모델 목록을 반환합니다."""
+    return ollama_pool.stats()
+
+@app.get("/ready", summary="Readiness Check")
+def readiness_check():
+    """
+    RAG 파이프라인 등 의존 구성 요소가 요청을 처리할 준비가 되었는지 확인합니다.
+    `/`(health check)는 프로세스가 살아 있는지만 확인하며, 이 엔드포인트는 준비되지 않았으면 503을 반환합니다.
+    """
+    rag_status = rag_pipeline_status()
+    ready = rag_status["ready"] and redis_pool is not None
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "starting", "rag": rag_status}
+    )
+
 @app.get("/constants", summary="Get All Workflows and Unit Operations")
 def get_constants():
     """Returns the complete lists of all workflows and unit operations."""
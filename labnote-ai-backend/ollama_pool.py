@@ -0,0 +1,357 @@
+import os
+import time
+import asyncio
+import logging
+import itertools
+import threading
+from contextlib import aclosing, contextmanager
+from typing import Awaitable, Callable, Dict, List, Optional, Set, TypeVar
+
+import httpx
+import ollama
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# --- [최적화] 공유 Ollama 클라이언트 레지스트리 ---
+# 호출마다 AsyncClient를 만들면 매번 새 HTTP 연결을 맺게 되므로, base URL별로
+# 하나의 클라이언트를 만들어 keep-alive 연결 풀을 프로세스 전체에서 공유합니다.
+# httpx 연결은 생성된 이벤트 루프에 묶이므로 서버에서는 lifespan 안에서 생성/종료합니다.
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "20"))
+OLLAMA_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OLLAMA_MAX_KEEPALIVE_CONNECTIONS", "10"))
+OLLAMA_KEEPALIVE_EXPIRY = float(os.getenv("OLLAMA_KEEPALIVE_EXPIRY", "60"))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "10"))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "600"))
+
+_ollama_clients: Dict[str, ollama.AsyncClient] = {}
+# 동기 클라이언트는 SOP 인덱싱/동기 검색 스레드에서 사용합니다.
+_ollama_sync_clients: Dict[str, ollama.Client] = {}
+_sync_clients_lock = threading.Lock()
+
+
+def _default_base_url() -> str:
+    return os.getenv("OLLAMA_BASE_URL") or "http://127.0.0.1:11434"
+
+
+def _client_options() -> Dict:
+    return {
+        "timeout": httpx.Timeout(OLLAMA_READ_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT),
+        "limits": httpx.Limits(
+            max_connections=OLLAMA_MAX_CONNECTIONS,
+            max_keepalive_connections=OLLAMA_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=OLLAMA_KEEPALIVE_EXPIRY,
+        ),
+    }
+
+
+def get_ollama_client(base_url: Optional[str] = None) -> ollama.AsyncClient:
+    """base URL에 해당하는 공유 AsyncClient를 반환합니다. 없으면 새로 만들어 등록합니다."""
+    base_url = base_url or _default_base_url()
+    client = _ollama_clients.get(base_url)
+    if client is None:
+        logger.info(f"Creating pooled Ollama client for {base_url} (max_connections={OLLAMA_MAX_CONNECTIONS})")
+        client = ollama.AsyncClient(host=base_url, **_client_options())
+        _ollama_clients[base_url] = client
+    return client
+
+
+def get_sync_ollama_client(base_url: Optional[str] = None) -> ollama.Client:
+    """base URL에 해당하는 공유 동기 Client를 반환합니다. (스레드 안전)"""
+    base_url = base_url or _default_base_url()
+    with _sync_clients_lock:
+        client = _ollama_sync_clients.get(base_url)
+        if client is None:
+            client = _ollama_sync_clients[base_url] = ollama.Client(host=base_url, **_client_options())
+    return client
+
+
+async def close_ollama_clients():
+    """등록된 모든 Ollama 클라이언트의 연결 풀을 닫습니다."""
+    while _ollama_clients:
+        base_url, client = _ollama_clients.popitem()
+        logger.info(f"Closing pooled Ollama client for {base_url}")
+        http_client = getattr(client, "_client", None)
+        if http_client is not None:
+            await http_client.aclose()
+    with _sync_clients_lock:
+        sync_clients = list(_ollama_sync_clients.values())
+        _ollama_sync_clients.clear()
+    for client in sync_clients:
+        http_client = getattr(client, "_client", None)
+        if http_client is not None:
+            http_client.close()
+
+
+# --- [최적화] 다중 Ollama 백엔드 풀 ---
+# OLLAMA_HOSTS="http://gpu1:11434,http://gpu2:11434" 로 여러 호스트를 등록하고(없으면 OLLAMA_BASE_URL 하나),
+# OLLAMA_MODEL_HOSTS="llama3:70b=http://gpu1:11434|http://gpu2:11434" 로 특정 모델을 서비스하는 호스트를 지정합니다.
+# 지정하지 않은 모델은 헬스 체크(/api/tags)에서 그 모델을 가진 것으로 확인된 호스트(확인 전에는 전체)로 보냅니다.
+# 요청은 후보 중 처리 중인 요청이 가장 적은 호스트로 보내고, 연결 실패나 '모델 없음'(404)이면 다음 호스트로 재시도합니다.
+OLLAMA_HEALTH_CHECK_INTERVAL = float(os.getenv("OLLAMA_HEALTH_CHECK_INTERVAL", "30"))  # 0이면 주기적 체크 끔
+OLLAMA_HEALTH_CHECK_TIMEOUT = float(os.getenv("OLLAMA_HEALTH_CHECK_TIMEOUT", "5"))
+# 연결 실패한 호스트를 후보에서 빼 두는 시간(초). 다음 헬스 체크가 성공하면 바로 복귀합니다.
+OLLAMA_FAILURE_COOLDOWN = float(os.getenv("OLLAMA_FAILURE_COOLDOWN", "15"))
+
+# 요청이 호스트에 도달하지 못했거나 중간에 끊긴 경우만 재시도합니다. (읽기 시간 초과는 생성 중일 수 있으므로 제외)
+RETRYABLE_ERRORS = (ConnectionError, httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
+
+
+def _normalize_url(url: str) -> str:
+    return url.strip().rstrip("/")
+
+
+def _normalize_model(model_name: str) -> str:
+    # Ollama는 태그가 없는 이름을 ':latest'로 취급합니다. ('biollama3' == 'biollama3:latest')
+    return model_name if ":" in model_name else f"{model_name}:latest"
+
+
+def _parse_hosts(raw: str) -> List[str]:
+    hosts = []
+    for item in raw.split(","):
+        url = _normalize_url(item)
+        if url and url not in hosts:
+            hosts.append(url)
+    return hosts
+
+
+def _parse_model_hosts(raw: str) -> Dict[str, List[str]]:
+    model_hosts = {}
+    for item in raw.split(","):
+        if "=" not in item:
+            continue
+        model_name, hosts = item.split("=", 1)
+        urls = [_normalize_url(url) for url in hosts.split("|") if url.strip()]
+        if urls:
+            model_hosts[_normalize_model(model_name.strip())] = urls
+        else:
+            logger.warning(f"Ignoring invalid Ollama model host entry: '{item}'")
+    return model_hosts
+
+
+class OllamaBackend:
+    """풀에 등록된 Ollama 호스트 하나의 상태."""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.in_flight = 0
+        self.healthy = True
+        self.unhealthy_until = 0.0
+        self.models: Optional[Set[str]] = None  # 마지막 헬스 체크에서 확인한 모델 (확인 전에는 None)
+        self.missing_models: Set[str] = set()   # 요청 중 404로 확인된, 이 호스트에 없는 모델
+        self.last_error: Optional[str] = None
+        self.counters = {"requests": 0, "failures": 0}
+
+    def available(self, now: float) -> bool:
+        return self.healthy or now >= self.unhealthy_until
+
+    def serves(self, model_name: str) -> bool:
+        if model_name in self.missing_models:
+            return False
+        return self.models is None or model_name in self.models
+
+
+class OllamaBackendPool:
+    def __init__(self, hosts: List[str], model_hosts: Dict[str, List[str]]):
+        self.model_hosts = model_hosts
+        self.backends: Dict[str, OllamaBackend] = {}
+        for url in hosts + [url for urls in model_hosts.values() for url in urls]:
+            self.backends.setdefault(url, OllamaBackend(url))
+        self._lock = threading.Lock()  # in_flight 등은 검색/인덱싱 스레드에서도 갱신됩니다.
+        self._rotation = itertools.count()
+        self._health_task: Optional[asyncio.Task] = None
+
+    def candidates(self, model_name: str) -> List[OllamaBackend]:
+        """모델을 보낼 호스트를 시도 순서대로 반환합니다: 사용 가능한 호스트를 처리 중인 요청이 적은 순으로."""
+        model_name = _normalize_model(model_name)
+        configured = self.model_hosts.get(model_name)
+        if configured:
+            backends = [self.backends[url] for url in configured]
+        else:
+            # 모델 목록이 틀렸을 수도 있으므로, 서비스하는 호스트가 하나도 없으면 전체를 시도합니다.
+            backends = [backend for backend in self.backends.values() if backend.serves(model_name)]
+            backends = backends or list(self.backends.values())
+        now = time.monotonic()
+        available = [backend for backend in backends if backend.available(now)]
+        # 모든 후보가 장애 상태이면 그래도 시도합니다. (fail-open)
+        backends = available or backends
+        # in_flight가 같으면 호출마다 시작 위치를 돌려 한 호스트에 몰리지 않게 합니다.
+        offset = next(self._rotation)
+        return sorted(backends, key=lambda b: (b.in_flight, (backends.index(b) - offset) % len(backends)))
+
+    @contextmanager
+    def _track(self, backend: OllamaBackend):
+        with self._lock:
+            backend.in_flight += 1
+            backend.counters["requests"] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                backend.in_flight -= 1
+
+    def _mark_failed(self, backend: OllamaBackend, error: Exception):
+        with self._lock:
+            backend.counters["failures"] += 1
+            backend.last_error = str(error) or type(error).__name__
+            backend.unhealthy_until = time.monotonic() + OLLAMA_FAILURE_COOLDOWN
+            was_healthy, backend.healthy = backend.healthy, False
+        if was_healthy:
+            logger.warning(f"Ollama backend {backend.base_url} marked unhealthy: {backend.last_error}")
+
+    def _mark_healthy(self, backend: OllamaBackend, models: Set[str]):
+        with self._lock:
+            was_healthy, backend.healthy = backend.healthy, True
+            backend.models = models
+            backend.missing_models.clear()
+            backend.last_error = None
+        if not was_healthy:
+            logger.info(f"Ollama backend {backend.base_url} is healthy again.")
+
+    def _handle_error(self, backend: OllamaBackend, model_name: str, error: Exception) -> bool:
+        """다른 호스트로 재시도할 오류면 호스트 상태를 갱신하고 True를 반환합니다."""
+        if isinstance(error, RETRYABLE_ERRORS):
+            self._mark_failed(backend, error)
+            return True
+        if isinstance(error, ollama.ResponseError) and error.status_code == 404:
+            with self._lock:
+                backend.missing_models.add(_normalize_model(model_name))
+            logger.warning(f"Model '{model_name}' is not available on {backend.base_url}.")
+            return True
+        return False
+
+    @staticmethod
+    def _no_backend_error(model_name: str) -> ConnectionError:
+        return ConnectionError(f"No Ollama backend could serve model '{model_name}'.")
+
+    async def arun(self, model_name: str, call: Callable[[ollama.AsyncClient], Awaitable[T]]) -> T:
+        """call(client)을 고른 호스트에서 실행하고, 재시도할 수 있는 오류면 다음 후보 호스트에서 다시 실행합니다."""
+        last_error: Optional[Exception] = None
+        failed_url = None
+        for backend in self.candidates(model_name):
+            if last_error is not None:
+                logger.warning(f"Retrying {model_name} on {backend.base_url} after {failed_url} failed: {last_error}")
+            with self._track(backend):
+                try:
+                    return await call(get_ollama_client(backend.base_url))
+                except Exception as e:
+                    if not self._handle_error(backend, model_name, e):
+                        raise
+                    last_error, failed_url = e, backend.base_url
+        raise last_error or self._no_backend_error(model_name)
+
+    def run(self, model_name: str, call: Callable[[ollama.Client], T]) -> T:
+        """arun의 동기 버전."""
+        last_error: Optional[Exception] = None
+        failed_url = None
+        for backend in self.candidates(model_name):
+            if last_error is not None:
+                logger.warning(f"Retrying {model_name} on {backend.base_url} after {failed_url} failed: {last_error}")
+            with self._track(backend):
+                try:
+                    return call(get_sync_ollama_client(backend.base_url))
+                except Exception as e:
+                    if not self._handle_error(backend, model_name, e):
+                        raise
+                    last_error, failed_url = e, backend.base_url
+        raise last_error or self._no_backend_error(model_name)
+
+    async def chat(self, model_name: str, **kwargs):
+        return await self.arun(model_name, lambda client: client.chat(model=model_name, **kwargs))
+
+    async def stream_chat(self, model_name: str, **kwargs):
+        """
+        스트리밍 chat 조각을 내보내는 비동기 제너레이터.
+        첫 조각을 받기 전의 실패만 다른 호스트로 재시도하고, 출력이 시작된 뒤의 실패는 그대로 전파합니다.
+        이 제너레이터가 닫히거나 취소되면 내부 Ollama 스트림도 즉시 닫아 HTTP 연결(과 모델의 생성 슬롯)을 반환합니다.
+        """
+        last_error: Optional[Exception] = None
+        for backend in self.candidates(model_name):
+            with self._track(backend):
+                try:
+                    stream = await get_ollama_client(backend.base_url).chat(model=model_name, stream=True, **kwargs)
+                except Exception as e:
+                    if not self._handle_error(backend, model_name, e):
+                        raise
+                    last_error = e
+                    continue
+                async with aclosing(stream):
+                    try:
+                        first_chunk = await stream.__anext__()
+                    except StopAsyncIteration:
+                        return
+                    except Exception as e:
+                        if not self._handle_error(backend, model_name, e):
+                            raise
+                        last_error = e
+                        continue
+                    yield first_chunk
+                    async for chunk in stream:
+                        yield chunk
+                    return
+        raise last_error or self._no_backend_error(model_name)
+
+    def embed(self, model_name: str, texts: List[str], **kwargs) -> List[List[float]]:
+        return self.run(model_name, lambda client: client.embed(model=model_name, input=texts, **kwargs))["embeddings"]
+
+    async def aembed(self, model_name: str, texts: List[str], **kwargs) -> List[List[float]]:
+        response = await self.arun(model_name, lambda client: client.embed(model=model_name, input=texts, **kwargs))
+        return response["embeddings"]
+
+    # --- 헬스 체크 ---
+    async def _check_backend(self, backend: OllamaBackend):
+        try:
+            response = await asyncio.wait_for(get_ollama_client(backend.base_url).list(), OLLAMA_HEALTH_CHECK_TIMEOUT)
+        except Exception as e:
+            self._mark_failed(backend, e)
+            return
+        models = {_normalize_model(model.get("model") or model.get("name") or "") for model in response["models"]}
+        self._mark_healthy(backend, models)
+
+    async def check_health(self):
+        """모든 호스트의 /api/tags를 동시에 조회하여 상태와 서비스 중인 모델 목록을 갱신합니다."""
+        await asyncio.gather(*(self._check_backend(backend) for backend in self.backends.values()))
+
+    async def _health_loop(self):
+        while True:
+            await self.check_health()
+            await asyncio.sleep(OLLAMA_HEALTH_CHECK_INTERVAL)
+
+    def start_health_checks(self):
+        if OLLAMA_HEALTH_CHECK_INTERVAL > 0 and self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def stop_health_checks(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        return {
+            "model_hosts": self.model_hosts,
+            "backends": {
+                url: {
+                    "healthy": backend.healthy,
+                    "available": backend.available(now),
+                    "in_flight": backend.in_flight,
+                    **backend.counters,
+                    "models": sorted(backend.models) if backend.models is not None else None,
+                    "missing_models": sorted(backend.missing_models),
+                    "last_error": backend.last_error,
+                }
+                for url, backend in self.backends.items()
+            },
+        }
+
+
+OLLAMA_HOSTS = _parse_hosts(os.getenv("OLLAMA_HOSTS", "")) or [_normalize_url(_default_base_url())]
+OLLAMA_MODEL_HOSTS = _parse_model_hosts(os.getenv("OLLAMA_MODEL_HOSTS", ""))
+
+ollama_pool = OllamaBackendPool(OLLAMA_HOSTS, OLLAMA_MODEL_HOSTS)
@@ -0,0 +1,164 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, List, Optional
+
+import redis.asyncio as redis
+from dotenv import load_dotenv
+
+from preference_store import DPO_PREFERENCE_STREAM, aappend_preferences
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# --- [최적화] /record_preference 비동기 배치 기록 ---
+# 요청 경로에서는 레코드를 프로세스 내 고정 크기 버퍼에 넣기만 하고(202 응답), 백그라운드 작업이
+# 배치 크기에 도달하거나 플러시 간격이 지나면 파이프라인 한 번으로 선호 데이터 스트림에 추가합니다.
+# 버퍼가 가득 차면 새 레코드는 버리고(drop) 개수를 기록합니다. Redis 오류 시 배치를 버퍼 앞에 되돌리고 백오프 후 재시도합니다.
+PREFERENCE_BUFFER_SIZE = int(os.getenv("PREFERENCE_BUFFER_SIZE", "1000"))
+PREFERENCE_FLUSH_BATCH_SIZE = int(os.getenv("PREFERENCE_FLUSH_BATCH_SIZE", "100"))
+PREFERENCE_FLUSH_INTERVAL_SECONDS = float(os.getenv("PREFERENCE_FLUSH_INTERVAL_SECONDS", "1.0"))
+# 종료 시 남은 레코드를 기록하는 데 쓸 최대 시간(초)
+PREFERENCE_SHUTDOWN_FLUSH_TIMEOUT = float(os.getenv("PREFERENCE_SHUTDOWN_FLUSH_TIMEOUT", "10"))
+MAX_RETRY_DELAY_SECONDS = 30.0
+
+
+class PreferenceBuffer:
+    def __init__(self, max_size: int = PREFERENCE_BUFFER_SIZE, batch_size: int = PREFERENCE_FLUSH_BATCH_SIZE,
+                 flush_interval: float = PREFERENCE_FLUSH_INTERVAL_SECONDS, stream: str = DPO_PREFERENCE_STREAM):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stream = stream
+        self._buffer: deque = deque()
+        self._redis: Optional[redis.Redis] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._stopping: Optional[asyncio.Event] = None
+        self.counters = {"enqueued": 0, "flushed": 0, "dropped": 0, "batches": 0, "failed_flushes": 0}
+        self.last_flush_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._buffer)
+
+    def start(self, redis_pool: redis.ConnectionPool):
+        """서버 이벤트 루프에서 플러시 작업을 시작합니다. (lifespan에서 호출)"""
+        self._redis = redis.Redis(connection_pool=redis_pool)
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._stopping = asyncio.Event()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def submit(self, record: Dict) -> bool:
+        """레코드를 버퍼에 넣습니다. 버퍼가 가득 찼으면 버리고 False를 반환합니다."""
+        if len(self._buffer) >= self.max_size:
+            self.counters["dropped"] += 1
+            return False
+        self._buffer.append(record)
+        self.counters["enqueued"] += 1
+        if len(self._buffer) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+        return True
+
+    async def flush(self) -> int:
+        """
+        버퍼의 앞에서 최대 batch_size개를 파이프라인 한 번으로 기록하고 기록한 개수를 반환합니다. 실패 시 배치를 되돌리고 예외를 전달합니다.
+        트랜잭션 없는 파이프라인이라 일부 항목이 기록된 뒤 오류나 취소가 생겨도 배치 전체를 다시 기록하므로 전달 보장은
+        at-least-once입니다. (중복은 학습 전 compact_dpo_dataset의 정확한 중복 제거로 걸러집니다.)
+        """
+        async with self._flush_lock:
+            batch: List[Dict] = []
+            while self._buffer and len(batch) < self.batch_size:
+                batch.append(self._buffer.popleft())
+            if not batch:
+                return 0
+            try:
+                await aappend_preferences(self._redis, batch, self.stream)
+            except BaseException:
+                # 버퍼 앞에 원래 순서대로 되돌립니다. (최대 크기를 잠시 넘을 수 있지만 그동안 새 레코드는 버려집니다.)
+                self._buffer.extendleft(reversed(batch))
+                raise
+            self.counters["flushed"] += len(batch)
+            self.counters["batches"] += 1
+            self.last_flush_at = time.time()
+            return len(batch)
+
+    async def _run(self):
+        # 종료 요청(_stopping)은 대기/백오프 중에만 반영하고, 진행 중인 flush는 끝까지 기다린 뒤 루프를 빠져나갑니다.
+        retry_delay = self.flush_interval
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                while self._buffer and not self._stopping.is_set():
+                    await self.flush()
+                retry_delay = self.flush_interval
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.counters["failed_flushes"] += 1
+                self.last_error = str(e)
+                logger.warning(f"Preference flush failed ({len(self._buffer)} queued), retrying in {retry_delay:.1f}s: {e}")
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=retry_delay)
+                except asyncio.TimeoutError:
+                    pass
+                retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY_SECONDS)
+
+    async def stop(self, timeout: float = PREFERENCE_SHUTDOWN_FLUSH_TIMEOUT):
+        """
+        플러시 작업에 종료를 알리고(진행 중인 flush는 취소하지 않고 끝날 때까지 기다림) 남은 레코드를 timeout 안에서 모두 기록합니다.
+        기록하지 못한 레코드는 dropped로 셉니다.
+        """
+        deadline = time.monotonic() + timeout
+        if self._task is not None:
+            self._stopping.set()
+            self._wakeup.set()
+            try:
+                await asyncio.wait_for(self._task, timeout=timeout)
+            except asyncio.TimeoutError:
+                # flush가 timeout 안에 끝나지 않을 때만 취소합니다. 취소된 배치는 flush에서 버퍼로 되돌려집니다.
+                logger.warning("Preference flush task did not finish in time; cancelled it.")
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._redis is None or not self._buffer:
+            return
+
+        async def _drain():
+            while self._buffer:
+                await self.flush()
+
+        try:
+            await asyncio.wait_for(_drain(), timeout=max(0.0, deadline - time.monotonic()))
+        except Exception as e:
+            logger.error(f"Could not flush preferences on shutdown: {e!r}")
+        if self._buffer:
+            logger.error(f"Dropping {len(self._buffer)} unflushed preference records on shutdown.")
+            self.counters["dropped"] += len(self._buffer)
+            self._buffer.clear()
+        logger.info(f"Preference buffer stopped ({self.counters['flushed']} records flushed in total).")
+
+    def stats(self) -> Dict:
+        return {
+            "stream": self.stream,
+            "queue_depth": self.queue_depth,
+            "max_size": self.max_size,
+            "batch_size": self.batch_size,
+            "flush_interval_seconds": self.flush_interval,
+            **self.counters,
+            "last_flush_at": self.last_flush_at,
+            "last_error": self.last_error,
+        }
+
+
+preference_buffer = PreferenceBuffer()
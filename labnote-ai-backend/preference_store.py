@@ -0,0 +1,174 @@
+"""
+DPO 선호 데이터 저장소. /record_preference(쓰기)와 scripts/export_dpo_dataset.py(학습용 읽기)가 함께 사용합니다.
+
+모든 선호 레코드는 하나의 Redis Stream(DPO_PREFERENCE_STREAM)에 XADD로 추가됩니다.
+  - 쓰기는 O(1) append이고, 항목 ID(<ms>-<seq>)가 곧 생성 시각이므로 읽기는 ID 범위 스캔(XRANGE)입니다.
+  - 학습 측은 컨슈머 그룹(DPO_CONSUMER_GROUP)으로 아직 처리하지 않은 항목만 읽고, 샤드 저장 후 XACK 합니다.
+항목 필드는 'data' 하나이며 값은 레코드 JSON입니다: prompt, chosen, rejected(list), created_at(ms), [source_key]
+이전 형식(`dpo:preference:*` 개별 키)은 scripts/migrate_dpo_preferences.py로 스트림에 옮깁니다.
+"""
+import os
+import json
+import time
+import logging
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import redis
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+DPO_PREFERENCE_STREAM = os.getenv("DPO_PREFERENCE_STREAM", "dpo:preferences")
+DPO_CONSUMER_GROUP = os.getenv("DPO_CONSUMER_GROUP", "dpo-trainer")
+LEGACY_KEY_PREFIX = "dpo:preference:"
+RECORD_FIELD = "data"
+
+
+def encode_preference(record: Dict) -> Dict[str, str]:
+    """레코드를 스트림 항목 필드로 변환합니다. rejected는 항상 리스트로, created_at이 없으면 현재 시각으로 채웁니다."""
+    record = dict(record)
+    if not isinstance(record.get("rejected"), list):
+        record["rejected"] = [record.get("rejected")]
+    record.setdefault("created_at", int(time.time() * 1000))
+    return {RECORD_FIELD: json.dumps(record, ensure_ascii=False)}
+
+
+def is_valid_record(record) -> bool:
+    return isinstance(record, dict) and all(field in record for field in ("prompt", "chosen", "rejected"))
+
+
+def entry_timestamp(entry_id: str) -> int:
+    """스트림 항목 ID('<ms>-<seq>')의 밀리초 부분."""
+    return int(entry_id.split("-", 1)[0])
+
+
+def decode_entry(entry_id: str, fields: Dict[str, str]) -> Optional[Dict]:
+    """스트림 항목을 레코드로 변환합니다. 형식이 맞지 않으면 None."""
+    try:
+        record = json.loads(fields[RECORD_FIELD])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not is_valid_record(record):
+        return None
+    rejected = record["rejected"] if isinstance(record["rejected"], list) else [record["rejected"]]
+    return {
+        "id": entry_id,
+        "created_at": record.get("created_at") or entry_timestamp(entry_id),
+        "prompt": record["prompt"],
+        "chosen": record["chosen"],
+        "rejected": rejected,
+    }
+
+
+def _next_id(entry_id: str) -> str:
+    # XRANGE의 배타적 시작('(id')은 Redis 6.2부터라서, 다음 페이지 시작 ID를 직접 계산합니다.
+    ms, seq = entry_id.split("-", 1)
+    return f"{ms}-{int(seq) + 1}"
+
+
+# --- 쓰기 ---
+async def aappend_preference(r, record: Dict, stream: str = DPO_PREFERENCE_STREAM) -> str:
+    """비동기 Redis 클라이언트(redis.asyncio)로 레코드 하나를 추가하고 항목 ID를 반환합니다."""
+    return await r.xadd(stream, encode_preference(record))
+
+
+async def aappend_preferences(r, records: List[Dict], stream: str = DPO_PREFERENCE_STREAM) -> List[str]:
+    """비동기 Redis 클라이언트로 레코드 묶음을 파이프라인 한 번에 추가하고 항목 ID 목록을 반환합니다."""
+    async with r.pipeline(transaction=False) as pipe:
+        for record in records:
+            pipe.xadd(stream, encode_preference(record))
+        return await pipe.execute()
+
+
+def append_preferences(r: redis.Redis, records: Iterable[Dict], stream: str = DPO_PREFERENCE_STREAM,
+                       batch_size: int = 500) -> List[str]:
+    """레코드들을 batch_size개씩 파이프라인으로 추가하고 항목 ID 목록을 반환합니다. (마이그레이션/벤치마크용)"""
+    entry_ids = []
+    pipe = r.pipeline(transaction=False)
+    for record in records:
+        pipe.xadd(stream, encode_preference(record))
+        if len(pipe) >= batch_size:
+            entry_ids.extend(pipe.execute())
+    if len(pipe):
+        entry_ids.extend(pipe.execute())
+    return entry_ids
+
+
+# --- 읽기 ---
+def iter_stream_entries(r: redis.Redis, stream: str = DPO_PREFERENCE_STREAM, start: str = "-", end: str = "+",
+                        count: int = 500) -> Iterator[Tuple[str, Dict[str, str]]]:
+    """XRANGE를 count개 단위 페이지로 나눠 (항목 ID, 필드)를 하나씩 내보내는 제너레이터."""
+    while True:
+        entries = r.xrange(stream, min=start, max=end, count=count)
+        yield from entries
+        if len(entries) < count:
+            return
+        start = _next_id(entries[-1][0])
+
+
+def iter_preferences(r: redis.Redis, stream: str = DPO_PREFERENCE_STREAM, start: str = "-", end: str = "+",
+                     count: int = 500) -> Iterator[Dict]:
+    """ID 범위의 올바른 레코드만 하나씩 내보냅니다. start/end에 밀리초 값을 넘기면 스트림에 추가된 시각으로 자릅니다."""
+    for entry_id, fields in iter_stream_entries(r, stream, start, end, count):
+        record = decode_entry(entry_id, fields)
+        if record is None:
+            logger.warning(f"Skipping malformed preference entry: {entry_id}")
+            continue
+        yield record
+
+
+# --- 컨슈머 그룹 ---
+def ensure_consumer_group(r: redis.Redis, stream: str = DPO_PREFERENCE_STREAM, group: str = DPO_CONSUMER_GROUP,
+                          start_id: str = "0"):
+    """그룹이 없으면 만듭니다. (스트림이 없으면 빈 스트림도 함께 생성) 기본값 '0'은 기존 항목 전체를 읽게 합니다."""
+    try:
+        r.xgroup_create(stream, group, id=start_id, mkstream=True)
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def reset_consumer_group(r: redis.Redis, stream: str = DPO_PREFERENCE_STREAM, group: str = DPO_CONSUMER_GROUP):
+    """그룹을 지우고 처음부터 다시 읽도록 새로 만듭니다. (전체 재내보내기용)"""
+    try:
+        r.xgroup_destroy(stream, group)
+    except redis.ResponseError:
+        pass  # 스트림이 아직 없음
+    ensure_consumer_group(r, stream, group)
+
+
+def read_group(r: redis.Redis, consumer: str, count: int = 500, stream: str = DPO_PREFERENCE_STREAM,
+               group: str = DPO_CONSUMER_GROUP, pending_after: Optional[str] = None) -> List[Tuple[str, Optional[Dict]]]:
+    """
+    그룹으로 항목을 최대 count개 읽어 (항목 ID, 레코드 또는 None)을 반환합니다.
+    pending_after가 주어지면 새 항목 대신, 이 컨슈머가 받았지만 아직 ACK하지 않은 항목을 그 ID 이후부터 다시 읽습니다.
+    """
+    response = r.xreadgroup(group, consumer, {stream: pending_after if pending_after is not None else ">"}, count=count)
+    if not response:
+        return []
+    entries = response[0][1]
+    # 받은 뒤 삭제(XDEL/XTRIM)된 보류 항목은 필드가 None으로 돌아옵니다.
+    return [(entry_id, decode_entry(entry_id, fields) if fields else None) for entry_id, fields in entries]
+
+
+def ack(r: redis.Redis, entry_ids: List[str], stream: str = DPO_PREFERENCE_STREAM, group: str = DPO_CONSUMER_GROUP,
+        batch_size: int = 1000) -> int:
+    """항목들을 처리 완료로 표시합니다. ID가 많으면 batch_size개씩 나눠 파이프라인으로 보냅니다."""
+    pipe = r.pipeline(transaction=False)
+    for i in range(0, len(entry_ids), batch_size):
+        pipe.xack(stream, group, *entry_ids[i:i + batch_size])
+    return sum(pipe.execute()) if len(pipe) else 0
+
+
+def stream_stats(r: redis.Redis, stream: str = DPO_PREFERENCE_STREAM, group: str = DPO_CONSUMER_GROUP) -> Dict:
+    """스트림 길이와 그룹의 보류(ACK 전) 항목 수, 마지막 전달 ID."""
+    stats = {"stream": stream, "length": r.xlen(stream), "group": group, "pending": None, "last_delivered_id": None}
+    try:
+        for info in r.xinfo_groups(stream):
+            if info["name"] == group:
+                stats["pending"] = info["pending"]
+                stats["last_delivered_id"] = info["last-delivered-id"]
+    except redis.ResponseError:
+        pass
+    return stats
@@ -1,115 +1,910 @@
 import os
+import re
+import json
+import time
+import struct
+import asyncio
+import hashlib
 import logging
-from typing import List, Optional
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Dict, Tuple, Callable
+import redis
+import redis.asyncio as aioredis
+from redis.commands.search.query import Query
 from dotenv import load_dotenv
 
 from langchain_community.vectorstores.redis import Redis
-from langchain_community.document_loaders import DirectoryLoader, UnstructuredMarkdownLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 from langchain_ollama import OllamaEmbeddings
 
+from context_packer import pack_context, query_terms
+from ollama_pool import ollama_pool
+from sop_loader import LOADER_SIGNATURE, MarkdownSOPSplitter, load_markdown_file
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 load_dotenv()
 
 class NomicEmbeddings(OllamaEmbeddings):
+    # 임베딩 요청은 부모의 단일 호스트 클라이언트 대신 ollama_pool을 거쳐, 이 모델을 서비스하는 호스트 중
+    # 처리 중인 요청이 가장 적은 곳으로 보냅니다. 연결 실패 시 다른 호스트로 재시도합니다.
+    # 쿼리는 'search_query:', 문서는 'search_document:' 접두사를 한 번만 붙입니다.
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        return ollama_pool.embed(self.model, texts, options=self._default_params, keep_alive=self.keep_alive)
+
+    async def _aembed(self, texts: List[str]) -> List[List[float]]:
+        return await ollama_pool.aembed(self.model, texts, options=self._default_params, keep_alive=self.keep_alive)
+
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        prefixed_texts = [f"search_document: {text}" for text in texts]
-        return super().embed_documents(prefixed_texts)
+        return self._embed([f"search_document: {text}" for text in texts])
 
     def embed_query(self, text: str) -> List[float]:
-        prefixed_text = f"search_query: {text}"
-        return super().embed_query(prefixed_text)
+        return self._embed([f"search_query: {text}"])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self._aembed([f"search_document: {text}" for text in texts])
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self._aembed([f"search_query: {text}"]))[0]
+
+def create_embeddings() -> NomicEmbeddings:
+    """환경 변수 설정으로 임베딩 모델 클라이언트를 만듭니다. (연결은 첫 호출 시점에 맺어집니다.)"""
+    return NomicEmbeddings(model=os.getenv("EMBEDDING_MODEL"), base_url=os.getenv("OLLAMA_BASE_URL"))
+
+# langchain_community Redis 벡터 저장소의 기본 스키마 필드 이름
+CONTENT_FIELD = "content"
+CONTENT_VECTOR_FIELD = "content_vector"
+
+# --- 하이브리드 검색 (BM25 + 벡터) 기본값 ---
+# 호출별 인자로 덮어쓸 수 있으며, 지정하지 않으면 아래 환경 변수 값을 사용합니다.
+RAG_RETRIEVAL_MODE = os.getenv("RAG_RETRIEVAL_MODE", "vector").lower()  # 'vector' | 'hybrid'
+RAG_HYBRID_ALPHA = float(os.getenv("RAG_HYBRID_ALPHA", "0.5"))  # 벡터 점수 가중치 (1-alpha는 BM25)
+RAG_HYBRID_CANDIDATES = int(os.getenv("RAG_HYBRID_CANDIDATES", "20"))  # 각 검색기에서 가져올 후보 수
+RAG_RERANK = os.getenv("RAG_RERANK", "false").lower() == "true"
+RAG_RERANKER_MODEL = os.getenv("RAG_RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+
+RETRIEVAL_MODES = ("vector", "hybrid")
+_FILTER_ID_PATTERN = re.compile(r"[^0-9A-Za-z]")
+
+def resolve_retrieval_options(mode: Optional[str] = None, alpha: Optional[float] = None,
+                              uo_id: Optional[str] = None, workflow_id: Optional[str] = None,
+                              rerank: Optional[bool] = None, candidates: Optional[int] = None) -> Dict:
+    """
+    호출별 검색 옵션을 환경 변수 기본값과 합쳐 정규화합니다.
+    - mode: 'vector'(KNN만) 또는 'hybrid'(BM25 + KNN 점수 가중 결합)
+    - uo_id: 해당 UO ID가 본문에 나오는 청크로 제한 (RediSearch 필터)
+    - workflow_id: 해당 워크플로우 ID가 파일 경로(source)에 포함된 청크로 제한
+    - rerank: 후보를 CPU cross-encoder로 다시 정렬 (sentence-transformers 필요)
+    """
+    mode = (mode or RAG_RETRIEVAL_MODE).lower()
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode '{mode}'. Expected one of {RETRIEVAL_MODES}.")
+    alpha = RAG_HYBRID_ALPHA if alpha is None else alpha
+    return {
+        "mode": mode,
+        "alpha": min(max(alpha, 0.0), 1.0),
+        "uo_id": _FILTER_ID_PATTERN.sub("", uo_id or "") or None,
+        "workflow_id": _FILTER_ID_PATTERN.sub("", workflow_id or "") or None,
+        "rerank": RAG_RERANK if rerank is None else rerank,
+        "candidates": max(candidates or RAG_HYBRID_CANDIDATES, 1),
+    }
+
+def _is_plain_vector_search(options: Dict) -> bool:
+    return options["mode"] == "vector" and not (options["uo_id"] or options["workflow_id"] or options["rerank"])
+
+def _cache_query_key(query: str, options: Dict) -> str:
+    """기본 벡터 검색은 기존 캐시 키를 그대로 쓰고, 그 외 옵션은 키에 포함하여 결과가 섞이지 않게 합니다."""
+    if _is_plain_vector_search(options):
+        return query
+    return f"{query}\0{json.dumps(options, sort_keys=True)}"
+
+def _bm25_query_text(query: str) -> Optional[str]:
+    """자연어 쿼리를 RediSearch OR 쿼리로 바꿉니다. 영숫자 토큰만 사용하므로 쿼리 문법 이스케이프가 필요 없습니다."""
+    terms = query_terms(query)
+    return "|".join(terms) if terms else None
+
+def fuse_scores(vector_scores: Dict[str, float], bm25_scores: Dict[str, float], alpha: float) -> List[Tuple[str, float]]:
+    """
+    벡터 점수(코사인 유사도, 0~1로 자름)와 BM25 점수(후보 중 최댓값으로 나눔)를 alpha 가중합으로 결합합니다.
+    한쪽 결과에만 있는 문서는 다른 쪽 점수를 0으로 봅니다. (문서 ID, 결합 점수)를 점수 내림차순으로 반환합니다.
+    """
+    bm25_max = max(bm25_scores.values(), default=0.0)
+    fused = {
+        doc_id: alpha * min(max(vector_scores.get(doc_id, 0.0), 0.0), 1.0)
+        + (1 - alpha) * (bm25_scores.get(doc_id, 0.0) / bm25_max if bm25_max > 0 else 0.0)
+        for doc_id in set(vector_scores) | set(bm25_scores)
+    }
+    return sorted(fused.items(), key=lambda item: (-item[1], item[0]))
+
+class CrossEncoderReranker:
+    """
+    sentence-transformers의 CrossEncoder를 처음 사용할 때 불러오는 CPU 재정렬기.
+    패키지가 없거나 모델을 불러오지 못하면 경고를 한 번 남기고 재정렬 없이 원래 순서를 유지합니다.
+    """
+
+    def __init__(self, model_name: str = RAG_RERANKER_MODEL):
+        self.model_name = model_name
+        self._model = None
+        self._unavailable = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._model is None and not self._unavailable:
+                try:
+                    from sentence_transformers import CrossEncoder
+                    self._model = CrossEncoder(self.model_name, device="cpu")
+                    logging.info(f"Loaded reranker model '{self.model_name}'.")
+                except Exception as e:
+                    self._unavailable = True
+                    logging.warning(f"Reranker '{self.model_name}' is unavailable, keeping fused order: {e}")
+        return self._model
+
+    def rerank(self, query: str, docs: List[Document], k: int) -> List[Document]:
+        model = self._load() if docs else None
+        if model is None:
+            return docs[:k]
+        scores = model.predict([(query, doc.page_content) for doc in docs])
+        ranked = sorted(zip(docs, scores), key=lambda item: -float(item[1]))
+        for doc, score in ranked:
+            doc.metadata["rerank_score"] = float(score)
+        return [doc for doc, _ in ranked[:k]]
+
+_reranker: Optional[CrossEncoderReranker] = None
+
+def get_reranker() -> CrossEncoderReranker:
+    global _reranker
+    if _reranker is None:
+        _reranker = CrossEncoderReranker()
+    return _reranker
+
+class RetrievalCache:
+    """
+    (query, k) 단위 검색 결과 캐시.
+    - 1단계: 프로세스 내 LRU (최대 항목 수 + TTL), Document 객체를 그대로 보관
+    - 2단계(선택): Redis에 쿼리 임베딩과 top-k 문서 ID를 보관하여 워커/재시작 간 공유
+    모든 키에는 인덱스 버전이 포함되므로, 인덱스가 재구축되거나 SOP 파일이 바뀌면 기존 항목은 자동으로 무효화됩니다.
+    """
+
+    def __init__(self, redis_url: str, index_name: str, docs_directory: str):
+        self.enabled = os.getenv("RAG_CACHE_ENABLED", "true").lower() == "true"
+        self.max_entries = int(os.getenv("RAG_CACHE_MAX_ENTRIES", "512"))
+        self.ttl_seconds = float(os.getenv("RAG_CACHE_TTL_SECONDS", "600"))
+        self.redis_enabled = os.getenv("RAG_CACHE_REDIS_ENABLED", "false").lower() == "true"
+        self.redis_ttl_seconds = int(os.getenv("RAG_CACHE_REDIS_TTL_SECONDS", "86400"))
+        self.version_check_seconds = float(os.getenv("RAG_CACHE_VERSION_CHECK_SECONDS", "30"))
+
+        self.index_name = index_name
+        self.docs_directory = docs_directory
+        self.version_key = f"{index_name}:version"
+        # 임베딩 벡터(바이너리)가 포함된 문서 해시를 읽어야 하므로 decode_responses를 끕니다.
+        self._client = redis.Redis.from_url(redis_url)
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str, int], Tuple[float, List[Document]]]" = OrderedDict()
+        self._version: Optional[str] = None
+        self._version_checked_at = 0.0
+        self._counters = {"lru_hits": 0, "redis_hits": 0, "misses": 0, "embed_calls": 0, "embed_calls_saved": 0}
+
+    # --- 인덱스 버전 ---
+    def _sops_fingerprint(self) -> str:
+        digest = hashlib.sha256()
+        for root, _, files in os.walk(self.docs_directory):
+            for name in sorted(files):
+                if not name.endswith(".md"):
+                    continue
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+        return digest.hexdigest()[:16]
+
+    def current_version(self) -> str:
+        """Redis의 인덱스 버전 카운터와 SOP 파일 지문을 합친 버전 문자열. 주기적으로만 다시 계산합니다."""
+        now = time.monotonic()
+        if self._version is None or now - self._version_checked_at >= self.version_check_seconds:
+            try:
+                index_version = (self._client.get(self.version_key) or b"0").decode("utf-8")
+            except redis.exceptions.RedisError:
+                index_version = "0"
+            version = f"{index_version}:{self._sops_fingerprint()}"
+            if self._version is not None and version != self._version:
+                logging.info(f"Index version changed ({self._version} -> {version}). Invalidating retrieval cache.")
+                self.clear()
+            self._version, self._version_checked_at = version, now
+        return self._version
+
+    def cached_version(self) -> Optional[str]:
+        """다시 확인할 시점이 지나지 않았다면 마지막으로 계산한 버전을, 아니면 None을 반환합니다."""
+        if self._version is not None and time.monotonic() - self._version_checked_at < self.version_check_seconds:
+            return self._version
+        return None
+
+    def bump_version(self):
+        """인덱스가 (재)구축되었음을 알리고 로컬 캐시를 비웁니다."""
+        try:
+            self._client.incr(self.version_key)
+        except redis.exceptions.RedisError as e:
+            logging.warning(f"Failed to bump index version: {e}")
+        self.clear()
+        self._version = None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    # --- 1단계: 프로세스 내 LRU ---
+    def get_local(self, version: str, query: str, k: int) -> Optional[List[Document]]:
+        key = (version, query, k)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, docs = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            self._counters["lru_hits"] += 1
+            self._counters["embed_calls_saved"] += 1
+            return docs
+
+    def put_local(self, version: str, query: str, k: int, docs: List[Document]):
+        with self._lock:
+            self._entries[(version, query, k)] = (time.monotonic() + self.ttl_seconds, docs)
+            self._entries.move_to_end((version, query, k))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # --- 2단계: Redis (쿼리 임베딩 + top-k 문서 ID) ---
+    @staticmethod
+    def _query_hash(query: str) -> str:
+        return hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+    def get_embedding(self, query: str) -> Optional[List[float]]:
+        if not self.redis_enabled:
+            return None
+        try:
+            raw = self._client.get(f"rag_cache:emb:{self._query_hash(query)}")
+        except redis.exceptions.RedisError:
+            return None
+        return json.loads(raw) if raw else None
+
+    def put_embedding(self, query: str, embedding: List[float]):
+        if not self.redis_enabled:
+            return
+        try:
+            self._client.set(f"rag_cache:emb:{self._query_hash(query)}", json.dumps(embedding), ex=self.redis_ttl_seconds)
+        except redis.exceptions.RedisError as e:
+            logging.warning(f"Failed to cache query embedding: {e}")
+
+    def get_top_k(self, version: str, query: str, k: int) -> Optional[List[Document]]:
+        if not self.redis_enabled:
+            return None
+        try:
+            raw = self._client.get(f"rag_cache:topk:{version}:{k}:{self._query_hash(query)}")
+            if not raw:
+                return None
+            doc_ids = json.loads(raw)
+            pipe = self._client.pipeline(transaction=False)
+            for doc_id in doc_ids:
+                pipe.hgetall(doc_id)
+            hashes = pipe.execute()
+        except redis.exceptions.RedisError:
+            return None
+
+        docs = []
+        for doc_id, fields in zip(doc_ids, hashes):
+            if not fields:
+                return None  # 문서가 삭제되었으면 캐시를 신뢰하지 않음
+            metadata = {
+                key.decode("utf-8"): value.decode("utf-8", errors="replace")
+                for key, value in fields.items()
+                if key not in (b"content", b"content_vector")
+            }
+            metadata["id"] = doc_id
+            docs.append(Document(page_content=fields.get(b"content", b"").decode("utf-8", errors="replace"), metadata=metadata))
+        self.record("redis_hits")
+        self.record("embed_calls_saved")
+        return docs
+
+    def put_top_k(self, version: str, query: str, k: int, docs: List[Document]):
+        if not self.redis_enabled:
+            return
+        doc_ids = [doc.metadata.get("id") for doc in docs]
+        if not all(doc_ids):
+            return
+        try:
+            self._client.set(f"rag_cache:topk:{version}:{k}:{self._query_hash(query)}", json.dumps(doc_ids), ex=self.redis_ttl_seconds)
+        except redis.exceptions.RedisError as e:
+            logging.warning(f"Failed to cache top-k document IDs: {e}")
+
+    def record(self, counter: str, amount: int = 1):
+        with self._lock:
+            self._counters[counter] += amount
+
+    def stats(self) -> Dict:
+        hits = self._counters["lru_hits"] + self._counters["redis_hits"]
+        lookups = hits + self._counters["misses"]
+        return {
+            **self._counters,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+            "version": self._version,
+            "enabled": self.enabled,
+            "redis_enabled": self.redis_enabled,
+        }
 
 class RAGPipeline:
     def __init__(self):
         self.redis_url = os.getenv("REDIS_URL")
-        self.ollama_base_url = os.getenv("OLLAMA_BASE_URL")
+        self.ollama_base_url = os.getenv("OLLAMA_BASE_URL") or os.getenv("OLLAMA_HOSTS")
         self.embedding_model = os.getenv("EMBEDDING_MODEL")
-        self.index_name = "labnote_index"
-        self.docs_directory = "./sops"
+        self.index_name = os.getenv("RAG_INDEX_NAME", "labnote_index")
+        self.docs_directory = os.getenv("SOPS_DIRECTORY", "./sops")
+        self._async_redis: Optional[aioredis.Redis] = None
+        self._redis_client = redis.Redis.from_url(self.redis_url) if self.redis_url else None
+        self._index_lock = threading.Lock()
+        # 'markdown': 제목 구조 기반 경량 로더 (기본), 'unstructured': 기존 UnstructuredMarkdownLoader
+        self.sop_loader = os.getenv("SOP_LOADER", "markdown").lower()
+        self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=200)
+        self.markdown_splitter = MarkdownSOPSplitter(chunk_size=2000, chunk_overlap=200)
 
         if not all([self.redis_url, self.ollama_base_url, self.embedding_model]):
             raise ValueError("Required environment variables are missing. Check your .env file.")
 
-        self.embeddings = NomicEmbeddings(model=self.embedding_model, base_url=self.ollama_base_url)
+        self.embeddings = create_embeddings()
+        self.retrieval_cache = RetrievalCache(self.redis_url, self.index_name, self.docs_directory)
         self.vector_store = self._initialize_vector_store()
 
-    def _load_and_split_documents(self) -> List[Document]:
-        logging.info(f"Loading documents from '{self.docs_directory}'...")
-        loader = DirectoryLoader(
-            self.docs_directory, glob="**/*.md", loader_cls=UnstructuredMarkdownLoader,
-            show_progress=True, use_multithreading=True
-        )
-        documents = loader.load()
-        if not documents:
-            logging.warning(f"No Markdown documents (.md) found in '{self.docs_directory}'.")
-            return []
+    # --- 증분 인덱싱 ---
+    # 파일별 내용 해시와 청크 키를 Redis 해시('<index>:files')에 기록해 두고,
+    # 새로 추가되거나 내용이 바뀐 파일만 다시 임베딩하며, 삭제된 파일의 청크는 인덱스에서 제거합니다.
+    @property
+    def manifest_key(self) -> str:
+        return f"{self.index_name}:files"
+
+    def _scan_sop_files(self) -> Dict[str, str]:
+        """
+        SOP 디렉토리의 .md 파일별 내용 해시(sha256)를 반환합니다. 키는 docs_directory 기준 상대 경로.
+        로더 종류도 해시에 포함하여, 분할 방식이 바뀌면 모든 파일이 다시 임베딩되도록 합니다.
+        """
+        loader_signature = LOADER_SIGNATURE if self.sop_loader == "markdown" else "unstructured"
+        file_hashes = {}
+        for root, _, files in os.walk(self.docs_directory):
+            for name in sorted(files):
+                if not name.endswith(".md"):
+                    continue
+                path = os.path.join(root, name)
+                with open(path, "rb") as f:
+                    digest = hashlib.sha256(loader_signature.encode("utf-8") + b"\0" + f.read())
+                file_hashes[os.path.relpath(path, self.docs_directory)] = digest.hexdigest()
+        return file_hashes
+
+    def _load_and_split_file(self, rel_path: str) -> List[Document]:
+        path = os.path.join(self.docs_directory, rel_path)
+        if self.sop_loader == "markdown":
+            return load_markdown_file(path, self.markdown_splitter)
+        # unstructured는 임포트 비용이 크므로 선택된 경우에만 불러옵니다.
+        from langchain_community.document_loaders import UnstructuredMarkdownLoader
+        documents = UnstructuredMarkdownLoader(path).load()
+        return self.text_splitter.split_documents(documents)
+
+    # --- 스트리밍 수집 파이프라인 ---
+    # 파일 로드/분할(제너레이터) → 배치 임베딩(스레드 풀, 동시 실행 수 제한) → Redis 쓰기를 겹쳐서 실행합니다.
+    # 한 파일의 청크가 모두 기록되면 on_file_done 콜백으로 알려, 중간에 실패해도 완료된 파일은 다시 임베딩하지 않습니다.
+    def _iter_chunk_batches(self, rel_paths: List[str], batch_size: int, chunk_counts: Dict[str, int]):
+        batch = []
+        for rel_path in rel_paths:
+            chunks = self._load_and_split_file(rel_path)
+            chunk_counts[rel_path] = len(chunks)
+            for chunk in chunks:
+                batch.append((rel_path, chunk))
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    def _ingest_files(self, rel_paths: List[str], on_file_done: Callable[[str, List[str]], None]) -> Dict[str, float]:
+        """파일들을 스트리밍 방식으로 임베딩하여 인덱스에 기록합니다. 인덱스가 없으면 첫 배치로 생성합니다."""
+        batch_size = int(os.getenv("RAG_EMBED_BATCH_SIZE", "32"))
+        concurrency = int(os.getenv("RAG_EMBED_CONCURRENCY", "4"))
+        started_at = time.perf_counter()
+        chunk_counts: Dict[str, int] = {}
+        chunk_ids: Dict[str, List[str]] = {rel_path: [] for rel_path in rel_paths}
+        finished = set()
+        written = 0
+
+        def _finish_completed_files():
+            for rel_path, count in chunk_counts.items():
+                if rel_path not in finished and len(chunk_ids[rel_path]) == count:
+                    finished.add(rel_path)
+                    on_file_done(rel_path, chunk_ids[rel_path])
+
+        def _record(batch, keys):
+            nonlocal written
+            for (rel_path, _), key in zip(batch, keys):
+                chunk_ids[rel_path].append(key)
+            written += len(batch)
+            elapsed = time.perf_counter() - started_at
+            logging.info(f"Ingested {written} chunks from {len(chunk_counts)} files ({written / elapsed:.1f} chunks/s)")
+
+        batches = self._iter_chunk_batches(rel_paths, batch_size, chunk_counts)
+        try:
+            if self.vector_store is None:
+                first_batch = next(batches, None)
+                if first_batch is None:
+                    _finish_completed_files()
+                    return {"chunks": 0, "elapsed_seconds": 0.0, "chunks_per_second": 0.0}
+                logging.info(f"Creating new index '{self.index_name}'...")
+                self.vector_store, keys = Redis.from_texts_return_keys(
+                    texts=[doc.page_content for _, doc in first_batch],
+                    embedding=self.embeddings,
+                    metadatas=[doc.metadata for _, doc in first_batch],
+                    index_name=self.index_name,
+                    redis_url=self.redis_url
+                )
+                _record(first_batch, keys)
+                _finish_completed_files()
+
+            def _write(batch, future):
+                vectors = future.result()
+                keys = self.vector_store.add_texts(
+                    [doc.page_content for _, doc in batch],
+                    metadatas=[doc.metadata for _, doc in batch],
+                    embeddings=vectors
+                )
+                _record(batch, keys)
+                _finish_completed_files()
+
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                in_flight = deque()
+                for batch in batches:
+                    in_flight.append((batch, executor.submit(self.embeddings.embed_documents, [doc.page_content for _, doc in batch])))
+                    # 임베딩 중인 배치가 동시 실행 한도에 도달하면 가장 오래된 배치부터 기록하여 메모리 사용량을 제한
+                    if len(in_flight) >= concurrency:
+                        _write(*in_flight.popleft())
+                while in_flight:
+                    _write(*in_flight.popleft())
+            _finish_completed_files()
+        except BaseException:
+            # 완료되지 않은 파일의 일부 청크는 매니페스트에 없으므로 지워서, 다음 동기화가 그 파일을 처음부터 다시 기록하게 합니다.
+            orphan_ids = [chunk_id for rel_path, ids in chunk_ids.items() if rel_path not in finished for chunk_id in ids]
+            if orphan_ids:
+                logging.warning(f"Ingest failed; deleting {len(orphan_ids)} chunks of unfinished files.")
+                self._redis_client.delete(*orphan_ids)
+            raise
+
+        elapsed = time.perf_counter() - started_at
+        return {
+            "chunks": written,
+            "elapsed_seconds": round(elapsed, 3),
+            "chunks_per_second": round(written / elapsed, 2) if elapsed > 0 else 0.0,
+        }
 
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=200)
-        splits = text_splitter.split_documents(documents)
-        logging.info(f"Loaded and split {len(documents)} documents into {len(splits)} chunks.")
-        return splits
+    def _index_exists(self, client: redis.Redis) -> bool:
+        try:
+            client.ft(self.index_name).info()
+            return True
+        except redis.exceptions.ResponseError:
+            return False
+
+    def _delete_leftover_documents(self, client: redis.Redis, batch_size: int = 500) -> int:
+        """인덱스 없이 남아 있는 이 인덱스의 문서 해시('doc:<index>:*')를 지우고 개수를 반환합니다. 새 인덱스에 중복으로 잡히지 않게 합니다."""
+        deleted = 0
+        batch = []
+        for key in client.scan_iter(match=f"doc:{self.index_name}:*", count=batch_size):
+            batch.append(key)
+            if len(batch) >= batch_size:
+                deleted += client.delete(*batch)
+                batch = []
+        if batch:
+            deleted += client.delete(*batch)
+        return deleted
+
+    def sync_index(self, full: bool = False) -> Dict[str, float]:
+        """
+        SOP 디렉토리와 벡터 인덱스를 동기화합니다.
+        full=True이거나, Redis에 인덱스가 없거나, 매니페스트가 없는 기존(전체 구축) 인덱스라면
+        매니페스트와 남은 문서를 지우고 처음부터 다시 구축합니다.
+        """
+        with self._index_lock:
+            client = redis.Redis.from_url(self.redis_url, decode_responses=True)
+            manifest = {path: json.loads(entry) for path, entry in client.hgetall(self.manifest_key).items()}
+
+            # self.vector_store가 아니라 Redis에 인덱스가 실제로 있는지로 판단합니다. 인덱스가 사라졌는데
+            # 매니페스트가 남아 있으면 모든 파일이 '변경 없음'으로 처리되어 새 인덱스에 SOP 대부분이 빠지기 때문입니다.
+            index_exists = self._index_exists(client)
+            if full or not index_exists or not manifest:
+                if index_exists:
+                    logging.info(f"Dropping index '{self.index_name}' for a full rebuild.")
+                    Redis.drop_index(self.index_name, delete_documents=True, redis_url=self.redis_url)
+                else:
+                    leftover = self._delete_leftover_documents(client)
+                    if leftover:
+                        logging.warning(f"Index '{self.index_name}' is missing; deleted {leftover} leftover document hashes.")
+                if manifest:
+                    logging.warning(f"Discarding manifest '{self.manifest_key}' ({len(manifest)} files) for a full rebuild.")
+                client.delete(self.manifest_key)
+                self.vector_store, manifest = None, {}
+
+            current = self._scan_sop_files()
+            added = [p for p in current if p not in manifest]
+            updated = [p for p in current if p in manifest and manifest[p]["hash"] != current[p]]
+            removed = [p for p in manifest if p not in current]
+
+            # 삭제된 파일의 청크는 바로 지웁니다.
+            removed_ids = [chunk_id for p in removed for chunk_id in manifest[p]["chunk_ids"]]
+            if removed:
+                pipe = client.pipeline()
+                if removed_ids:
+                    pipe.delete(*removed_ids)
+                pipe.hdel(self.manifest_key, *removed)
+                pipe.execute()
+            chunks_deleted = len(removed_ids)
+
+            # 변경된 파일은 새 청크를 모두 기록한 뒤에, 매니페스트 갱신과 이전 청크 삭제를 한 트랜잭션으로 수행합니다.
+            # 중간에 실패하면 매니페스트가 이전 해시를 가리키므로 다음 동기화에서 그 파일만 깨끗하게 다시 처리됩니다.
+            def _on_file_done(rel_path: str, ids: List[str]):
+                nonlocal chunks_deleted
+                old_ids = manifest[rel_path]["chunk_ids"] if rel_path in manifest else []
+                pipe = client.pipeline()
+                pipe.hset(self.manifest_key, rel_path, json.dumps({"hash": current[rel_path], "chunk_ids": ids}))
+                if old_ids:
+                    pipe.delete(*old_ids)
+                pipe.execute()
+                chunks_deleted += len(old_ids)
+                synced_files.append(rel_path)
+
+            synced_files: List[str] = []
+            try:
+                ingest_stats = self._ingest_files(added + updated, _on_file_done)
+            except BaseException:
+                # 실패 전에 반영된 파일이 있으면 검색 캐시가 이전 인덱스의 결과를 돌려주지 않도록 버전을 올립니다.
+                if removed or synced_files:
+                    self.retrieval_cache.bump_version()
+                raise
+
+            stats = {
+                "added": len(added),
+                "updated": len(updated),
+                "removed": len(removed),
+                "unchanged": len(current) - len(added) - len(updated),
+                "chunks_added": ingest_stats["chunks"],
+                "chunks_deleted": chunks_deleted,
+                "ingest_seconds": ingest_stats["elapsed_seconds"],
+                "chunks_per_second": ingest_stats["chunks_per_second"],
+            }
+            if added or updated or removed:
+                self.retrieval_cache.bump_version()
+            logging.info(f"Index '{self.index_name}' synchronized: {stats}")
+            return stats
 
     def _initialize_vector_store(self) -> Optional[Redis]:
         """
         **개선점**: 최신 langchain-redis의 `schema` 요구사항 변경에 대응하도록 로직을 수정합니다.
         이제 `from_existing_index` 대신, Redis 클라이언트로 직접 인덱스 존재 여부를 확인하는
         더욱 안정적인 방식을 사용합니다.
+        - 인덱스가 없을 때만 증분 인덱서(sync_index)로 구축합니다.
+        - Redis 연결 실패는 재구축 경로로 빠지지 않고 그대로 전파되어, 호출자가 나중에 재시도할 수 있습니다.
         """
+        client = self._redis_client
+        client.ping() # 연결 확인
+
         try:
-            # 먼저 Redis 클라이언트로 인덱스가 존재하는지 직접 확인합니다.
-            client = Redis.from_url(self.redis_url)
-            client.ping() # 연결 확인
-            
             # 인덱스 정보를 조회하여 존재 여부를 확인
             client.ft(self.index_name).info()
-            
-            logging.info(f"Existing Redis index '{self.index_name}' found. Connecting...")
-            # 인덱스가 존재하면, from_existing_index를 안전하게 호출합니다.
-            return Redis.from_existing_index(
-                embedding=self.embeddings,
-                index_name=self.index_name,
-                redis_url=self.redis_url
-            )
-            
-        except Exception: # 인덱스가 없거나 Redis 연결 실패 시
-            logging.warning(f"Index '{self.index_name}' not found or Redis connection failed. Attempting to create a new index.")
-            splits = self._load_and_split_documents()
-            
-            if not splits:
+        except redis.exceptions.ResponseError: # 인덱스가 없는 경우
+            logging.warning(f"Index '{self.index_name}' not found. Attempting to create a new index.")
+            self.vector_store = None
+            self.sync_index()
+            if self.vector_store is None:
                 logging.error(f"Cannot create index because no documents were found.")
-                return None
+            return self.vector_store
+
+        logging.info(f"Existing Redis index '{self.index_name}' found. Connecting...")
+        # 인덱스가 존재하면, from_existing_index를 안전하게 호출합니다.
+        return Redis.from_existing_index(
+            embedding=self.embeddings,
+            index_name=self.index_name,
+            redis_url=self.redis_url
+        )
 
-            logging.info("Creating new index and embedding documents...")
-            vector_store = Redis.from_documents(
-                documents=splits,
-                embedding=self.embeddings,
-                redis_url=self.redis_url,
-                index_name=self.index_name
-            )
-            logging.info(f"Successfully created and populated new index '{self.index_name}'.")
-            return vector_store
-
-    def retrieve_context(self, query: str, k: int = 5) -> List[Document]:
+    def retrieve_context(self, query: str, k: int = 5, **retrieval_options) -> List[Document]:
+        """
+        SOP 청크 top-k를 검색합니다. retrieval_options는 resolve_retrieval_options의 인자
+        (mode, alpha, uo_id, workflow_id, rerank, candidates)이며, 생략하면 환경 변수 기본값을 사용합니다.
+        """
         if not self.vector_store:
             logging.warning("Vector store is not available. Cannot retrieve context.")
             return []
+        options = resolve_retrieval_options(**retrieval_options)
         
-        logging.info(f"Retrieving top {k} documents for query: '{query}'")
-        return self.vector_store.similarity_search(query, k=k)
+        cache = self.retrieval_cache
+        cache_query = _cache_query_key(query, options)
+        if not cache.enabled:
+            logging.info(f"Retrieving top {k} documents ({options['mode']}) for query: '{query}'")
+            if _is_plain_vector_search(options):
+                return self.vector_store.similarity_search(query, k=k)
+            return self._search(query, self.embeddings.embed_query(query), k, options)
+
+        version = cache.current_version()
+        docs = cache.get_local(version, cache_query, k)
+        if docs is not None:
+            logging.info(f"Retrieval cache hit (local) for top {k} documents.")
+            return docs
+        docs = cache.get_top_k(version, cache_query, k)
+        if docs is not None:
+            logging.info(f"Retrieval cache hit (redis) for top {k} documents.")
+            cache.put_local(version, cache_query, k, docs)
+            return docs
+
+        cache.record("misses")
+        logging.info(f"Retrieving top {k} documents ({options['mode']}) for query: '{query}'")
+        embedding = cache.get_embedding(query)
+        if embedding is None:
+            embedding = self.embeddings.embed_query(query)
+            cache.record("embed_calls")
+            cache.put_embedding(query, embedding)
+        else:
+            cache.record("embed_calls_saved")
+        if _is_plain_vector_search(options):
+            docs = self.vector_store.similarity_search_by_vector(embedding, k=k)
+        else:
+            docs = self._search(query, embedding, k, options)
+        cache.put_local(version, cache_query, k, docs)
+        cache.put_top_k(version, cache_query, k, docs)
+        return docs
+
+    def configure_async_redis(self, redis_pool: aioredis.ConnectionPool):
+        """비동기 검색에 사용할 Redis 클라이언트를 앱의 연결 풀에 연결합니다."""
+        self._async_redis = aioredis.Redis(connection_pool=redis_pool)
+
+    # --- 하이브리드 검색 ---
+    # 동기/비동기 경로가 같은 RediSearch 쿼리 객체와 점수 결합 로직을 공유하고, 실행하는 클라이언트만 다릅니다.
+    @staticmethod
+    def _vector_query(k: int, uo_id: Optional[str] = None) -> Query:
+        """KNN 벡터 쿼리. uo_id가 있으면 해당 ID가 본문에 나오는 청크 안에서만 KNN을 수행합니다."""
+        prefilter = f"(@{CONTENT_FIELD}:({uo_id}))" if uo_id else "*"
+        return (
+            Query(f"{prefilter}=>[KNN {k} @{CONTENT_VECTOR_FIELD} $vector AS distance]")
+            .sort_by("distance")
+            .paging(0, k)
+            .return_fields(CONTENT_FIELD, "source", "heading_path", "distance")
+            .dialect(2)
+        )
+
+    @staticmethod
+    def _bm25_query(text: str, k: int, uo_id: Optional[str] = None) -> Query:
+        """content 필드에 대한 BM25 전문 검색 쿼리."""
+        query_string = f"@{CONTENT_FIELD}:({text})"
+        if uo_id:
+            query_string = f"@{CONTENT_FIELD}:({uo_id}) {query_string}"
+        return (
+            Query(query_string)
+            .scorer("BM25")
+            .with_scores()
+            .paging(0, k)
+            .return_fields(CONTENT_FIELD, "source", "heading_path")
+            .dialect(2)
+        )
+
+    @staticmethod
+    def _pack_vector(embedding: List[float]) -> bytes:
+        return struct.pack(f"{len(embedding)}f", *embedding)
+
+    @staticmethod
+    def _to_document(doc) -> Document:
+        metadata = {"id": doc.id, "source": getattr(doc, "source", "Unknown")}
+        if getattr(doc, "heading_path", None):
+            metadata["heading_path"] = doc.heading_path
+        return Document(page_content=getattr(doc, CONTENT_FIELD, ""), metadata=metadata)
+
+    @staticmethod
+    def _fetch_k(k: int, options: Dict) -> int:
+        # 결합/필터/재정렬이 있으면 후보를 넉넉히 가져와야 최종 top-k가 비지 않습니다.
+        return k if _is_plain_vector_search(options) else max(k, options["candidates"])
+
+    def _rank_results(self, vector_result, bm25_result, limit: int, options: Dict) -> List[Document]:
+        """두 검색 결과를 workflow 필터 → 점수 결합 순으로 처리하여 상위 limit개 문서를 반환합니다."""
+        documents: Dict[str, Document] = {}
+        vector_scores: Dict[str, float] = {}
+        bm25_scores: Dict[str, float] = {}
+        for doc in vector_result.docs:
+            documents[doc.id] = self._to_document(doc)
+            vector_scores[doc.id] = 1.0 - float(getattr(doc, "distance", 1.0))  # 코사인 거리 → 유사도
+        if bm25_result is not None:
+            for doc in bm25_result.docs:
+                documents.setdefault(doc.id, self._to_document(doc))
+                bm25_scores[doc.id] = float(doc.score or 0.0)
+
+        workflow_id = options["workflow_id"]
+        if workflow_id:
+            allowed = {
+                doc_id for doc_id, doc in documents.items()
+                if workflow_id.lower() in str(doc.metadata.get("source", "")).lower()
+            }
+            vector_scores = {doc_id: score for doc_id, score in vector_scores.items() if doc_id in allowed}
+            bm25_scores = {doc_id: score for doc_id, score in bm25_scores.items() if doc_id in allowed}
+
+        if options["mode"] == "hybrid":
+            ranked = fuse_scores(vector_scores, bm25_scores, options["alpha"])
+        else:
+            ranked = sorted(vector_scores.items(), key=lambda item: -item[1])
+
+        docs = []
+        for doc_id, score in ranked[:limit]:
+            doc = documents[doc_id]
+            doc.metadata["retrieval_score"] = round(score, 6)
+            docs.append(doc)
+        return docs
+
+    def _search(self, query: str, embedding: List[float], k: int, options: Dict) -> List[Document]:
+        """동기 하이브리드/필터 검색. 재정렬이 켜져 있으면 후보 전체를 재정렬한 뒤 top-k를 자릅니다."""
+        fetch_k = self._fetch_k(k, options)
+        ft = self._redis_client.ft(self.index_name)
+        vector_result = ft.search(
+            self._vector_query(fetch_k, options["uo_id"]), query_params={"vector": self._pack_vector(embedding)}
+        )
+        bm25_text = _bm25_query_text(query) if options["mode"] == "hybrid" else None
+        bm25_result = ft.search(self._bm25_query(bm25_text, fetch_k, options["uo_id"])) if bm25_text else None
+        docs = self._rank_results(vector_result, bm25_result, fetch_k if options["rerank"] else k, options)
+        if options["rerank"]:
+            docs = get_reranker().rerank(query, docs, k)
+        return docs
+
+    async def _asearch(self, query: str, embedding: List[float], k: int, options: Dict) -> List[Document]:
+        """
+        _search의 비동기 버전. 앱의 연결 풀을 공유하는 비동기 Redis 클라이언트로 벡터/BM25 검색을 동시에 보내고,
+        CPU를 쓰는 재정렬은 스레드에서 실행합니다. 바이너리 벡터 필드는 반환하지 않습니다.
+        """
+        fetch_k = self._fetch_k(k, options)
+        ft = self._async_redis.ft(self.index_name)
+        searches = [ft.search(
+            self._vector_query(fetch_k, options["uo_id"]), query_params={"vector": self._pack_vector(embedding)}
+        )]
+        bm25_text = _bm25_query_text(query) if options["mode"] == "hybrid" else None
+        if bm25_text:
+            searches.append(ft.search(self._bm25_query(bm25_text, fetch_k, options["uo_id"])))
+        results = await asyncio.gather(*searches)
+        bm25_result = results[1] if bm25_text else None
+        docs = self._rank_results(results[0], bm25_result, fetch_k if options["rerank"] else k, options)
+        if options["rerank"]:
+            docs = await asyncio.to_thread(get_reranker().rerank, query, docs, k)
+        return docs
+
+    async def aretrieve_context(self, query: str, k: int = 5, **retrieval_options) -> List[Document]:
+        """
+        retrieve_context의 비동기 버전. 임베딩은 Ollama AsyncClient로, 검색은 앱의 연결 풀을 공유하는
+        비동기 Redis 클라이언트로 수행하여 동시 요청의 검색이 이벤트 루프를 막지 않고 겹쳐서 실행됩니다.
+        비동기 클라이언트가 구성되지 않았으면 동기 검색을 스레드에서 실행합니다.
+        """
+        if not self.vector_store:
+            logging.warning("Vector store is not available. Cannot retrieve context.")
+            return []
+        if self._async_redis is None:
+            return await asyncio.to_thread(self.retrieve_context, query, k, **retrieval_options)
+        options = resolve_retrieval_options(**retrieval_options)
+
+        cache = self.retrieval_cache
+        cache_query = _cache_query_key(query, options)
+        version = None
+        if cache.enabled:
+            version = cache.cached_version() or await asyncio.to_thread(cache.current_version)
+            docs = cache.get_local(version, cache_query, k)
+            if docs is not None:
+                logging.info(f"Retrieval cache hit (local) for top {k} documents.")
+                return docs
+            if cache.redis_enabled:
+                docs = await asyncio.to_thread(cache.get_top_k, version, cache_query, k)
+                if docs is not None:
+                    logging.info(f"Retrieval cache hit (redis) for top {k} documents.")
+                    cache.put_local(version, cache_query, k, docs)
+                    return docs
+            cache.record("misses")
+
+        logging.info(f"Retrieving top {k} documents (async, {options['mode']}) for query: '{query}'")
+        embedding = await asyncio.to_thread(cache.get_embedding, query) if cache.enabled and cache.redis_enabled else None
+        if embedding is None:
+            embedding = await self.embeddings.aembed_query(query)
+            cache.record("embed_calls")
+            if cache.enabled and cache.redis_enabled:
+                await asyncio.to_thread(cache.put_embedding, query, embedding)
+        else:
+            cache.record("embed_calls_saved")
+
+        docs = await self._asearch(query, embedding, k, options)
+        if cache.enabled:
+            cache.put_local(version, cache_query, k, docs)
+            if cache.redis_enabled:
+                await asyncio.to_thread(cache.put_top_k, version, cache_query, k, docs)
+        return docs
+
+    @staticmethod
+    def format_context_for_prompt(documents: List[Document], query: str = "", token_budget: Optional[int] = None) -> str:
+        """
+        검색된 청크를 프롬프트용 컨텍스트 문자열로 만듭니다. 청크 간 중복은 항상 제거하고,
+        token_budget이 있으면 query와 관련도가 높은 문장만 예산 안에서 남깁니다. (context_packer.pack_context 참고)
+        """
+        return pack_context(documents, query, token_budget)[0]
+
+# --- [최적화] 지연 초기화 ---
+# 모듈 임포트 시점에 Redis 연결/문서 임베딩을 하지 않도록, 파이프라인은 첫 사용 시점
+# (또는 FastAPI lifespan의 백그라운드 워밍업)에 한 번만 생성합니다.
+_rag_pipeline: Optional[RAGPipeline] = None
+_rag_pipeline_lock = threading.Lock()
+_rag_init_error: Optional[str] = None
+_async_redis_pool: Optional[aioredis.ConnectionPool] = None
+
+
+def set_async_redis_pool(redis_pool: aioredis.ConnectionPool):
+    """비동기 검색에 사용할 앱의 Redis 연결 풀을 등록합니다. 이미 생성된 파이프라인에도 즉시 적용됩니다."""
+    global _async_redis_pool
+    _async_redis_pool = redis_pool
+    if _rag_pipeline is not None:
+        _rag_pipeline.configure_async_redis(redis_pool)
+
+
+class RAGPipelineNotReadyError(Exception):
+    """다른 호출자가 RAG 파이프라인을 생성(인덱스 구축 포함) 중이라 기다리지 않고 바로 실패할 때 발생합니다."""
+
+    def __init__(self):
+        super().__init__("RAG pipeline is still initializing.")
+
+
+def get_rag_pipeline(wait: bool = True) -> RAGPipeline:
+    """
+    RAG 파이프라인을 반환합니다. 최초 호출 시 생성하며, 생성에 실패하면 예외를 전파하고 다음 호출에서 재시도합니다.
+    wait=False이면 다른 스레드가 생성 중일 때 잠금을 기다리지 않고 RAGPipelineNotReadyError를 발생시킵니다.
+    """
+    global _rag_pipeline, _rag_init_error
+    if _rag_pipeline is None:
+        if not _rag_pipeline_lock.acquire(blocking=wait):
+            raise RAGPipelineNotReadyError()
+        try:
+            if _rag_pipeline is None:
+                try:
+                    pipeline = RAGPipeline()
+                except Exception as e:
+                    _rag_init_error = str(e)
+                    raise
+                if _async_redis_pool is not None:
+                    pipeline.configure_async_redis(_async_redis_pool)
+                _rag_pipeline, _rag_init_error = pipeline, None
+        finally:
+            _rag_pipeline_lock.release()
+    return _rag_pipeline
+
+
+async def aget_rag_pipeline(wait: bool = False) -> RAGPipeline:
+    """
+    get_rag_pipeline의 비동기 버전. 생성이 필요하면 이벤트 루프를 막지 않도록 스레드에서 수행합니다.
+    기본값(wait=False)에서는 생성(전체 인덱스 구축일 수 있음)이 진행 중이면 바로 RAGPipelineNotReadyError를 발생시켜,
+    워밍업 동안 들어온 요청이 기본 실행기 스레드를 잠금 대기로 점유하지 않게 합니다. (워밍업 작업만 wait=True)
+    """
+    if _rag_pipeline is not None:
+        return _rag_pipeline
+    if not wait and _rag_pipeline_lock.locked():
+        raise RAGPipelineNotReadyError()
+    return await asyncio.to_thread(get_rag_pipeline, wait)
+
 
-    def format_context_for_prompt(self, documents: List[Document]) -> str:
-        if not documents:
-            return "No relevant context found in the SOPs."
+def rag_pipeline_status() -> Dict:
+    if _rag_pipeline is not None:
+        return {"ready": True, "vector_store": _rag_pipeline.vector_store is not None}
+    return {"ready": False, "error": _rag_init_error}
 
-        context_parts = []
-        for doc in documents:
-            source = doc.metadata.get('source', 'Unknown').split(os.path.sep)[-1]
-            context_parts.append(f"--- CONTEXT FROM: {source} ---\n{doc.page_content}")
-        return "\n\n".join(context_parts)
 
-rag_pipeline = RAGPipeline()
+if __name__ == "__main__":
+    import argparse
 
-    
+    parser = argparse.ArgumentParser(description="RAG pipeline maintenance commands.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    reindex_parser = subparsers.add_parser("reindex", help="Incrementally sync the SOP directory into the vector index.")
+    reindex_parser.add_argument("--full", action="store_true", help="Drop the index and re-embed every SOP.")
+    cli_args = parser.parse_args()
 
+    if cli_args.command == "reindex":
+        print(json.dumps(get_rag_pipeline().sync_index(full=cli_args.full), indent=2))
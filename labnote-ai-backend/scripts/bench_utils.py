@@ -0,0 +1,170 @@
+"""
+벤치마크 스크립트 공용 헬퍼.
+
+Redis/Ollama 없이 백엔드 모듈을 불러올 수 있도록 RAG 파이프라인과 LLM 호출을
+고정 지연을 갖는 스텁으로 교체합니다. 검색/스케줄러 벤치마크용 가짜 Ollama 서버도 제공합니다.
+"""
+import os
+import sys
+import json
+import time
+import types
+import asyncio
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+TEST_BLOCK = """
+------------------------------------------------------------------------
+### [UHW250 Nucleic Acid Purification]
+#### Input
+- (samples from the previous step)
+#### Method
+- (method used in this step)
+------------------------------------------------------------------------
+"""
+
+
+class StubRAGPipeline:
+    """retrieve_context 호출마다 rag_latency 만큼 대기하고 빈 결과를 돌려주는 스텁."""
+
+    def __init__(self, rag_latency: float = 0.0):
+        self.rag_latency = rag_latency
+
+    def retrieve_context(self, query, k=3, **retrieval_options):
+        time.sleep(self.rag_latency)
+        return []
+
+    async def aretrieve_context(self, query, k=3, **retrieval_options):
+        await asyncio.sleep(self.rag_latency)
+        return []
+
+    @staticmethod
+    def format_context_for_prompt(documents):
+        return "No relevant context found in the SOPs."
+
+
+def install_agent_stubs(llm_latency: float = 0.0, rag_latency: float = 0.0):
+    """스텁을 설치한 뒤 agents 모듈을 반환합니다."""
+    stub_module = types.ModuleType("rag_pipeline")
+    stub_pipeline = StubRAGPipeline(rag_latency)
+
+    async def _aget_rag_pipeline():
+        return stub_pipeline
+
+    stub_module.RAGPipeline = StubRAGPipeline
+    stub_module.aget_rag_pipeline = _aget_rag_pipeline
+    sys.modules["rag_pipeline"] = stub_module
+
+    import agents
+
+    async def _stub_call_llm_api(system_prompt, user_prompt, model_name=None, **kwargs):
+        await asyncio.sleep(llm_latency)
+        return f"stub answer from {model_name}"
+
+    agents.call_llm_api = _stub_call_llm_api
+    return agents
+
+
+def fake_vector(text: str, dim: int):
+    """텍스트 해시로부터 결정적인 벡터를 만듭니다."""
+    seed = hashlib.sha256(text.encode("utf-8")).digest()
+    return [((seed[i % len(seed)] + i) % 255) / 255.0 - 0.5 for i in range(dim)]
+
+
+class FakeOllamaStats:
+    """가짜 Ollama 서버가 관찰한 모델별 동시 처리 수."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = {}
+        self.max_in_flight = {}
+        self.requests = {}
+
+    def enter(self, model):
+        with self._lock:
+            self.in_flight[model] = self.in_flight.get(model, 0) + 1
+            self.max_in_flight[model] = max(self.max_in_flight.get(model, 0), self.in_flight[model])
+            self.requests[model] = self.requests.get(model, 0) + 1
+
+    def leave(self, model):
+        with self._lock:
+            self.in_flight[model] -= 1
+
+
+def start_fake_ollama_server(port: int, embed_latency: float = 0.0, dim: int = 768, chat_latency: float = 0.0,
+                             chat_latencies=None, models=None):
+    """
+    Ollama 호환 가짜 서버를 백그라운드 스레드에서 띄웁니다.
+    - /api/embed, /api/embeddings : embed_latency 후 해시 기반 벡터
+    - /api/chat                   : 모델별 지연(chat_latencies, 기본 chat_latency) 후 고정 답변 (stream 지원)
+    - /api/tags                   : models 목록 (헬스 체크용)
+    models를 주면 목록에 없는 모델의 chat 요청은 실제 Ollama처럼 404로 응답합니다.
+    반환값: (서버, FakeOllamaStats)
+    """
+    stats = FakeOllamaStats()
+    chat_latencies = chat_latencies or {}
+    served = {name if ":" in name else f"{name}:latest" for name in models} if models is not None else None
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, payload, status: int = 200):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self._send_json({"models": [{"name": name, "model": name} for name in sorted(served or [])]})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            model = body.get("model", "")
+            if self.path == "/api/chat":
+                if served is not None and (model if ":" in model else f"{model}:latest") not in served:
+                    self._send_json({"error": f"model '{model}' not found"}, status=404)
+                    return
+                stats.enter(model)
+                try:
+                    time.sleep(chat_latencies.get(model, chat_latency))
+                finally:
+                    stats.leave(model)
+                message = {"role": "assistant", "content": f"fake answer from {model}"}
+                final = {"model": model, "created_at": "2025-01-01T00:00:00Z", "message": message, "done": True, "done_reason": "stop"}
+                if not body.get("stream", True):
+                    self._send_json(final)
+                    return
+                lines = [
+                    {"model": model, "created_at": final["created_at"], "message": {"role": "assistant", "content": "fake answer "}, "done": False},
+                    {**final, "message": {"role": "assistant", "content": f"from {model}"}},
+                ]
+                data = b"".join(json.dumps(line).encode("utf-8") + b"\n" for line in lines)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                return
+
+            time.sleep(embed_latency)
+            if self.path == "/api/embed":
+                inputs = body.get("input", [])
+                inputs = [inputs] if isinstance(inputs, str) else inputs
+                self._send_json({"model": model, "embeddings": [fake_vector(t, dim) for t in inputs]})
+            else:  # 구버전 /api/embeddings
+                self._send_json({"embedding": fake_vector(body.get("prompt", ""), dim)})
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats
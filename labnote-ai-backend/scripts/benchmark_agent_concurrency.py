@@ -0,0 +1,56 @@
+"""
+에이전트 팀 동시성 부하 벤치마크.
+
+LLM 호출과 RAG 검색을 고정 지연을 갖는 스텁으로 대체한 뒤, 두 가지 실행 방식의
+처리량을 동시 요청 수별로 비교합니다.
+  - legacy : asyncio.to_thread(run_agent_team) → 스레드마다 새 이벤트 루프 생성 (기존 방식)
+  - native : await arun_agent_team() → 서버 이벤트 루프에서 그대로 실행
+
+사용 예:
+    python scripts/benchmark_agent_concurrency.py --concurrency 1 8 32 128 --llm_latency 0.2
+"""
+import os
+import time
+import asyncio
+import argparse
+import logging
+
+from bench_utils import TEST_BLOCK, install_agent_stubs
+
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+async def _run_batch(agents, mode: str, concurrency: int, requests_per_level: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one_request():
+        async with semaphore:
+            if mode == "legacy":
+                result = await asyncio.to_thread(agents.run_agent_team, "benchmark", TEST_BLOCK, "Method")
+            else:
+                result = await agents.arun_agent_team("benchmark", TEST_BLOCK, "Method")
+            assert result.get("options"), "agent team returned no options"
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one_request() for _ in range(requests_per_level)))
+    return time.perf_counter() - start
+
+
+async def main(args):
+    agents = install_agent_stubs(args.llm_latency, args.rag_latency)
+    print(f"default thread pool size: {min(32, (os.cpu_count() or 1) + 4)}")
+    print(f"{'mode':<8} {'concurrency':>11} {'requests':>9} {'elapsed(s)':>11} {'req/s':>8}")
+    for concurrency in args.concurrency:
+        requests_per_level = max(args.min_requests, concurrency * 2)
+        for mode in ("legacy", "native"):
+            elapsed = await _run_batch(agents, mode, concurrency, requests_per_level)
+            print(f"{mode:<8} {concurrency:>11} {requests_per_level:>9} {elapsed:>11.3f} {requests_per_level / elapsed:>8.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark agent team concurrency with a stubbed LLM.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 64, 128], help="Concurrent request levels to test.")
+    parser.add_argument("--min_requests", type=int, default=16, help="Minimum number of requests per level.")
+    parser.add_argument("--llm_latency", type=float, default=0.2, help="Simulated latency (s) of each LLM call.")
+    parser.add_argument("--rag_latency", type=float, default=0.01, help="Simulated latency (s) of each RAG retrieval.")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,92 @@
+"""
+비동기 RAG 검색 벤치마크.
+
+로컬 Redis(redis-stack)와 고정 지연을 갖는 스텁 임베딩 서버(Ollama /api/embed 호환)를 사용하여,
+동시 요청 수별로 세 가지 검색 경로의 처리량을 비교합니다.
+  - blocking : 코루틴 안에서 동기 retrieve_context 직접 호출 (이벤트 루프 차단)
+  - thread   : asyncio.to_thread(retrieve_context)
+  - async    : await aretrieve_context() (비동기 임베딩 + 비동기 Redis)
+
+벤치마크 전용 인덱스(기본: labnote_bench_index)를 만들고 종료 시 삭제합니다. 검색 캐시는 끈 상태로 측정합니다.
+
+사용 예:
+    python scripts/benchmark_async_retrieval.py --redis_url redis://localhost:6379 --embed_latency 0.05
+"""
+import os
+import time
+import asyncio
+import argparse
+import logging
+
+from bench_utils import BACKEND_DIR, start_fake_ollama_server
+
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+async def _run(pipeline, mode: str, concurrency: int, total: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            query = f"Find the procedure for the Method section of UHW250 run {i}"
+            if mode == "blocking":
+                pipeline.retrieve_context(query, 3)
+            elif mode == "thread":
+                await asyncio.to_thread(pipeline.retrieve_context, query, 3)
+            else:
+                await pipeline.aretrieve_context(query, k=3)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return time.perf_counter() - start
+
+
+async def main(args):
+    import redis
+    import redis.asyncio as aioredis
+    from rag_pipeline import get_rag_pipeline
+
+    # 환경 변수를 설정한 뒤 생성해야 벤치마크 인덱스를 사용합니다.
+    pipeline = get_rag_pipeline()
+    if not pipeline.vector_store:
+        raise SystemExit("Benchmark index could not be created (no SOP documents?).")
+    pool = aioredis.ConnectionPool.from_url(args.redis_url, decode_responses=True)
+    pipeline.configure_async_redis(pool)
+
+    try:
+        print(f"{'mode':<9} {'concurrency':>11} {'requests':>9} {'elapsed(s)':>11} {'req/s':>8}")
+        for concurrency in args.concurrency:
+            total = max(args.min_requests, concurrency * 4)
+            for mode in ("blocking", "thread", "async"):
+                elapsed = await _run(pipeline, mode, concurrency, total)
+                print(f"{mode:<9} {concurrency:>11} {total:>9} {elapsed:>11.3f} {total / elapsed:>8.1f}")
+    finally:
+        await pool.disconnect()
+        pipeline.vector_store.drop_index(pipeline.index_name, delete_documents=True, redis_url=args.redis_url)
+        # 증분 인덱서 매니페스트와 인덱스 버전 키도 정리
+        redis.Redis.from_url(args.redis_url).delete(pipeline.manifest_key, pipeline.retrieval_cache.version_key)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark async vs sync RAG retrieval.")
+    parser.add_argument("--redis_url", default="redis://localhost:6379", help="Local Redis Stack URL.")
+    parser.add_argument("--index_name", default="labnote_bench_index", help="Temporary index used for the benchmark.")
+    parser.add_argument("--port", type=int, default=11499, help="Port for the stub embedding server.")
+    parser.add_argument("--embed_latency", type=float, default=0.05, help="Simulated latency (s) per embedding request.")
+    parser.add_argument("--dim", type=int, default=768, help="Embedding dimension.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 64], help="Concurrent request levels.")
+    parser.add_argument("--min_requests", type=int, default=32, help="Minimum number of requests per level.")
+    cli_args = parser.parse_args()
+
+    start_fake_ollama_server(cli_args.port, cli_args.embed_latency, cli_args.dim)
+    os.environ.update({
+        "REDIS_URL": cli_args.redis_url,
+        "OLLAMA_BASE_URL": f"http://127.0.0.1:{cli_args.port}",
+        "OLLAMA_HOSTS": f"http://127.0.0.1:{cli_args.port}",
+        "OLLAMA_MODEL_HOSTS": "",
+        "EMBEDDING_MODEL": "stub-embed",
+        "RAG_INDEX_NAME": cli_args.index_name,
+        "SOPS_DIRECTORY": os.path.join(BACKEND_DIR, "sops"),
+        "RAG_CACHE_ENABLED": "false",
+    })
+    asyncio.run(main(cli_args))
@@ -0,0 +1,64 @@
+"""
+`uvicorn main:app` 콜드 스타트 측정.
+
+서버 프로세스를 반복 실행하면서 다음 두 시점을 측정합니다.
+  - serving : `/` health check가 처음 200을 반환한 시점 (포트가 열리고 요청을 받기 시작)
+  - ready   : `/ready`가 처음 200을 반환한 시점 (RAG 파이프라인 워밍업 완료)
+
+사용 예 (labnote-ai-backend 디렉토리에서):
+    python scripts/benchmark_cold_start.py --runs 3 --port 8765
+"""
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+import urllib.error
+import urllib.request
+
+from bench_utils import BACKEND_DIR
+
+
+def _wait_for(url: str, started_at: float, timeout: float) -> float:
+    """url이 200을 반환할 때까지 폴링하고, 시작 시점부터의 경과 시간(초)을 반환합니다."""
+    while time.perf_counter() - started_at < timeout:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return time.perf_counter() - started_at
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.05)
+    raise TimeoutError(f"{url} did not become available within {timeout}s")
+
+
+def measure_once(port: int, timeout: float):
+    started_at = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=BACKEND_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        serving = _wait_for(f"http://127.0.0.1:{port}/", started_at, timeout)
+        ready = _wait_for(f"http://127.0.0.1:{port}/ready", started_at, timeout)
+        return serving, ready
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def main(args):
+    results = [measure_once(args.port, args.timeout) for _ in range(args.runs)]
+    for i, (serving, ready) in enumerate(results, 1):
+        print(f"run {i}: serving={serving:.2f}s ready={ready:.2f}s")
+    print(f"mean : serving={statistics.mean(r[0] for r in results):.2f}s ready={statistics.mean(r[1] for r in results):.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure uvicorn cold-start time for main:app.")
+    parser.add_argument("--runs", type=int, default=3, help="Number of server start-ups to measure.")
+    parser.add_argument("--port", type=int, default=8765, help="Port to bind the server to.")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Maximum seconds to wait per start-up.")
+    main(parser.parse_args())
@@ -0,0 +1,146 @@
+"""
+CPU DPO 학습 메모리/속도 스모크 벤치마크.
+
+네트워크 없이 임시 디렉터리에 작은 Llama 구조 모델(기본 수 MB)과 단어 단위 토크나이저를 만들고,
+길이가 제각각인 가짜 선호 쌍으로 run_dpo_training.build_trainer를 모드별로 실행합니다.
+모드마다 별도 프로세스에서 실행하므로 최대 RSS(ru_maxrss)가 서로 섞이지 않습니다.
+  - full        : 전체 가중치 학습 (기존 방식)
+  - lora        : LoRA 어댑터만 학습
+  - lora-gc     : LoRA + gradient checkpointing
+  - lora-gc-len : LoRA + gradient checkpointing + 길이 버킷팅(--group_by_length)
+모드별 학습 파라미터 수, 최대 RSS(MB), steps/sec를 출력합니다.
+
+사용 예:
+    python scripts/benchmark_dpo_training.py --steps 20 --batch_size 4
+    python scripts/benchmark_dpo_training.py --hidden_size 256 --layers 8 --max_length 512
+"""
+import os
+import sys
+import json
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+
+MODES = {
+    "full": [],
+    "lora": ["--lora"],
+    "lora-gc": ["--lora", "--gradient_checkpointing"],
+    "lora-gc-len": ["--lora", "--gradient_checkpointing", "--group_by_length"],
+}
+WORDS = [f"w{i}" for i in range(500)]
+
+
+def _peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # Linux: KB 단위
+
+
+def build_tiny_model(model_dir: str, hidden_size: int, layers: int):
+    """작은 Llama 구조 모델과 WordLevel 토크나이저를 model_dir에 저장합니다."""
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+    special = ["<unk>", "<pad>", "<s>", "</s>"]
+    vocab = {token: i for i, token in enumerate(special + WORDS)}
+    tokenizer_object = Tokenizer(models.WordLevel(vocab=vocab, unk_token="<unk>"))
+    tokenizer_object.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer_object, unk_token="<unk>", pad_token="<pad>", bos_token="<s>", eos_token="</s>"
+    )
+    config = LlamaConfig(
+        vocab_size=len(vocab), hidden_size=hidden_size, intermediate_size=hidden_size * 2,
+        num_hidden_layers=layers, num_attention_heads=4, num_key_value_heads=4, max_position_embeddings=2048,
+        pad_token_id=vocab["<pad>"], bos_token_id=vocab["<s>"], eos_token_id=vocab["</s>"],
+    )
+    model = LlamaForCausalLM(config)
+    model.save_pretrained(model_dir)
+    tokenizer.save_pretrained(model_dir)
+    size_mb = sum(p.numel() * p.element_size() for p in model.parameters()) / 1024 / 1024
+    return size_mb
+
+
+def build_pairs(count: int, max_words: int, seed: int = 0):
+    rng = random.Random(seed)
+
+    def text(n):
+        return " ".join(rng.choice(WORDS) for _ in range(n))
+
+    # 실제 데이터처럼 prompt 길이가 크게 다르도록 짧은/긴 쌍을 섞습니다.
+    return [
+        {
+            "prompt": text(rng.choice([rng.randint(8, 32), rng.randint(max_words // 2, max_words)])),
+            "chosen": text(rng.randint(4, 48)),
+            "rejected": text(rng.randint(4, 48)),
+        }
+        for _ in range(count)
+    ]
+
+
+def run_worker(args):
+    """한 모드를 학습하고 결과를 JSON 한 줄로 출력합니다. (자식 프로세스)"""
+    from datasets import Dataset
+    from run_dpo_training import build_arg_parser, build_trainer
+
+    rss_after_import = _peak_rss_mb()
+    train_args = build_arg_parser().parse_args([
+        "--base_model", args.model_dir, "--output_dir", os.path.join(args.model_dir, f"out-{args.worker}"),
+        "--max_steps", str(args.steps), "--batch_size", str(args.batch_size), "--grad_acc_steps", "1",
+        "--max_length", str(args.max_length), "--save_steps", str(args.steps * 10), *MODES[args.worker],
+    ])
+    dataset = Dataset.from_list(build_pairs(args.pairs, args.max_words))
+    trainer = build_trainer(dataset, train_args)
+    trainable = sum(p.numel() for p in trainer.model.parameters() if p.requires_grad)
+    metrics = trainer.train().metrics
+    print(json.dumps({
+        "mode": args.worker,
+        "trainable_params": trainable,
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "rss_after_import_mb": round(rss_after_import, 1),
+        "steps_per_second": round(metrics["train_steps_per_second"], 3),
+    }))
+
+
+def main(args):
+    model_dir = tempfile.mkdtemp(prefix="dpo_train_bench_")
+    try:
+        size_mb = build_tiny_model(model_dir, args.hidden_size, args.layers)
+        print(f"tiny model: {size_mb:.1f} MB (hidden={args.hidden_size}, layers={args.layers})  pairs={args.pairs}  "
+              f"steps={args.steps}  batch_size={args.batch_size}  max_length={args.max_length}")
+        print(f"{'mode':<12} {'trainable':>11} {'peak RSS MB':>12} {'+ over import':>14} {'steps/s':>8}")
+        for mode in args.modes:
+            command = [
+                sys.executable, os.path.abspath(__file__), "--worker", mode, "--model_dir", model_dir,
+                "--steps", str(args.steps), "--batch_size", str(args.batch_size), "--pairs", str(args.pairs),
+                "--max_length", str(args.max_length), "--max_words", str(args.max_words),
+            ]
+            completed = subprocess.run(command, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            result_lines = [line for line in completed.stdout.splitlines() if line.startswith("{")]
+            if completed.returncode != 0 or not result_lines:
+                print(f"{mode:<12} failed:\n{completed.stderr[-2000:]}")
+                continue
+            result = json.loads(result_lines[-1])
+            print(f"{mode:<12} {result['trainable_params']:>11,} {result['peak_rss_mb']:>12.1f} "
+                  f"{result['peak_rss_mb'] - result['rss_after_import_mb']:>14.1f} {result['steps_per_second']:>8.2f}")
+    finally:
+        shutil.rmtree(model_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Smoke-benchmark CPU DPO training modes on a tiny causal LM.")
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES), help="Training modes to compare.")
+    parser.add_argument("--hidden_size", type=int, default=128, help="Tiny model hidden size.")
+    parser.add_argument("--layers", type=int, default=4, help="Tiny model layer count.")
+    parser.add_argument("--pairs", type=int, default=64, help="Number of synthetic preference pairs.")
+    parser.add_argument("--max_words", type=int, default=400, help="Longest synthetic prompt in words.")
+    parser.add_argument("--steps", type=int, default=10, help="Training steps per mode.")
+    parser.add_argument("--batch_size", type=int, default=4, help="Per-device batch size.")
+    parser.add_argument("--max_length", type=int, default=256, help="Max prompt + response tokens per pair.")
+    parser.add_argument("--worker", choices=list(MODES), help=argparse.SUPPRESS)
+    parser.add_argument("--model_dir", help=argparse.SUPPRESS)
+    cli_args = parser.parse_args()
+    if cli_args.worker:
+        run_worker(cli_args)
+    else:
+        main(cli_args)
@@ -0,0 +1,59 @@
+"""
+에이전트 그래프 컴파일 캐시 마이크로 벤치마크.
+
+LLM/RAG를 지연 0의 스텁으로 대체하여 요청당 그래프 처리 비용만 측정합니다.
+  - rebuild : 요청마다 create_agent_graph()로 그래프를 다시 만들고 컴파일 (기존 방식)
+  - cached  : get_agent_graph()가 반환하는 캐시된 그래프 재사용
+
+사용 예:
+    python scripts/benchmark_graph_compile.py --iterations 200
+"""
+import time
+import asyncio
+import argparse
+import logging
+import statistics
+
+from bench_utils import TEST_BLOCK, install_agent_stubs
+
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def _initial_state(agents):
+    return agents.AgentState(
+        query="benchmark",
+        uo_block=TEST_BLOCK,
+        uo_id="UHW250",
+        uo_name="Nucleic Acid Purification",
+        section_to_populate="Method",
+        options={},
+        messages=[]
+    )
+
+
+async def _measure(agents, mode: str, iterations: int):
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        graph = agents.create_agent_graph() if mode == "rebuild" else agents.get_agent_graph()
+        await graph.ainvoke(_initial_state(agents))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+async def main(args):
+    agents = install_agent_stubs()
+    # 로깅/임포트 등 최초 1회 비용을 측정에서 제외
+    await agents.get_agent_graph().ainvoke(_initial_state(agents))
+
+    print(f"{'mode':<8} {'mean(ms)':>9} {'p50(ms)':>8} {'p95(ms)':>8}")
+    for mode in ("rebuild", "cached"):
+        latencies = sorted(await _measure(agents, mode, args.iterations))
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        print(f"{mode:<8} {statistics.mean(latencies):>9.3f} {statistics.median(latencies):>8.3f} {p95:>8.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark per-request agent graph compile cost.")
+    parser.add_argument("--iterations", type=int, default=200, help="Number of requests per mode.")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,103 @@
+"""
+LLM 요청 스케줄러 벤치마크.
+
+로컬 가짜 Ollama 서버(/api/chat, 고정 지연)에 chat/populate/batch 우선순위가 섞인 호출을 한꺼번에 보내고,
+우선순위별 대기 시간·전체 지연·대기열 초과(429에 해당하는 LLMQueueFullError) 횟수와
+가짜 서버가 관찰한 모델별 최대 동시 처리 수를 출력합니다. --no_scheduler로 스케줄러 없이 같은 부하를 비교합니다.
+
+사용 예:
+    python scripts/benchmark_llm_scheduler.py --concurrency 2 --chat 10 --populate 30 --batch 60
+    python scripts/benchmark_llm_scheduler.py --max_queue_depth 20 --chat_latency 0.5
+"""
+import os
+import time
+import asyncio
+import argparse
+import logging
+import statistics
+
+from bench_utils import start_fake_ollama_server
+
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def _percentile(values, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+async def main(args, stats):
+    from llm_scheduler import PRIORITY_BATCH, PRIORITY_CHAT, PRIORITY_POPULATE, LLMQueueFullError, llm_scheduler
+    from llm_utils import call_llm_api, close_ollama_clients
+
+    latencies = {PRIORITY_CHAT: [], PRIORITY_POPULATE: [], PRIORITY_BATCH: []}
+    rejected = {priority: 0 for priority in latencies}
+
+    async def one(i: int, priority: str, delay: float):
+        await asyncio.sleep(delay)
+        started_at = time.perf_counter()
+        try:
+            await call_llm_api("You are a benchmark.", f"{priority} request {i}", model_name=args.model, use_cache=False, priority=priority)
+        except LLMQueueFullError:
+            rejected[priority] += 1
+            return
+        latencies[priority].append(time.perf_counter() - started_at)
+
+    # 배치/자동 채우기 작업이 먼저 쌓인 뒤 대화형 요청이 들어오는 상황을 재현합니다.
+    jobs = [one(i, PRIORITY_BATCH, 0.0) for i in range(args.batch)]
+    jobs += [one(i, PRIORITY_POPULATE, 0.0) for i in range(args.populate)]
+    jobs += [one(i, PRIORITY_CHAT, args.chat_delay + i * args.chat_interval) for i in range(args.chat)]
+
+    started_at = time.perf_counter()
+    try:
+        await asyncio.gather(*jobs)
+    finally:
+        await close_ollama_clients()
+    elapsed = time.perf_counter() - started_at
+
+    mode = "scheduler" if llm_scheduler.enabled else "no scheduler"
+    print(f"{mode}: concurrency={args.concurrency} max_queue_depth={args.max_queue_depth} chat_latency={args.chat_latency}s")
+    print(f"{'priority':<10} {'done':>6} {'rejected':>9} {'p50(s)':>8} {'p95(s)':>8} {'max(s)':>8}")
+    for priority, values in latencies.items():
+        print(
+            f"{priority:<10} {len(values):>6} {rejected[priority]:>9} {_percentile(values, 0.5):>8.2f} "
+            f"{_percentile(values, 0.95):>8.2f} {max(values, default=0.0):>8.2f}"
+        )
+    total = sum(len(values) for values in latencies.values())
+    print(f"total: {total} calls in {elapsed:.2f}s ({total / elapsed:.1f} calls/s), "
+          f"max in-flight at Ollama: {stats.max_in_flight.get(args.model, 0)}")
+    if llm_scheduler.enabled:
+        model_stats = llm_scheduler.stats()["models"].get(args.model, {})
+        print(f"scheduler: queued={model_stats.get('queued')} max_queue_depth={model_stats.get('max_queue_depth')} "
+              f"avg_wait={model_stats.get('avg_wait_seconds')}s avg_call={model_stats.get('avg_call_seconds')}s")
+    if latencies[PRIORITY_CHAT] and latencies[PRIORITY_BATCH]:
+        print(f"chat p50 / batch p50: {statistics.median(latencies[PRIORITY_CHAT]) / statistics.median(latencies[PRIORITY_BATCH]):.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the in-process LLM scheduler against a fake Ollama server.")
+    parser.add_argument("--model", default="biollama3", help="Model name sent to the fake server.")
+    parser.add_argument("--concurrency", type=int, default=2, help="Scheduler slots for the model (LLM_MODEL_CONCURRENCY).")
+    parser.add_argument("--max_queue_depth", type=int, default=100, help="LLM_MAX_QUEUE_DEPTH for the run.")
+    parser.add_argument("--chat", type=int, default=10, help="Number of chat-priority calls.")
+    parser.add_argument("--populate", type=int, default=20, help="Number of populate-priority calls.")
+    parser.add_argument("--batch", type=int, default=40, help="Number of batch-priority calls.")
+    parser.add_argument("--chat_delay", type=float, default=0.5, help="Seconds before the first chat call is sent.")
+    parser.add_argument("--chat_interval", type=float, default=0.2, help="Seconds between chat calls.")
+    parser.add_argument("--chat_latency", type=float, default=0.2, help="Fake /api/chat latency in seconds.")
+    parser.add_argument("--port", type=int, default=11497, help="Port for the fake Ollama server.")
+    parser.add_argument("--no_scheduler", action="store_true", help="Disable the scheduler (LLM_SCHEDULER_ENABLED=false).")
+    cli_args = parser.parse_args()
+
+    # llm_scheduler는 임포트 시점에 환경 변수를 읽으므로 임포트 전에 설정합니다.
+    os.environ.update({
+        "OLLAMA_BASE_URL": f"http://127.0.0.1:{cli_args.port}",
+        "OLLAMA_HOSTS": f"http://127.0.0.1:{cli_args.port}",
+        "OLLAMA_MODEL_HOSTS": "",
+        "LLM_SCHEDULER_ENABLED": "false" if cli_args.no_scheduler else "true",
+        "LLM_MODEL_CONCURRENCY": f"{cli_args.model}={cli_args.concurrency}",
+        "LLM_MAX_QUEUE_DEPTH": str(cli_args.max_queue_depth),
+        "LLM_CACHE_ENABLED": "false",
+    })
+    _, server_stats = start_fake_ollama_server(cli_args.port, chat_latency=cli_args.chat_latency)
+    asyncio.run(main(cli_args, server_stats))
@@ -0,0 +1,100 @@
+"""
+다중 Ollama 백엔드 풀 벤치마크.
+
+로컬 가짜 Ollama 호스트 여러 개(/api/chat, /api/embed, /api/tags)를 띄우고 call_llm_api와 임베딩 호출을 동시에 보내
+호스트별 요청 분산, 최대 동시 처리 수, 모델 라우팅을 확인합니다.
+  - 마지막 모델(기본 llama3:70b)은 첫 번째 호스트에만 있습니다. (다른 호스트의 /api/tags에는 없음)
+  - --dead_hosts 개수만큼 아무것도 열려 있지 않은 포트를 호스트 목록 앞에 넣어 연결 실패와 재시도를 재현합니다.
+  - --single_host는 같은 부하를 호스트 하나(OLLAMA_BASE_URL만 설정한 기존 구성)로 보냅니다.
+
+사용 예:
+    python scripts/benchmark_ollama_pool.py --hosts 3 --calls 60 --chat_latency 0.2
+    python scripts/benchmark_ollama_pool.py --hosts 3 --dead_hosts 1
+"""
+import os
+import time
+import asyncio
+import argparse
+import logging
+
+from bench_utils import start_fake_ollama_server
+
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+async def main(args, host_stats):
+    from llm_utils import call_llm_api, close_ollama_clients
+    from ollama_pool import ollama_pool
+    from rag_pipeline import create_embeddings
+
+    embeddings = create_embeddings()
+    await ollama_pool.check_health()
+
+    latencies, errors = [], 0
+
+    async def chat(i: int):
+        nonlocal errors
+        model_name = args.models[i % len(args.models)]
+        started_at = time.perf_counter()
+        content = await call_llm_api("You are a benchmark.", f"request {i}", model_name=model_name, use_cache=False)
+        latencies.append(time.perf_counter() - started_at)
+        errors += content.startswith("(LLM Error")
+
+    async def embed(i: int):
+        await embeddings.aembed_query(f"query {i}")
+
+    started_at = time.perf_counter()
+    try:
+        await asyncio.gather(*(chat(i) for i in range(args.calls)), *(embed(i) for i in range(args.embeds)))
+    finally:
+        await close_ollama_clients()
+    elapsed = time.perf_counter() - started_at
+
+    latencies.sort()
+    print(f"{'single host' if args.single_host else 'pool'}: {len(host_stats)} live host(s), "
+          f"{args.dead_hosts} dead, {args.calls} chat + {args.embeds} embed calls")
+    print(f"elapsed {elapsed:.2f}s  chat p50 {latencies[len(latencies) // 2]:.2f}s  "
+          f"p95 {latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]:.2f}s  errors {errors}")
+    print(f"{'host':<26} {'requests':>9} {'max in-flight':>14}  models")
+    for url, stats in host_stats.items():
+        print(f"{url:<26} {sum(stats.requests.values()):>9} {max(stats.max_in_flight.values(), default=0):>14}  {dict(stats.requests)}")
+    for url, backend in ollama_pool.stats()["backends"].items():
+        if backend["failures"]:
+            print(f"{url}: {backend['failures']} failed attempt(s), healthy={backend['healthy']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Ollama backend pool routing against local fake hosts.")
+    parser.add_argument("--hosts", type=int, default=3, help="Number of live fake Ollama hosts.")
+    parser.add_argument("--dead_hosts", type=int, default=0, help="Number of unreachable hosts added to the pool.")
+    parser.add_argument("--models", nargs="+", default=["biollama3", "mixtral", "llama3:70b"],
+                        help="Chat models; the last one is only served by the first host.")
+    parser.add_argument("--calls", type=int, default=60, help="Number of chat calls.")
+    parser.add_argument("--embeds", type=int, default=30, help="Number of embedding calls.")
+    parser.add_argument("--chat_latency", type=float, default=0.2, help="Fake /api/chat latency in seconds.")
+    parser.add_argument("--port", type=int, default=11480, help="First port for the fake hosts.")
+    parser.add_argument("--single_host", action="store_true", help="Send everything to the first host only.")
+    cli_args = parser.parse_args()
+
+    embed_model = "nomic-embed-text"
+    host_stats = {}
+    for i in range(1 if cli_args.single_host else cli_args.hosts):
+        models = cli_args.models + [embed_model] if i == 0 else cli_args.models[:-1] + [embed_model]
+        if cli_args.single_host:
+            models = None
+        _, host_stats[f"http://127.0.0.1:{cli_args.port + i}"] = start_fake_ollama_server(
+            cli_args.port + i, chat_latency=cli_args.chat_latency, models=models
+        )
+    dead = [f"http://127.0.0.1:{cli_args.port + 100 + i}" for i in range(cli_args.dead_hosts)]
+
+    # ollama_pool/llm_scheduler는 임포트 시점에 환경 변수를 읽으므로 임포트 전에 설정합니다.
+    os.environ.update({
+        "OLLAMA_BASE_URL": next(iter(host_stats)),
+        "OLLAMA_HOSTS": "" if cli_args.single_host else ",".join(dead + list(host_stats)),
+        "OLLAMA_MODEL_HOSTS": "",
+        "OLLAMA_CONNECT_TIMEOUT": "1",
+        "EMBEDDING_MODEL": embed_model,
+        "LLM_SCHEDULER_ENABLED": "false",
+        "LLM_CACHE_ENABLED": "false",
+    })
+    asyncio.run(main(cli_args, host_stats))
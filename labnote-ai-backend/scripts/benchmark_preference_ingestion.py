@@ -0,0 +1,93 @@
+"""
+/record_preference 기록 방식 벤치마크.
+
+로컬 Redis에 벤치마크 전용 스트림(기본: bench:dpo:preferences)을 쓰고 종료 시 삭제합니다.
+확장 프로그램이 제안을 연달아 수락할 때처럼 --requests개의 기록 요청을 --concurrency개씩 동시에 보내 비교합니다.
+  - direct   : 요청마다 Redis에 XADD 한 번을 기다림 (요청 경로에서 바로 기록)
+  - buffered : preference_buffer에 넣고 바로 반환, 백그라운드 작업이 배치 파이프라인으로 기록 (현재 방식)
+요청이 반환될 때까지의 지연(p50/p95)과, 모든 레코드가 Redis에 기록될 때까지의 시간을 출력합니다.
+
+사용 예:
+    python scripts/benchmark_preference_ingestion.py --requests 2000 --concurrency 50
+"""
+import os
+import time
+import asyncio
+import argparse
+
+import bench_utils  # noqa: F401  (백엔드 모듈 경로 설정)
+import redis.asyncio as redis
+
+from preference_buffer import PreferenceBuffer
+from preference_store import aappend_preference
+
+RECORD = {
+    "prompt": "Given the experimental context, write the 'Method' section ...",
+    "chosen": "- Centrifuge at 4,000 x g for 10 min",
+    "rejected": ["- Centrifuge", "- Spin down"],
+}
+
+
+def _percentile(values, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def _burst(args, handle) -> list:
+    latencies = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one():
+        async with semaphore:
+            started_at = time.perf_counter()
+            await handle()
+            latencies.append(time.perf_counter() - started_at)
+
+    await asyncio.gather(*(one() for _ in range(args.requests)))
+    return latencies
+
+
+async def main(args):
+    pool = redis.ConnectionPool.from_url(args.redis_url, decode_responses=True)
+    r = redis.Redis(connection_pool=pool)
+    await r.ping()
+    await r.delete(args.stream)
+    print(f"requests: {args.requests}  concurrency: {args.concurrency}  batch_size: {args.batch_size}")
+    print(f"{'mode':<9} {'p50 ms':>8} {'p95 ms':>8} {'all stored s':>13} {'records/s':>10}")
+    try:
+        started_at = time.perf_counter()
+        latencies = await _burst(args, lambda: aappend_preference(r, RECORD, args.stream))
+        stored = time.perf_counter() - started_at
+        print(f"{'direct':<9} {_percentile(latencies, 0.5) * 1000:>8.2f} {_percentile(latencies, 0.95) * 1000:>8.2f} "
+              f"{stored:>13.2f} {args.requests / stored:>10.0f}")
+
+        await r.delete(args.stream)
+        buffer = PreferenceBuffer(max_size=args.requests, batch_size=args.batch_size,
+                                  flush_interval=args.flush_interval, stream=args.stream)
+        buffer.start(pool)
+
+        async def submit():
+            buffer.submit(RECORD)
+
+        started_at = time.perf_counter()
+        latencies = await _burst(args, submit)
+        while await r.xlen(args.stream) < args.requests:
+            await asyncio.sleep(0.005)
+        stored = time.perf_counter() - started_at
+        await buffer.stop()
+        print(f"{'buffered':<9} {_percentile(latencies, 0.5) * 1000:>8.2f} {_percentile(latencies, 0.95) * 1000:>8.2f} "
+              f"{stored:>13.2f} {args.requests / stored:>10.0f}  ({buffer.counters['batches']} batches)")
+    finally:
+        await r.delete(args.stream)
+        await pool.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark direct vs buffered preference ingestion into Redis.")
+    parser.add_argument("--redis_url", default=os.getenv("REDIS_URL", "redis://localhost:6379"), help="Local Redis URL.")
+    parser.add_argument("--stream", default="bench:dpo:preferences", help="Stream key used for the benchmark.")
+    parser.add_argument("--requests", type=int, default=2000, help="Number of preference records to record.")
+    parser.add_argument("--concurrency", type=int, default=50, help="Concurrent requests in the burst.")
+    parser.add_argument("--batch_size", type=int, default=100, help="Records per pipelined flush.")
+    parser.add_argument("--flush_interval", type=float, default=0.05, help="Seconds between time-based flushes.")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,129 @@
+"""
+DPO 선호 데이터 저장소 처리량 벤치마크.
+
+로컬 Redis에서 벤치마크 전용 키(기본: bench:dpo:preference:*, bench:dpo:preferences)로 두 저장 형식을 비교합니다.
+종료 시 벤치마크 키와 임시 출력 디렉터리를 삭제합니다.
+  쓰기
+  - keys        : 레코드마다 개별 키에 SET (기존 /record_preference 방식)
+  - stream      : 레코드마다 XADD 한 번 (현재 /record_preference 방식)
+  - stream-pipe : XADD를 배치 파이프라인으로 (마이그레이션 방식)
+  읽기
+  - keys        : KEYS + 키마다 GET 한 번 (기존 run_dpo_training 방식), 파이썬 리스트에 모두 적재
+  - export      : 컨슈머 그룹으로 스트림 전체를 샤드 파일로 스트리밍 (export_dpo_dataset --full)
+  - resume      : 새 레코드(--new_records개)만 내보내는 증분 실행
+쓰기/읽기 처리량(records/s)과 tracemalloc 기준 최대 파이썬 메모리를 출력합니다.
+
+사용 예:
+    python scripts/benchmark_preference_store.py --records 50000 --batch_size 500
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+import redis
+
+from export_dpo_dataset import export_preferences
+from preference_store import append_preferences, encode_preference
+
+
+def _make_records(start: int, count: int):
+    for i in range(start, start + count):
+        yield {
+            "prompt": f"Given the experimental context, write the 'Method' section ... sample {i}",
+            "chosen": f"- Step {i}: centrifuge at 4,000 x g for 10 min",
+            "rejected": [f"- Step {i}: centrifuge", ""],
+        }
+
+
+def write_keys(r: redis.Redis, key_prefix: str, count: int) -> int:
+    for record in _make_records(0, count):
+        r.set(f"{key_prefix}{uuid.uuid4()}", json.dumps(record))
+    return count
+
+
+def write_stream(r: redis.Redis, stream: str, count: int) -> int:
+    for record in _make_records(0, count):
+        r.xadd(stream, encode_preference(record))
+    return count
+
+
+def read_keys(r: redis.Redis, key_prefix: str) -> int:
+    data = {"prompt": [], "chosen": [], "rejected": []}
+    for key in r.keys(f"{key_prefix}*"):
+        record = json.loads(r.get(key))
+        for rejected_item in record["rejected"]:
+            if rejected_item:
+                data["prompt"].append(record["prompt"])
+                data["chosen"].append(record["chosen"])
+                data["rejected"].append(rejected_item)
+    return len(data["prompt"])
+
+
+def _measure(fn):
+    tracemalloc.start()
+    started_at = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - started_at
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak / 1024 / 1024
+
+
+def _row(mode: str, records: int, seconds: float, peak: float):
+    print(f"{mode:<14} {records:>9} {seconds:>9.2f} {records / max(seconds, 1e-9):>11.0f} {peak:>9.1f}")
+
+
+def _cleanup(r: redis.Redis, args):
+    r.delete(args.stream, f"{args.stream}:pipe")
+    keys = list(r.scan_iter(match=f"{args.key_prefix}*", count=1000))
+    for i in range(0, len(keys), 1000):
+        r.delete(*keys[i:i + 1000])
+
+
+def main(args):
+    r = redis.Redis.from_url(args.redis_url, decode_responses=True)
+    r.ping()
+    output_dir = tempfile.mkdtemp(prefix="dpo_store_bench_")
+    _cleanup(r, args)
+    header = f"{'mode':<14} {'records':>9} {'seconds':>9} {'records/s':>11} {'peak MB':>9}"
+    try:
+        print(f"records: {args.records}  batch_size={args.batch_size}")
+        print(f"[write]\n{header}")
+        _row("keys", *_measure(lambda: write_keys(r, args.key_prefix, args.records)))
+        _row("stream", *_measure(lambda: write_stream(r, args.stream, args.records)))
+        _, seconds, peak = _measure(
+            lambda: append_preferences(r, _make_records(0, args.records), f"{args.stream}:pipe", args.batch_size)
+        )
+        _row("stream-pipe", args.records, seconds, peak)
+
+        def _export(full: bool):
+            report = export_preferences(r, output_dir, full=full, batch_size=args.batch_size,
+                                        stream=args.stream, group=args.group)
+            return report["exported"]
+
+        print(f"[read]\n{header}")
+        _, seconds, peak = _measure(lambda: read_keys(r, args.key_prefix))
+        _row("keys", args.records, seconds, peak)
+        _row("export", *_measure(lambda: _export(True)))
+        write_stream(r, args.stream, args.new_records)
+        _row("resume", *_measure(lambda: _export(False)))
+    finally:
+        _cleanup(r, args)
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark DPO preference storage (per-record keys vs Redis Stream).")
+    parser.add_argument("--redis_url", default=os.getenv("REDIS_URL", "redis://localhost:6379"), help="Local Redis URL.")
+    parser.add_argument("--key_prefix", default="bench:dpo:preference:", help="Key prefix for the per-record key layout.")
+    parser.add_argument("--stream", default="bench:dpo:preferences", help="Stream key for the stream layout.")
+    parser.add_argument("--group", default="bench-trainer", help="Consumer group used by the export runs.")
+    parser.add_argument("--records", type=int, default=20000, help="Number of records written per layout.")
+    parser.add_argument("--new_records", type=int, default=1000, help="Records appended before the incremental run.")
+    parser.add_argument("--batch_size", type=int, default=500, help="Records per pipelined round trip / XREADGROUP call.")
+    main(parser.parse_args())
@@ -0,0 +1,166 @@
+"""
+SOP 검색 품질/지연 오프라인 벤치마크.
+
+SOP 마크다운의 UO 제목(`### [UHW010 Liquid Handling] ...`)과 그 아래 섹션(Method, Reagent 등)으로
+평가 쿼리를 자동 생성합니다. 쿼리 문구는 agents._build_generation_prompt의 RAG 쿼리와 같은 형식입니다.
+검색된 청크가 같은 SOP 파일에서 나왔고 본문에 해당 UO ID가 있으면 정답으로 봅니다.
+
+비교하는 검색 구성:
+  - vector         : KNN만 (기존 방식)
+  - vector+uo      : KNN + UO ID 필터
+  - hybrid         : BM25 + KNN 점수 결합
+  - hybrid+uo      : BM25 + KNN + UO ID 필터
+  - hybrid+rerank  : BM25 + KNN 후보를 cross-encoder로 재정렬 (sentence-transformers 필요)
+지표: hit@k, MRR@k, precision@k, 쿼리당 지연 p50/p95 (검색 캐시는 끈 상태).
+
+벤치마크 전용 인덱스(기본: labnote_bench_quality_index)를 만들고 종료 시 삭제합니다.
+기본은 .env의 Ollama 임베딩 모델을 사용하며, --stub_embed를 주면 해시 기반 스텁 임베딩으로
+지연만 측정합니다(이 경우 벡터 검색의 품질 지표는 의미가 없습니다).
+
+사용 예:
+    python scripts/benchmark_retrieval_quality.py --k 3
+    python scripts/benchmark_retrieval_quality.py --stub_embed --configs vector hybrid
+"""
+import os
+import re
+import glob
+import time
+import asyncio
+import argparse
+import logging
+import statistics
+
+from bench_utils import BACKEND_DIR, start_fake_ollama_server
+
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+CONFIGS = {
+    "vector": {"mode": "vector"},
+    "vector+uo": {"mode": "vector", "filter_uo": True},
+    "hybrid": {"mode": "hybrid"},
+    "hybrid+uo": {"mode": "hybrid", "filter_uo": True},
+    "hybrid+rerank": {"mode": "hybrid", "rerank": True},
+}
+EVAL_SECTIONS = ("Method", "Reagent", "Consumables", "Equipment")
+UO_HEADING_PATTERN = re.compile(r"\[(U[A-Z]{1,3}\d{3})\s+([^\]]+)\]")
+WORKFLOW_HEADING_PATTERN = re.compile(r"\[(W[A-Z]\d{3})\s+[^\]]+\]\s*(.*)")
+
+
+def build_eval_set(sops_dir: str, min_chars: int):
+    """SOP 파일에서 (쿼리, 정답 source 파일명, UO ID) 목록을 만듭니다."""
+    from sop_loader import parse_sections
+
+    cases = []
+    for path in sorted(glob.glob(os.path.join(sops_dir, "**", "*.md"), recursive=True)):
+        with open(path, "r", encoding="utf-8") as f:
+            sections = parse_sections(f.read())
+        experiment = os.path.splitext(os.path.basename(path))[0]
+        for heading_path, body in sections:
+            # 워크플로우 제목(`## [WD070 ...] DmpR sensor design`)은 뒤따르는 UO 섹션들의 실험 설명으로 사용
+            match = WORKFLOW_HEADING_PATTERN.search(heading_path[-1]) if heading_path else None
+            if match and match.group(2):
+                experiment = match.group(2)
+            if len(heading_path) < 2 or heading_path[-1] not in EVAL_SECTIONS:
+                continue
+            uo_match = UO_HEADING_PATTERN.search(heading_path[-2])
+            if not uo_match or len(body.split("\n", 1)[-1].strip()) < min_chars:
+                continue
+            uo_id, uo_name = uo_match.group(1), uo_match.group(2).strip()
+            query = (
+                f"Find the specific procedure or list of items for the '{heading_path[-1]}' section of the unit "
+                f"operation '{uo_id}: {uo_name}' related to the experiment: {experiment}"
+            )
+            cases.append((query, os.path.basename(path), uo_id))
+    return cases
+
+
+def _is_relevant(doc, source_name: str, uo_id: str) -> bool:
+    return os.path.basename(str(doc.metadata.get("source", ""))) == source_name and uo_id in doc.page_content
+
+
+async def evaluate(pipeline, cases, config: dict, k: int):
+    hits, reciprocal_ranks, precisions, latencies = 0, [], [], []
+    for query, source_name, uo_id in cases:
+        options = {"mode": config["mode"], "rerank": config.get("rerank", False)}
+        if config.get("filter_uo"):
+            options["uo_id"] = uo_id
+        started_at = time.perf_counter()
+        docs = await pipeline.aretrieve_context(query, k=k, **options)
+        latencies.append(time.perf_counter() - started_at)
+
+        relevant = [_is_relevant(doc, source_name, uo_id) for doc in docs]
+        first_hit = next((rank for rank, is_hit in enumerate(relevant, 1) if is_hit), None)
+        hits += first_hit is not None
+        reciprocal_ranks.append(1.0 / first_hit if first_hit else 0.0)
+        precisions.append(sum(relevant) / k)
+
+    latencies.sort()
+    return {
+        "hit": hits / len(cases),
+        "mrr": statistics.mean(reciprocal_ranks),
+        "precision": statistics.mean(precisions),
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+    }
+
+
+async def main(args):
+    import redis
+    import redis.asyncio as aioredis
+    from rag_pipeline import get_rag_pipeline
+
+    cases = build_eval_set(os.environ["SOPS_DIRECTORY"], args.min_chars)
+    if not cases:
+        raise SystemExit("No evaluation queries could be derived from the SOP directory.")
+
+    # 환경 변수를 설정한 뒤 생성해야 벤치마크 인덱스를 사용합니다.
+    pipeline = get_rag_pipeline()
+    if not pipeline.vector_store:
+        raise SystemExit("Benchmark index could not be created (no SOP documents?).")
+    pool = aioredis.ConnectionPool.from_url(args.redis_url, decode_responses=True)
+    pipeline.configure_async_redis(pool)
+
+    try:
+        print(f"queries: {len(cases)}  k={args.k}  embeddings={'stub' if args.stub_embed else os.environ.get('EMBEDDING_MODEL')}")
+        print(f"{'config':<14} {'hit@k':>7} {'MRR@k':>7} {'P@k':>7} {'p50(ms)':>9} {'p95(ms)':>9}")
+        for name in args.configs:
+            # 첫 호출의 연결/모델 로딩 비용은 지연 통계에서 제외
+            await evaluate(pipeline, cases[:1], CONFIGS[name], args.k)
+            result = await evaluate(pipeline, cases, CONFIGS[name], args.k)
+            print(
+                f"{name:<14} {result['hit']:>7.3f} {result['mrr']:>7.3f} {result['precision']:>7.3f} "
+                f"{result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f}"
+            )
+    finally:
+        await pool.disconnect()
+        if not args.keep_index:
+            pipeline.vector_store.drop_index(pipeline.index_name, delete_documents=True, redis_url=args.redis_url)
+            # 증분 인덱서 매니페스트와 인덱스 버전 키도 정리
+            redis.Redis.from_url(args.redis_url).delete(pipeline.manifest_key, pipeline.retrieval_cache.version_key)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark SOP retrieval quality and latency (vector vs hybrid).")
+    parser.add_argument("--redis_url", default=os.getenv("REDIS_URL", "redis://localhost:6379"), help="Local Redis Stack URL.")
+    parser.add_argument("--index_name", default="labnote_bench_quality_index", help="Temporary index used for the benchmark.")
+    parser.add_argument("--sops_dir", default=os.path.join(BACKEND_DIR, "sops"), help="SOP markdown directory to index and query.")
+    parser.add_argument("--k", type=int, default=3, help="Number of chunks retrieved per query.")
+    parser.add_argument("--min_chars", type=int, default=40, help="Skip sections whose body is shorter than this.")
+    parser.add_argument("--configs", nargs="+", choices=list(CONFIGS), default=["vector", "vector+uo", "hybrid", "hybrid+uo"])
+    parser.add_argument("--stub_embed", action="store_true", help="Use a local hash-based stub embedding server.")
+    parser.add_argument("--port", type=int, default=11498, help="Port for the stub embedding server.")
+    parser.add_argument("--dim", type=int, default=768, help="Stub embedding dimension.")
+    parser.add_argument("--keep_index", action="store_true", help="Do not drop the benchmark index afterwards.")
+    cli_args = parser.parse_args()
+
+    os.environ.update({
+        "REDIS_URL": cli_args.redis_url,
+        "RAG_INDEX_NAME": cli_args.index_name,
+        "SOPS_DIRECTORY": cli_args.sops_dir,
+        "RAG_CACHE_ENABLED": "false",
+    })
+    if cli_args.stub_embed:
+        start_fake_ollama_server(cli_args.port, 0.0, cli_args.dim)
+        stub_url = f"http://127.0.0.1:{cli_args.port}"
+        os.environ.update({"OLLAMA_BASE_URL": stub_url, "OLLAMA_HOSTS": stub_url, "OLLAMA_MODEL_HOSTS": "", "EMBEDDING_MODEL": "stub-embed"})
+    asyncio.run(main(cli_args))
@@ -0,0 +1,79 @@
+"""
+SOP 로더/분할기 수집 벤치마크.
+
+`example/` 연구노트(기본) 마크다운을 --scale 배로 복제한 임시 코퍼스에서 두 방식을 비교합니다.
+  - unstructured : DirectoryLoader + UnstructuredMarkdownLoader + RecursiveCharacterTextSplitter (기존 방식)
+  - markdown     : sop_loader.MarkdownSOPSplitter (제목 기반 경량 로더)
+임포트 시간은 처리 시간과 별도로 표시합니다.
+
+사용 예:
+    python scripts/benchmark_sop_loader.py --scale 50
+    python scripts/benchmark_sop_loader.py --corpus sops --scale 10
+"""
+import os
+import glob
+import time
+import shutil
+import argparse
+import tempfile
+
+from bench_utils import BACKEND_DIR
+
+
+def build_corpus(source_dir: str, scale: int) -> str:
+    files = glob.glob(os.path.join(source_dir, "**", "*.md"), recursive=True)
+    if not files:
+        raise SystemExit(f"No markdown files found under '{source_dir}'.")
+    target_dir = tempfile.mkdtemp(prefix="sop_bench_")
+    for copy in range(scale):
+        for i, path in enumerate(files):
+            shutil.copyfile(path, os.path.join(target_dir, f"{copy:04d}_{i:03d}.md"))
+    return target_dir
+
+
+def run_unstructured(corpus_dir: str):
+    started_at = time.perf_counter()
+    from langchain_community.document_loaders import DirectoryLoader, UnstructuredMarkdownLoader
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    import_seconds = time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    loader = DirectoryLoader(corpus_dir, glob="**/*.md", loader_cls=UnstructuredMarkdownLoader, use_multithreading=True)
+    documents = loader.load()
+    # 첫 파일 파싱 시 unstructured가 지연 임포트하는 모듈 비용도 처리 시간에 포함됩니다.
+    chunks = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=200).split_documents(documents)
+    return import_seconds, time.perf_counter() - started_at, len(documents), len(chunks)
+
+
+def run_markdown(corpus_dir: str):
+    started_at = time.perf_counter()
+    from sop_loader import MarkdownSOPSplitter, load_markdown_file
+    import_seconds = time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    splitter = MarkdownSOPSplitter(chunk_size=2000, chunk_overlap=200)
+    paths = sorted(glob.glob(os.path.join(corpus_dir, "**", "*.md"), recursive=True))
+    chunks = [chunk for path in paths for chunk in load_markdown_file(path, splitter)]
+    return import_seconds, time.perf_counter() - started_at, len(paths), len(chunks)
+
+
+def main(args):
+    source_dir = os.path.abspath(os.path.join(BACKEND_DIR, args.corpus))
+    corpus_dir = build_corpus(source_dir, args.scale)
+    try:
+        print(f"corpus: {source_dir} x{args.scale}")
+        print(f"{'loader':<13} {'import(s)':>9} {'load+split(s)':>13} {'files':>6} {'chunks':>7} {'files/s':>9}")
+        runners = {"markdown": run_markdown, "unstructured": run_unstructured}
+        for name in args.loaders:
+            import_seconds, seconds, files, chunks = runners[name](corpus_dir)
+            print(f"{name:<13} {import_seconds:>9.3f} {seconds:>13.3f} {files:>6} {chunks:>7} {files / seconds:>9.1f}")
+    finally:
+        shutil.rmtree(corpus_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark SOP markdown loading and splitting.")
+    parser.add_argument("--corpus", default="../example", help="Directory (relative to the backend) with source markdown files.")
+    parser.add_argument("--scale", type=int, default=50, help="Number of times to replicate the corpus.")
+    parser.add_argument("--loaders", nargs="+", choices=["markdown", "unstructured"], default=["markdown", "unstructured"])
+    main(parser.parse_args())
@@ -0,0 +1,198 @@
+"""
+DPO 학습 전 선호 쌍(prompt, chosen, rejected) 압축.
+
+export_dpo_dataset이 만든 샤드의 레코드를 rejected 항목별 쌍으로 펼치면서 다음을 제거합니다.
+  - 빈 rejected (공백만 있는 경우 포함)
+  - chosen과 같은 rejected (정규화 후 동일, 선호 신호가 없음)
+  - 정확한 중복: 정규화(NFKC, 공백 정리, 대소문자 무시)한 prompt/chosen/rejected의 해시가 같은 쌍
+  - (선택) 근사 중복: --near_dup_threshold를 주면 MinHash + LSH로 Jaccard 유사도가 임계값 이상인 쌍을 하나로 묶습니다.
+    /record_preference는 원본 제안 전체를 prompt에 넣으므로, 같은 노트에서 반복된 수정이 거의 같은 쌍으로 쌓입니다.
+중복 묶음에서는 먼저 나온(더 오래된 샤드의) 쌍을 남깁니다. 결과는 data_dir의 `_compacted_pairs.jsonl`에,
+크기 감소 보고서는 `_compaction_report.json`에 씁니다. (list_shards의 part-* 패턴에는 포함되지 않습니다.)
+
+사용 예:
+    python scripts/compact_dpo_dataset.py --data_dir ./dpo_data
+    python scripts/compact_dpo_dataset.py --data_dir ./dpo_data --near_dup_threshold 0.9
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import argparse
+import logging
+import unicodedata
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from export_dpo_dataset import iter_shard_records, list_shards
+
+logger = logging.getLogger(__name__)
+
+COMPACTED_FILE = "_compacted_pairs.jsonl"
+REPORT_FILE = "_compaction_report.json"
+WHITESPACE_PATTERN = re.compile(r"\s+")
+WORD_PATTERN = re.compile(r"\w+")
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+
+def normalize_text(text) -> str:
+    """비교용 정규화: NFKC, 연속 공백을 한 칸으로, 앞뒤 공백 제거, 대소문자 무시."""
+    if text is None:
+        return ""
+    return WHITESPACE_PATTERN.sub(" ", unicodedata.normalize("NFKC", str(text))).strip().casefold()
+
+
+def pair_digest(prompt: str, chosen: str, rejected: str) -> bytes:
+    hasher = hashlib.blake2b(digest_size=16)
+    for part in (prompt, chosen, rejected):
+        hasher.update(part.encode("utf-8"))
+        hasher.update(b"\x00")
+    return hasher.digest()
+
+
+class MinHashDeduplicator:
+    """
+    단어 shingle의 MinHash 서명을 LSH 밴드로 나눠 근사 중복 후보를 찾고, 서명으로 추정한 Jaccard 유사도가
+    threshold 이상이면 중복으로 판단합니다. 남긴 쌍의 서명만 보관합니다. (numpy 필요: datasets 설치 시 함께 설치됨)
+    """
+
+    def __init__(self, threshold: float = 0.9, num_perm: int = 128, shingle_size: int = 3, seed: int = 1):
+        import numpy as np
+
+        self.np = np
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = self._optimal_bands(threshold, num_perm)
+        rng = np.random.RandomState(seed)
+        # a, b, h 모두 32비트 이하라서 a * h + b가 uint64를 넘지 않습니다.
+        self._a = rng.randint(1, MAX_HASH, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, MAX_HASH, size=num_perm, dtype=np.uint64)
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(self.bands)]
+        self._signatures: List = []
+
+    @staticmethod
+    def _optimal_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+        # 후보가 되는 유사도 경계 (1/b)^(1/r)이 임계값보다 조금 낮도록 골라, 놓치는 중복을 줄이고 후보는 서명으로 다시 확인합니다.
+        best = (num_perm, 1)
+        best_gap = float("inf")
+        for rows in range(1, num_perm + 1):
+            bands = num_perm // rows
+            gap = threshold - (1 / bands) ** (1 / rows)
+            if 0 <= gap < best_gap:
+                best, best_gap = (bands, rows), gap
+        return best
+
+    def signature(self, text: str):
+        np = self.np
+        words = WORD_PATTERN.findall(text)
+        shingles = {" ".join(words[i:i + self.shingle_size]) for i in range(max(1, len(words) - self.shingle_size + 1))}
+        hashes = np.array(
+            [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") for s in shingles],
+            dtype=np.uint64,
+        )
+        # 순열마다 (a * h + b) mod p 를 32비트로 자른 값의 최소값
+        permuted = (self._a[:, None] * hashes[None, :] + self._b[:, None]) % MERSENNE_PRIME & MAX_HASH
+        return permuted.min(axis=1)
+
+    def is_duplicate(self, text: str) -> bool:
+        """이미 남긴 쌍과 근사 중복이면 True, 아니면 서명을 등록하고 False."""
+        signature = self.signature(text)
+        band_keys = [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+        checked = set()
+        for band, key in enumerate(band_keys):
+            for index in self._buckets[band].get(key, ()):
+                if index in checked:
+                    continue
+                checked.add(index)
+                if float((self._signatures[index] == signature).mean()) >= self.threshold:
+                    return True
+        index = len(self._signatures)
+        self._signatures.append(signature)
+        for band, key in enumerate(band_keys):
+            self._buckets[band].setdefault(key, []).append(index)
+        return False
+
+
+def iter_compacted_pairs(records: Iterable[Dict], near_dup_threshold: Optional[float] = None, num_perm: int = 128,
+                         stats: Optional[Dict] = None) -> Iterator[Dict]:
+    """레코드를 (prompt, chosen, rejected) 쌍으로 펼치며 빈/동일/중복 쌍을 걸러 내보내는 제너레이터."""
+    stats = stats if stats is not None else {}
+    for field in ("records", "pairs_in", "empty_rejected", "rejected_equals_chosen", "exact_duplicates",
+                  "near_duplicates", "pairs_out"):
+        stats.setdefault(field, 0)
+    seen = set()
+    near_dedup = MinHashDeduplicator(near_dup_threshold, num_perm) if near_dup_threshold else None
+
+    for record in records:
+        stats["records"] += 1
+        prompt_key, chosen_key = normalize_text(record["prompt"]), normalize_text(record["chosen"])
+        for rejected in record["rejected"]:
+            stats["pairs_in"] += 1
+            rejected_key = normalize_text(rejected)
+            if not rejected_key:
+                stats["empty_rejected"] += 1
+                continue
+            if rejected_key == chosen_key:
+                stats["rejected_equals_chosen"] += 1
+                continue
+            digest = pair_digest(prompt_key, chosen_key, rejected_key)
+            if digest in seen:
+                stats["exact_duplicates"] += 1
+                continue
+            seen.add(digest)
+            if near_dedup is not None and near_dedup.is_duplicate(f"{prompt_key}\n{chosen_key}\n{rejected_key}"):
+                stats["near_duplicates"] += 1
+                continue
+            stats["pairs_out"] += 1
+            yield {"prompt": record["prompt"], "chosen": record["chosen"], "rejected": rejected}
+
+
+def compact_dpo_dataset(data_dir: str, near_dup_threshold: Optional[float] = None, num_perm: int = 128) -> Dict:
+    """
+    data_dir의 모든 샤드를 압축해 `_compacted_pairs.jsonl`로 쓰고 보고서를 반환합니다.
+    보고서: 레코드/쌍 수, 사유별 제거 수, 남은 쌍 수, 감소율(%), 출력 경로, 소요 시간
+    """
+    started_at = time.perf_counter()
+    shards = list_shards(data_dir)
+    output_path = os.path.join(data_dir, COMPACTED_FILE)
+    stats: Dict = {}
+    with open(f"{output_path}.tmp", "w", encoding="utf-8") as f:
+        for pair in iter_compacted_pairs(iter_shard_records(shards), near_dup_threshold, num_perm, stats):
+            f.write(json.dumps(pair, ensure_ascii=False) + "\n")
+    os.replace(f"{output_path}.tmp", output_path)
+
+    pairs_in = stats.get("pairs_in", 0)
+    report = {
+        "shards": len(shards),
+        **stats,
+        "reduction_percent": round(100 * (1 - stats.get("pairs_out", 0) / pairs_in), 1) if pairs_in else 0.0,
+        "near_dup_threshold": near_dup_threshold,
+        "output_path": output_path,
+        "seconds": round(time.perf_counter() - started_at, 3),
+    }
+    with open(os.path.join(data_dir, REPORT_FILE), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+
+def format_report(report: Dict) -> str:
+    return (
+        f"DPO compaction: {report.get('records', 0)} records -> {report.get('pairs_in', 0)} pairs -> "
+        f"{report.get('pairs_out', 0)} pairs ({report['reduction_percent']}% smaller). Dropped: "
+        f"{report.get('empty_rejected', 0)} empty rejected, {report.get('rejected_equals_chosen', 0)} rejected == chosen, "
+        f"{report.get('exact_duplicates', 0)} exact duplicates, {report.get('near_duplicates', 0)} near duplicates "
+        f"(threshold={report['near_dup_threshold']}) in {report['seconds']}s."
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Deduplicate and compact exported DPO preference pairs.")
+    parser.add_argument("--data_dir", default="./dpo_data", help="Directory with exported preference shards.")
+    parser.add_argument("--near_dup_threshold", type=float, default=None,
+                        help="Also drop near-duplicate pairs with estimated Jaccard similarity >= this (MinHash, e.g. 0.9).")
+    parser.add_argument("--num_perm", type=int, default=128, help="MinHash permutations for near-duplicate detection.")
+    cli_args = parser.parse_args()
+    logger.info(format_report(compact_dpo_dataset(cli_args.data_dir, cli_args.near_dup_threshold, cli_args.num_perm)))
@@ -0,0 +1,272 @@
+"""
+DPO 선호 데이터 스트리밍 내보내기.
+
+/record_preference가 쌓는 선호 데이터 스트림(preference_store)을 컨슈머 그룹으로 읽어
+샤드 파일(JSONL 또는 Parquet)에 바로 씁니다. 전체 레코드를 메모리에 모으지 않습니다.
+
+증분 내보내기:
+  컨슈머 그룹(DPO_CONSUMER_GROUP)이 마지막으로 전달한 항목 이후의 새 항목만 읽고, 샤드를 확정한 뒤 XACK 합니다.
+  샤드를 확정하기 전에 실패한 실행의 항목은 그룹의 보류(pending) 목록에 남아 다음 실행에서 먼저 다시 읽습니다.
+  --full은 기존 샤드를 지우고 그룹을 처음부터 다시 만들어 스트림 전체를 내보냅니다.
+  이전 형식(`dpo:preference:*` 개별 키) 데이터는 먼저 scripts/migrate_dpo_preferences.py로 스트림에 옮겨야 합니다.
+
+레코드 형식(샤드 한 줄/한 행): id(스트림 항목 ID), created_at(ms), prompt, chosen, rejected(list)
+
+사용 예:
+    python scripts/export_dpo_dataset.py --output_dir ./dpo_data
+    python scripts/export_dpo_dataset.py --output_dir ./dpo_data --full --format parquet
+"""
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+import logging
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import redis
+from dotenv import load_dotenv
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from preference_store import (  # noqa: E402
+    DPO_CONSUMER_GROUP, DPO_PREFERENCE_STREAM, ack, ensure_consumer_group, read_group, reset_consumer_group,
+)
+
+load_dotenv(dotenv_path='.env')
+logger = logging.getLogger(__name__)
+
+STATE_FILE = "_export_state.json"
+SHARD_PATTERN = "part-*.{ext}"
+FORMATS = {"jsonl": "jsonl", "parquet": "parquet"}
+EXPORT_CONSUMER = "exporter"
+
+
+def iter_group_records(r: redis.Redis, batch_size: int = 500, stream: str = DPO_PREFERENCE_STREAM,
+                       group: str = DPO_CONSUMER_GROUP, consumer: str = EXPORT_CONSUMER,
+                       delivered_ids: Optional[List[str]] = None, stats: Optional[Dict] = None) -> Iterator[Dict]:
+    """
+    컨슈머 그룹으로 항목을 batch_size개씩 읽어 올바른 레코드만 하나씩 내보내는 제너레이터.
+    이전 실행에서 받고 ACK하지 못한 항목을 먼저 읽고, 그다음 새 항목을 읽습니다.
+    읽은 항목 ID(형식이 잘못된 항목 포함)는 delivered_ids에 모아, 호출자가 샤드를 확정한 뒤 ACK 합니다.
+    """
+    pending_after = "0"
+    while True:
+        entries = read_group(r, consumer, batch_size, stream, group, pending_after=pending_after)
+        if not entries:
+            if pending_after is None:
+                return
+            pending_after = None  # 보류 항목을 모두 읽었으니 새 항목으로 넘어갑니다.
+            continue
+        if pending_after is not None:
+            pending_after = entries[-1][0]
+        for entry_id, record in entries:
+            if delivered_ids is not None:
+                delivered_ids.append(entry_id)
+            if stats is not None:
+                stats["read"] += 1
+            if record is None:
+                logger.warning(f"Skipping malformed preference entry: {entry_id}")
+                if stats is not None:
+                    stats["malformed"] += 1
+                continue
+            yield record
+
+
+class ShardWriter:
+    """
+    레코드를 shard_size개 단위 파일로 씁니다. 파일은 '.tmp'로 쓰고 commit()에서 최종 이름으로 바꾸므로,
+    중간에 실패한 실행의 샤드가 데이터셋에 섞이지 않습니다.
+    """
+
+    def __init__(self, output_dir: str, run_id: str, shard_size: int, fmt: str = "jsonl"):
+        self.output_dir = output_dir
+        self.run_id = run_id
+        self.shard_size = shard_size
+        self.fmt = fmt
+        self.records = 0
+        self._paths: List[str] = []
+        self._rows: List[Dict] = []
+        self._file = None
+        self._rows_in_shard = 0
+
+    def _next_path(self) -> str:
+        path = os.path.join(self.output_dir, f"part-{self.run_id}-{len(self._paths):05d}.{FORMATS[self.fmt]}.tmp")
+        self._paths.append(path)
+        return path
+
+    def write(self, record: Dict):
+        if self.fmt == "jsonl":
+            if self._file is None:
+                self._file = open(self._next_path(), "w", encoding="utf-8")
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._rows_in_shard += 1
+            if self._rows_in_shard >= self.shard_size:
+                self._close_jsonl()
+        else:
+            self._rows.append(record)
+            if len(self._rows) >= self.shard_size:
+                self._flush_parquet()
+        self.records += 1
+
+    def _close_jsonl(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._rows_in_shard = 0
+
+    def _flush_parquet(self):
+        if not self._rows:
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        pq.write_table(pa.Table.from_pylist(self._rows), self._next_path())
+        self._rows = []
+
+    def commit(self) -> List[str]:
+        self._close_jsonl()
+        self._flush_parquet()
+        final_paths = []
+        for path in self._paths:
+            final_path = path[:-len(".tmp")]
+            os.replace(path, final_path)
+            final_paths.append(final_path)
+        return final_paths
+
+    def abort(self):
+        self._close_jsonl()
+        for path in self._paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _load_state(output_dir: str) -> Dict:
+    path = os.path.join(output_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_state(output_dir: str, state: Dict):
+    path = os.path.join(output_dir, STATE_FILE)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def list_shards(output_dir: str) -> List[str]:
+    """내보낸 샤드 파일 목록 (실행 순서대로)."""
+    paths = []
+    for ext in FORMATS.values():
+        paths.extend(glob.glob(os.path.join(output_dir, SHARD_PATTERN.format(ext=ext))))
+    return sorted(paths)
+
+
+def iter_exported_records(output_dir: str) -> Iterator[Dict]:
+    """출력 디렉터리의 모든 샤드 레코드를 하나씩 읽는 제너레이터."""
+    return iter_shard_records(list_shards(output_dir))
+
+
+def iter_shard_records(paths: Iterable[str]) -> Iterator[Dict]:
+    """샤드 파일의 레코드를 하나씩 읽는 제너레이터. (Parquet은 행 그룹 단위로 읽습니다.)"""
+    for path in paths:
+        if path.endswith(".jsonl"):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+        else:
+            import pyarrow.parquet as pq
+            for batch in pq.ParquetFile(path).iter_batches():
+                yield from batch.to_pylist()
+
+
+def export_preferences(r: redis.Redis, output_dir: str, full: bool = False, fmt: str = "jsonl",
+                       shard_size: int = 10000, batch_size: int = 500, stream: str = DPO_PREFERENCE_STREAM,
+                       group: str = DPO_CONSUMER_GROUP) -> Dict:
+    """
+    새 선호 데이터를 샤드로 내보내고 그룹에 ACK 합니다. full=True면 기존 샤드를 지우고 스트림 전체를 다시 내보냅니다.
+    반환값: 읽은/내보낸/건너뛴 레코드 수, 새 샤드, 마지막 항목 ID, 소요 시간을 담은 보고서
+    """
+    started_at = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    for leftover in glob.glob(os.path.join(output_dir, "part-*.tmp")):
+        os.remove(leftover)
+    if full:
+        for path in list_shards(output_dir):
+            os.remove(path)
+        state = {}
+        reset_consumer_group(r, stream, group)
+    else:
+        state = _load_state(output_dir)
+        ensure_consumer_group(r, stream, group)
+
+    stats = {"read": 0, "malformed": 0}
+    delivered_ids: List[str] = []
+    # 실행 번호를 샤드 이름에 넣어 실행 순서대로 정렬되고, 같은 초에 여러 번 실행해도 덮어쓰지 않게 합니다.
+    run_number = state.get("runs", 0) + 1
+    run_id = f"{run_number:06d}"
+    writer = ShardWriter(output_dir, run_id, shard_size, fmt)
+
+    try:
+        for record in iter_group_records(r, batch_size, stream, group, delivered_ids=delivered_ids, stats=stats):
+            writer.write(record)
+        shards = writer.commit()
+    except BaseException:
+        writer.abort()
+        raise
+    # 샤드가 확정된 뒤에만 ACK 하므로, 여기서 실패해도 항목은 다음 실행에서 다시 내보내집니다. (중복 가능, 유실 없음)
+    ack(r, delivered_ids, stream, group)
+
+    state.update({
+        "stream": stream,
+        "last_id": delivered_ids[-1] if delivered_ids else state.get("last_id"),
+        "records": state.get("records", 0) + writer.records,
+        "format": fmt,
+        "runs": run_number,
+        "last_run_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    })
+    _save_state(output_dir, state)
+    return {
+        "read": stats["read"],
+        "exported": writer.records,
+        "malformed": stats["malformed"],
+        "new_shards": shards,
+        "total_records": state["records"],
+        "last_id": state["last_id"],
+        "seconds": round(time.perf_counter() - started_at, 3),
+    }
+
+
+def main(args):
+    redis_url = args.redis_url
+    if not redis_url:
+        raise ValueError("REDIS_URL environment variable is not set.")
+    r = redis.Redis.from_url(redis_url, decode_responses=True)
+    report = export_preferences(
+        r, args.output_dir, full=args.full, fmt=args.format, shard_size=args.shard_size,
+        batch_size=args.batch_size, stream=args.stream,
+    )
+    logger.info(
+        f"Exported {report['exported']} new preference records ({report['malformed']} malformed skipped) "
+        f"into {len(report['new_shards'])} shard(s) in {report['seconds']}s. "
+        f"Dataset now has {report['total_records']} records."
+    )
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Export DPO preference records from the Redis stream into sharded files.")
+    parser.add_argument("--redis_url", default=os.getenv("REDIS_URL"), help="Redis URL (default: REDIS_URL).")
+    parser.add_argument("--output_dir", default="./dpo_data", help="Directory for shards and the export state file.")
+    parser.add_argument("--stream", default=DPO_PREFERENCE_STREAM, help="Preference stream key.")
+    parser.add_argument("--format", choices=list(FORMATS), default="jsonl", help="Shard file format (parquet needs pyarrow).")
+    parser.add_argument("--shard_size", type=int, default=10000, help="Records per shard file.")
+    parser.add_argument("--batch_size", type=int, default=500, help="Entries read per XREADGROUP call.")
+    parser.add_argument("--full", action="store_true", help="Drop existing shards, reset the consumer group and export everything.")
+    main(parser.parse_args())
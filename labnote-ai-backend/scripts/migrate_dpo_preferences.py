@@ -0,0 +1,163 @@
+"""
+이전 형식의 DPO 선호 데이터(`dpo:preference:*` 개별 키)를 선호 데이터 스트림으로 옮깁니다. (preference_store 참고)
+
+- 키는 KEYS 대신 SCAN으로 찾고, 값은 배치 단위 파이프라인으로 읽습니다. 문자열 JSON(SET)과 RedisJSON(JSON.SET) 모두 지원합니다.
+- 키 이름의 생성 시각(`dpo:preference:<13자리 ms>-<uuid>`) 순으로 추가하며, 원래 키는 레코드의 source_key에 남깁니다.
+- 이미 옮긴 키(source_key가 스트림에 있는 키)는 건너뛰므로 여러 번 실행해도 중복되지 않습니다.
+- --delete를 주면 스트림에 추가된 배치의 원래 키를 바로 삭제합니다.
+
+사용 예:
+    python scripts/migrate_dpo_preferences.py --dry_run
+    python scripts/migrate_dpo_preferences.py --delete
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import logging
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import redis
+from dotenv import load_dotenv
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from preference_store import (  # noqa: E402
+    DPO_PREFERENCE_STREAM, LEGACY_KEY_PREFIX, RECORD_FIELD, append_preferences, is_valid_record, iter_stream_entries,
+)
+
+load_dotenv(dotenv_path='.env')
+logger = logging.getLogger(__name__)
+
+
+def key_timestamp(key: str, key_prefix: str = LEGACY_KEY_PREFIX) -> Optional[int]:
+    match = re.match(rf"{re.escape(key_prefix)}(\d{{13}})-", key)
+    return int(match.group(1)) if match else None
+
+
+def _batched(items: Iterable, size: int) -> Iterator[List]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def fetch_records(r: redis.Redis, keys: List[str]) -> List[Optional[Dict]]:
+    """키 배치의 값을 파이프라인 한 번(RedisJSON 키가 섞여 있으면 두 번)으로 읽습니다. 읽지 못한 키는 None."""
+    pipe = r.pipeline(transaction=False)
+    for key in keys:
+        pipe.get(key)
+    values = pipe.execute(raise_on_error=False)
+
+    # JSON.SET으로 저장된 키는 GET이 WRONGTYPE 오류를 내므로 JSON.GET으로 다시 읽습니다.
+    json_positions = [i for i, value in enumerate(values) if isinstance(value, redis.ResponseError)]
+    if json_positions:
+        pipe = r.pipeline(transaction=False)
+        for i in json_positions:
+            pipe.execute_command("JSON.GET", keys[i])
+        for i, value in zip(json_positions, pipe.execute(raise_on_error=False)):
+            values[i] = value
+
+    records = []
+    for value in values:
+        if value is None or isinstance(value, Exception):
+            records.append(None)
+            continue
+        try:
+            records.append(json.loads(value))
+        except (TypeError, ValueError):
+            records.append(None)
+    return records
+
+
+def migrated_source_keys(r: redis.Redis, stream: str = DPO_PREFERENCE_STREAM) -> set:
+    """스트림에 이미 옮겨진 원래 키 목록."""
+    source_keys = set()
+    for _, fields in iter_stream_entries(r, stream, count=1000):
+        try:
+            source_key = json.loads(fields.get(RECORD_FIELD) or "{}").get("source_key")
+        except (TypeError, ValueError, AttributeError):
+            continue
+        if source_key:
+            source_keys.add(source_key)
+    return source_keys
+
+
+def migrate_preferences(r: redis.Redis, stream: str = DPO_PREFERENCE_STREAM, key_prefix: str = LEGACY_KEY_PREFIX,
+                        batch_size: int = 500, scan_count: int = 1000, delete: bool = False,
+                        dry_run: bool = False) -> Dict:
+    """이전 형식 키를 스트림으로 옮기고 스캔/이동/건너뜀/삭제 수와 소요 시간을 담은 보고서를 반환합니다."""
+    started_at = time.perf_counter()
+    already_migrated = migrated_source_keys(r, stream)
+    # SCAN은 리해싱 중 같은 키를 두 번 돌려줄 수 있으므로 집합으로 모아 한 실행에서 중복 XADD가 없게 합니다.
+    keys = set(r.scan_iter(match=f"{key_prefix}*", count=scan_count))
+    report = {"scanned_keys": len(keys), "migrated": 0, "already_migrated": 0, "malformed": 0, "deleted": 0}
+    pending = [key for key in keys if key not in already_migrated]
+    report["already_migrated"] = len(keys) - len(pending)
+    # 시각이 없는 UUID 키(가장 오래된 형식)를 먼저, 나머지는 생성 시각 순으로 추가합니다.
+    pending.sort(key=lambda key: (key_timestamp(key, key_prefix) or 0, key))
+
+    for batch in _batched(pending, batch_size):
+        records = []
+        for key, record in zip(batch, fetch_records(r, batch)):
+            if not is_valid_record(record):
+                logger.warning(f"Skipping malformed data at key: {key}")
+                report["malformed"] += 1
+                continue
+            record["created_at"] = record.get("created_at") or key_timestamp(key, key_prefix)
+            if record["created_at"] is None:
+                del record["created_at"]
+            record["source_key"] = key
+            records.append(record)
+        if dry_run:
+            report["migrated"] += len(records)
+            continue
+        append_preferences(r, records, stream, batch_size)
+        report["migrated"] += len(records)
+        if delete and records:
+            report["deleted"] += r.delete(*(record["source_key"] for record in records))
+
+    if delete and not dry_run and already_migrated:
+        # 이전 실행에서 옮겼지만 아직 남아 있는 키도 정리합니다.
+        leftovers = sorted(keys & already_migrated)
+        for batch in _batched(leftovers, batch_size):
+            report["deleted"] += r.delete(*batch)
+    report["seconds"] = round(time.perf_counter() - started_at, 3)
+    return report
+
+
+def main(args):
+    if not args.redis_url:
+        raise ValueError("REDIS_URL environment variable is not set.")
+    r = redis.Redis.from_url(args.redis_url, decode_responses=True)
+    report = migrate_preferences(
+        r, stream=args.stream, key_prefix=args.key_prefix, batch_size=args.batch_size,
+        scan_count=args.scan_count, delete=args.delete, dry_run=args.dry_run,
+    )
+    logger.info(
+        f"{'[dry run] ' if args.dry_run else ''}Migrated {report['migrated']} of {report['scanned_keys']} legacy keys "
+        f"into '{args.stream}' ({report['already_migrated']} already migrated, {report['malformed']} malformed, "
+        f"{report['deleted']} deleted) in {report['seconds']}s."
+    )
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Migrate legacy dpo:preference:* keys into the preference stream.")
+    parser.add_argument("--redis_url", default=os.getenv("REDIS_URL"), help="Redis URL (default: REDIS_URL).")
+    parser.add_argument("--stream", default=DPO_PREFERENCE_STREAM, help="Target preference stream key.")
+    parser.add_argument("--key_prefix", default=LEGACY_KEY_PREFIX, help="Prefix of the legacy per-record keys.")
+    parser.add_argument("--batch_size", type=int, default=500, help="Keys read and appended per pipelined round trip.")
+    parser.add_argument("--scan_count", type=int, default=1000, help="COUNT hint for each SCAN call.")
+    parser.add_argument("--delete", action="store_true", help="Delete legacy keys once they are in the stream.")
+    parser.add_argument("--dry_run", action="store_true", help="Only count what would be migrated.")
+    main(parser.parse_args())
@@ -4,8 +4,11 @@ import redis
 import argparse
 from dotenv import load_dotenv
 from datasets import Dataset
-from transformers import AutoModelForCausalLM, AutoTokenizer, TrainingArguments
-from trl import DPOTrainer
+from transformers import AutoModelForCausalLM, AutoTokenizer
+from trl import DPOConfig, DPOTrainer
+
+from export_dpo_dataset import export_preferences, iter_shard_records, list_shards
+from compact_dpo_dataset import compact_dpo_dataset, format_report
 
 # --- 초기 설정 ---
 # .env 파일이 스크립트와 동일한 디렉토리에 있으므로 경로를 수정합니다.
@@ -17,85 +20,147 @@ logger = logging.getLogger(__name__)
 REDIS_URL = os.getenv("REDIS_URL")
 BASE_MODEL_PATH = os.getenv("BASE_MODEL_PATH")
 NEW_MODEL_NAME = os.getenv("NEW_MODEL_NAME", "biollama3-v2-dpo")
-DPO_KEY_PREFIX = "dpo:preference:"
+DPO_DATA_DIR = os.getenv("DPO_DATA_DIR", "./dpo_data")
+LENGTH_COLUMN = "length"
 
-def fetch_dpo_data_from_redis() -> Dataset:
+def iter_dpo_pairs(shards):
     """
-    Redis에서 'dpo:preference:*' 패턴의 모든 키를 읽어와 Hugging Face Dataset으로 변환합니다.
+    샤드의 레코드를 (prompt, chosen, rejected) 행으로 내보냅니다.
     하나의 'chosen'과 여러 개의 'rejected' 항목이 있을 경우, 여러 개의 데이터 포인트로 확장합니다.
     """
-    logger.info(f"Connecting to Redis at {REDIS_URL}...")
-    if not REDIS_URL:
-        raise ValueError("REDIS_URL environment variable is not set.")
+    for record in iter_shard_records(shards):
+        for rejected_item in record["rejected"]:
+            if rejected_item: # 비어있지 않은 경우에만 추가
+                yield {"prompt": record["prompt"], "chosen": record["chosen"], "rejected": rejected_item}
 
-    r = redis.Redis.from_url(REDIS_URL, decode_responses=True)
-    r.ping()
-    
-    logger.info("Fetching DPO preference data from Redis...")
-    keys = r.keys(f"{DPO_KEY_PREFIX}*")
-    
-    if not keys:
-        logger.warning("No DPO data found in Redis. Exiting.")
+def fetch_dpo_data_from_redis(data_dir: str, full_export: bool = False, skip_export: bool = False,
+                              compaction: bool = True, near_dup_threshold: float = None) -> Dataset:
+    """
+    Redis 선호 데이터 스트림의 새 항목을 data_dir의 샤드 파일로 증분 내보낸 뒤(컨슈머 그룹, export_dpo_dataset 참고),
+    누적된 전체 샤드를 스트리밍으로 읽어 Hugging Face Dataset으로 변환합니다.
+    compaction이면 빈/중복 쌍을 걸러낸 뒤(compact_dpo_dataset 참고) 크기 감소 보고서를 남기고 학습에 사용합니다.
+    """
+    if not skip_export:
+        logger.info(f"Connecting to Redis at {REDIS_URL}...")
+        if not REDIS_URL:
+            raise ValueError("REDIS_URL environment variable is not set.")
+        r = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+        r.ping()
+
+        logger.info("Exporting new DPO preference data from Redis...")
+        report = export_preferences(r, data_dir, full=full_export)
+        logger.info(f"Exported {report['exported']} new records ({report['malformed']} malformed skipped) in {report['seconds']}s.")
+
+    shards = list_shards(data_dir)
+    if not shards:
+        logger.warning("No DPO data found. Exiting.")
         return Dataset.from_dict({"prompt": [], "chosen": [], "rejected": []})
 
-    data = {"prompt": [], "chosen": [], "rejected": []}
-    
-    for key in keys:
-        try:
-            pref_data = r.json().get(key)
-            
-            if isinstance(pref_data, dict) and "prompt" in pref_data and "chosen" in pref_data and "rejected" in pref_data:
-                prompt = pref_data["prompt"]
-                chosen = pref_data["chosen"]
-                
-                # 각 rejected 항목에 대해 별도의 데이터 포인트를 생성합니다.
-                if isinstance(pref_data["rejected"], list):
-                    for rejected_item in pref_data["rejected"]:
-                        if rejected_item: # 비어있지 않은 경우에만 추가
-                            data["prompt"].append(prompt)
-                            data["chosen"].append(chosen)
-                            data["rejected"].append(rejected_item)
-            else:
-                logger.warning(f"Skipping malformed data at key: {key}")
-
-        except Exception as e:
-            logger.error(f"Failed to process key {key}: {e}")
-
-    logger.info(f"Successfully fetched and processed {len(keys)} records into {len(data['prompt'])} training examples.")
-    return Dataset.from_dict(data)
+    if compaction:
+        report = compact_dpo_dataset(data_dir, near_dup_threshold)
+        logger.info(format_report(report))
+        # from_json도 파일을 Arrow 캐시에 순차 기록하므로 전체 쌍을 파이썬 리스트로 모으지 않습니다.
+        if not report["pairs_out"]:
+            logger.warning("No DPO pairs left after compaction. Exiting.")
+            return Dataset.from_dict({"prompt": [], "chosen": [], "rejected": []})
+        dataset = Dataset.from_json(report["output_path"])
+    else:
+        # from_generator는 행을 Arrow 캐시 파일에 순차 기록하므로 전체 레코드를 파이썬 리스트로 모으지 않습니다.
+        # 샤드 목록이 캐시 키에 포함되므로, 새 샤드가 생기면 데이터셋을 다시 만듭니다.
+        dataset = Dataset.from_generator(iter_dpo_pairs, gen_kwargs={"shards": shards})
+    logger.info(f"Loaded {len(dataset)} training examples from {len(shards)} shard(s) in {data_dir}.")
+    return dataset
 
-def main(args):
+def load_model_and_tokenizer(args):
     """
-    DPO 학습 파이프라인 메인 함수
+    베이스 모델과 토크나이저를 불러옵니다.
+    GPU가 없으면 float32로 불러오며(CPU는 fp16 학습을 지원하지 않음), --load_in_8bit은 CUDA와 bitsandbytes가 있을 때만 적용됩니다.
     """
-    # 1. 데이터 로드
-    dpo_dataset = fetch_dpo_data_from_redis()
-    if len(dpo_dataset) == 0:
-        return
+    import torch
 
-    # 2. 모델 및 토크나이저 로드
-    logger.info(f"Loading base model and tokenizer from: {BASE_MODEL_PATH}")
-    if not BASE_MODEL_PATH or not os.path.exists(BASE_MODEL_PATH):
-        logger.error(f"BASE_MODEL_PATH ('{BASE_MODEL_PATH}') is not set or does not exist. Please check your .env file and setup.sh script.")
-        return
-        
-    model = AutoModelForCausalLM.from_pretrained(BASE_MODEL_PATH, low_cpu_mem_usage=True, torch_dtype="auto")
-    tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL_PATH)
-    
+    use_cuda = torch.cuda.is_available()
+    model_kwargs = {"low_cpu_mem_usage": True, "dtype": "auto" if use_cuda else torch.float32}
+    if args.load_in_8bit:
+        try:
+            import bitsandbytes  # noqa: F401
+            bnb_available = True
+        except ImportError:
+            bnb_available = False
+        if use_cuda and bnb_available:
+            from transformers import BitsAndBytesConfig
+            model_kwargs["quantization_config"] = BitsAndBytesConfig(load_in_8bit=True)
+        else:
+            logger.warning("--load_in_8bit needs CUDA and bitsandbytes; loading the model without quantization.")
+
+    model = AutoModelForCausalLM.from_pretrained(args.base_model, **model_kwargs)
+    tokenizer = AutoTokenizer.from_pretrained(args.base_model)
     if tokenizer.pad_token is None:
         tokenizer.pad_token = tokenizer.eos_token
+    if "quantization_config" in model_kwargs:
+        from peft import prepare_model_for_kbit_training
+        model = prepare_model_for_kbit_training(model, use_gradient_checkpointing=args.gradient_checkpointing)
+    return model, tokenizer, use_cuda
+
+def build_peft_config(args):
+    """--lora가 켜져 있으면 LoRA 어댑터 설정을 반환합니다. 기본 대상은 출력층을 제외한 모든 Linear 층입니다."""
+    if not args.lora:
+        return None
+    from peft import LoraConfig
+
+    target_modules = args.lora_target_modules
+    if target_modules != "all-linear":
+        target_modules = [name.strip() for name in target_modules.split(",") if name.strip()]
+    return LoraConfig(
+        r=args.lora_r,
+        lora_alpha=args.lora_alpha,
+        lora_dropout=args.lora_dropout,
+        target_modules=target_modules,
+        bias="none",
+        task_type="CAUSAL_LM",
+    )
+
+def add_length_column(dataset: Dataset, max_length: int) -> Dataset:
+    """
+    길이 기준 버킷팅용으로, DPOTrainer가 토큰화한 쌍마다 prompt + 긴 쪽 응답의 토큰 수(max_length로 제한)를 계산합니다.
+    LengthGroupedSampler가 이 값으로 비슷한 길이의 쌍을 같은 배치에 모아 패딩을 줄입니다.
+    """
+    def _lengths(batch):
+        return {LENGTH_COLUMN: [
+            min(max_length, len(p) + max(len(c), len(r)))
+            for p, c, r in zip(batch["prompt_ids"], batch["chosen_ids"], batch["rejected_ids"])
+        ]}
+    return dataset.map(_lengths, batched=True, desc="Computing pair lengths")
 
-    # 3. DPOTrainer 설정 (CLI 인자 사용)
-    training_args = TrainingArguments(
+def build_trainer(dpo_dataset: Dataset, args, callbacks=None) -> DPOTrainer:
+    """
+    학습 설정과 DPOTrainer를 만듭니다. (main과 scripts/benchmark_dpo_training.py가 함께 사용)
+    메모리 절약 옵션: --lora(어댑터만 학습, 참조 모델은 어댑터를 끈 같은 모델을 사용), --load_in_8bit,
+    --gradient_checkpointing, --max_length(prompt+응답 토큰 상한), --group_by_length(비슷한 길이끼리 배치해 패딩 감소)
+    """
+    if args.load_in_8bit and not args.lora:
+        raise ValueError("--load_in_8bit freezes the quantized base weights, so it requires --lora.")
+    model, tokenizer, use_cuda = load_model_and_tokenizer(args)
+
+    # paged_adamw_32bit는 CUDA + bitsandbytes 전용이므로 CPU에서는 torch 기본 AdamW를 사용합니다.
+    optim = args.optim or ("paged_adamw_32bit" if use_cuda else "adamw_torch")
+    training_args = DPOConfig(
         per_device_train_batch_size=args.batch_size,
         gradient_accumulation_steps=args.grad_acc_steps,
         max_steps=args.max_steps,
         learning_rate=args.learning_rate,
         lr_scheduler_type="cosine",
         output_dir=args.output_dir, # CLI 인자 사용
-        optim="paged_adamw_32bit",
+        optim=optim,
+        beta=0.1,
+        max_length=args.max_length,
+        gradient_checkpointing=args.gradient_checkpointing,
+        train_sampling_strategy="group_by_length" if args.group_by_length else "random",
+        length_column_name=LENGTH_COLUMN,
+        # DPO collator는 *_ids 열만 읽으므로, 버킷팅용 length 열이 샘플러에 전달되도록 나머지 열을 지우지 않습니다.
+        remove_unused_columns=False,
+        use_cpu=not use_cuda,
         logging_steps=10,
-        save_steps=50,
+        save_steps=args.save_steps,
         report_to="none",
     )
 
@@ -103,26 +168,56 @@ def main(args):
         model,
         ref_model=None,
         args=training_args,
-        beta=0.1,
         train_dataset=dpo_dataset,
-        tokenizer=tokenizer,
+        processing_class=tokenizer,
+        peft_config=build_peft_config(args),
+        callbacks=callbacks,
     )
+    if args.group_by_length:
+        dpo_trainer.train_dataset = add_length_column(dpo_trainer.train_dataset, args.max_length)
+    return dpo_trainer
+
+def save_trained_model(dpo_trainer: DPOTrainer, args):
+    """LoRA 학습이면 기본적으로 어댑터를 베이스 모델에 병합해 저장합니다. (deploy_model.sh의 GGUF 변환은 전체 모델이 필요)"""
+    if args.lora and not args.no_merge_adapter:
+        merged_model = dpo_trainer.model.merge_and_unload()
+        merged_model.save_pretrained(args.output_dir)
+        dpo_trainer.processing_class.save_pretrained(args.output_dir)
+    else:
+        dpo_trainer.save_model(args.output_dir)
+
+def main(args):
+    """
+    DPO 학습 파이프라인 메인 함수
+    """
+    # 1. 데이터 로드
+    dpo_dataset = fetch_dpo_data_from_redis(args.data_dir, args.full_export, args.skip_export,
+                                            not args.no_compaction, args.near_dup_threshold)
+    if len(dpo_dataset) == 0:
+        return
+
+    # 2. 모델, 토크나이저, DPOTrainer 설정 (CLI 인자 사용)
+    logger.info(f"Loading base model and tokenizer from: {args.base_model}")
+    if not args.base_model or not os.path.exists(args.base_model):
+        logger.error(f"BASE_MODEL_PATH ('{args.base_model}') is not set or does not exist. Please check your .env file and setup.sh script.")
+        return
+    dpo_trainer = build_trainer(dpo_dataset, args)
 
-    # 4. 학습 실행
+    # 3. 학습 실행
     logger.info("Starting DPO training...")
     dpo_trainer.train()
     logger.info("DPO training completed.")
 
-    # 5. 모델 저장
+    # 4. 모델 저장
     logger.info(f"Saving trained model to {args.output_dir}")
-    dpo_trainer.save_model(args.output_dir)
+    save_trained_model(dpo_trainer, args)
     
     logger.info("--- DPO Training Pipeline Finished ---")
     logger.info(f"To use the new model with Ollama, you might need to convert it to GGUF and create a new Modelfile.")
     logger.info(f"Example: ollama create {NEW_MODEL_NAME} -f {args.output_dir}/Modelfile")
 
 
-if __name__ == "__main__":
+def build_arg_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="Run DPO training pipeline.")
     
     # 하이퍼파라미터 인자 추가
@@ -130,14 +225,40 @@ if __name__ == "__main__":
     parser.add_argument("--learning_rate", type=float, default=5e-5, help="Learning rate for the optimizer.")
     parser.add_argument("--batch_size", type=int, default=1, help="Batch size per device for training.")
     parser.add_argument("--grad_acc_steps", type=int, default=4, help="Gradient accumulation steps.")
-    
+    parser.add_argument("--save_steps", type=int, default=50, help="Save a checkpoint every N steps.")
+    parser.add_argument("--optim", type=str, default=None,
+                        help="Optimizer (default: paged_adamw_32bit on CUDA, adamw_torch on CPU).")
+
+    # 메모리 절약 옵션 (CPU 전용 빌드 머신용)
+    parser.add_argument("--max_length", type=int, default=1024, help="Max prompt + response tokens per pair; longer pairs are truncated.")
+    parser.add_argument("--lora", action="store_true", help="Train LoRA adapters instead of all weights.")
+    parser.add_argument("--lora_r", type=int, default=16, help="LoRA rank.")
+    parser.add_argument("--lora_alpha", type=int, default=32, help="LoRA alpha.")
+    parser.add_argument("--lora_dropout", type=float, default=0.05, help="LoRA dropout.")
+    parser.add_argument("--lora_target_modules", type=str, default="all-linear",
+                        help="Comma-separated module names for LoRA, or 'all-linear'.")
+    parser.add_argument("--no_merge_adapter", action="store_true", help="With --lora, save only the adapter instead of a merged model.")
+    parser.add_argument("--load_in_8bit", action="store_true", help="Load the base model in 8-bit (needs CUDA and bitsandbytes).")
+    parser.add_argument("--gradient_checkpointing", action="store_true", help="Recompute activations in backward to save memory.")
+    parser.add_argument("--group_by_length", action="store_true", help="Batch pairs of similar length together to reduce padding.")
+
     # 경로 인자 추가
+    parser.add_argument("--base_model", type=str, default=BASE_MODEL_PATH, help="Base model directory (default: BASE_MODEL_PATH).")
+    parser.add_argument("--data_dir", type=str, default=DPO_DATA_DIR, help="Directory with exported preference shards.")
+    parser.add_argument("--full_export", action="store_true", help="Re-export all preferences instead of only new ones.")
+    parser.add_argument("--skip_export", action="store_true", help="Train on existing shards without reading Redis.")
+    parser.add_argument("--no_compaction", action="store_true", help="Train on every exported pair without deduplication.")
+    parser.add_argument("--near_dup_threshold", type=float, default=None,
+                        help="Also drop near-duplicate pairs at this MinHash Jaccard similarity (e.g. 0.9).")
     parser.add_argument(
         "--output_dir", 
         type=str, 
         default=f"./{NEW_MODEL_NAME}", 
         help="Directory to save the trained model."
     )
-    
-    cli_args = parser.parse_args()
+    return parser
+
+
+if __name__ == "__main__":
+    cli_args = build_arg_parser().parse_args()
     main(cli_args)
@@ -0,0 +1,100 @@
+import re
+from typing import List, Tuple
+
+from langchain_core.documents import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+# 로더/분할 방식이 바뀌면 이 값을 올립니다. 증분 인덱서가 파일 해시에 포함하므로 모든 SOP가 다시 임베딩됩니다.
+LOADER_SIGNATURE = "markdown-headings-v1"
+
+HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+FENCE_PATTERN = re.compile(r"^\s*(```|~~~)")
+FRONT_MATTER_PATTERN = re.compile(r"\A---\n.*?\n---\n", re.DOTALL)
+
+
+def _clean_heading(text: str) -> str:
+    # SOP 파일의 '### \[UHW010 Liquid Handling\]' 같은 이스케이프를 제거
+    return text.replace("\\[", "[").replace("\\]", "]").strip()
+
+
+def parse_sections(text: str) -> List[Tuple[List[str], str]]:
+    """
+    마크다운을 제목 단위 섹션으로 나눕니다. 코드 블록 안의 '#'은 제목으로 취급하지 않습니다.
+    반환값: [(제목 경로, 섹션 본문(제목 줄 포함)), ...]
+    """
+    sections = []
+    heading_stack: List[Tuple[int, str]] = []
+    current_path: List[str] = []
+    current_lines: List[str] = []
+    in_code_block = False
+
+    for line in text.splitlines():
+        if FENCE_PATTERN.match(line):
+            in_code_block = not in_code_block
+        match = None if in_code_block else HEADING_PATTERN.match(line)
+        if match:
+            if any(l.strip() for l in current_lines):
+                sections.append((current_path, "\n".join(current_lines).strip()))
+            level, title = len(match.group(1)), _clean_heading(match.group(2))
+            while heading_stack and heading_stack[-1][0] >= level:
+                heading_stack.pop()
+            heading_stack.append((level, title))
+            current_path = [title for _, title in heading_stack]
+            current_lines = [line]
+        else:
+            current_lines.append(line)
+
+    if any(l.strip() for l in current_lines):
+        sections.append((current_path, "\n".join(current_lines).strip()))
+    return sections
+
+
+class MarkdownSOPSplitter:
+    """
+    제목 구조를 따라 SOP 마크다운을 청크로 나누는 경량 분할기.
+    - 짧은 인접 섹션은 chunk_size를 넘지 않는 범위에서 하나의 청크로 합칩니다.
+    - chunk_size보다 긴 섹션만 문자 기반 분할기로 다시 나눕니다.
+    - 각 청크의 metadata에 'source'와 첫 섹션의 제목 경로('heading_path')를 기록합니다.
+    """
+
+    def __init__(self, chunk_size: int = 2000, chunk_overlap: int = 200):
+        self.chunk_size = chunk_size
+        self.fallback_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+    def split_text(self, text: str, source: str) -> List[Document]:
+        text = FRONT_MATTER_PATTERN.sub("", text, count=1)
+        chunks: List[Document] = []
+        buffer: List[str] = []
+        buffer_path: List[str] = []
+        buffer_len = 0
+
+        def flush():
+            nonlocal buffer, buffer_len
+            if buffer:
+                chunks.append(self._make_document("\n\n".join(buffer), source, buffer_path))
+            buffer, buffer_len = [], 0
+
+        for path, body in parse_sections(text):
+            if len(body) > self.chunk_size:
+                flush()
+                for piece in self.fallback_splitter.split_text(body):
+                    chunks.append(self._make_document(piece, source, path))
+                continue
+            if buffer and buffer_len + len(body) + 2 > self.chunk_size:
+                flush()
+            if not buffer:
+                buffer_path = path
+            buffer.append(body)
+            buffer_len += len(body) + 2
+        flush()
+        return chunks
+
+    @staticmethod
+    def _make_document(content: str, source: str, path: List[str]) -> Document:
+        return Document(page_content=content, metadata={"source": source, "heading_path": " > ".join(path)})
+
+
+def load_markdown_file(path: str, splitter: MarkdownSOPSplitter) -> List[Document]:
+    """SOP 마크다운 파일 하나를 읽어 제목 기반 청크 목록으로 반환합니다."""
+    with open(path, "r", encoding="utf-8") as f:
+        return splitter.split_text(f.read(), source=path)